@@ -2,28 +2,24 @@
 """
     Main Python script to configure and start the app.
 
-    Checks if the database exists.
-    If not, then creates a new databse and populate it with test data.
+    The database is the one configured in the environment (see
+    sportsbazar/config.py), the sportsbazar.db SQLite file by default.
+    Checks if its tables exist.
+    If not, then creates a new databse and populate it with test data,
+    else upgrades its tables and indexes to the current schema.
 """
 
 
-import os.path
 import random
 import string
 from sportsbazar import app
-from sportsbazar.db_setup import db_create
+from sportsbazar.db_connect import get_engine
+from sportsbazar.db_setup import db_create, db_migrate
 from sportsbazar.db_populate import db_populate
 
 
-# Constants for - DB, Admin
-DB_URL = "sqlite:///sportsbazar.db?check_same_thread=False"
-
-# END Constants
-
-
 if __name__ == "__main__":
     # App configuration
-    app.config['DB_URL'] = "sqlite:///sportsbazar.db?check_same_thread=False"
     app.config['ENV'] = "development"
     # Secret key to secure session and cookies
     #secret_key = "".join(random.choice(string.ascii_uppercase + string.digits)
@@ -31,16 +27,17 @@ if __name__ == "__main__":
     #app.secret_key = secret_key
     app.secret_key = 'super_secret_key'
 
-    # Credentials of admin
-    app.config['ADMIN_ID'] = 2
-    app.config['ADMIN_NAME'] = "Abdullah A. Salman"
-    app.config['ADMIN_EMAIL'] = "abdullahahmadsalman22@gmail.com"
-
-    if app.config['DB_URL'] == "sqlite:///sportsbazar.db"\
-            "?check_same_thread=False":
-        if os.path.isfile('sportsbazar.db') is False:
-            db_create(app.config['DB_URL'])
-            db_populate()
+    # Credentials of admin, unless set in the environment
+    if app.config['ADMIN_EMAIL'] is None:
+        app.config['ADMIN_ID'] = 2
+        app.config['ADMIN_NAME'] = "Abdullah A. Salman"
+        app.config['ADMIN_EMAIL'] = "abdullahahmadsalman22@gmail.com"
+
+    if not get_engine().has_table('item'):
+        db_create(app.config['DB_URL'])
+        db_populate()
+    else:
+        db_migrate(app.config['DB_URL'])
 
     app.debug = True
     app.run(host='0.0.0.0', port=5000)
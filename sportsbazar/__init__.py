@@ -3,10 +3,25 @@
 """
 
 from flask import Flask
+from sportsbazar.config import load_config
 
 # Initialise the Flask app object
 app = Flask(__name__)
+# Defaults, settings file and environment variables (see config.py); may
+# still be overridden before the first request.
+load_config(app.config)
 
+import sportsbazar.db_connect
+import sportsbazar.cache
+import sportsbazar.sessions
+import sportsbazar.identity
+import sportsbazar.instrumentation
+import sportsbazar.metrics
+import sportsbazar.slow_queries
+import sportsbazar.compression
+import sportsbazar.assets
 import sportsbazar.views
 import sportsbazar.json_endpoints
+import sportsbazar.search
+import sportsbazar.item_transfer
 import sportsbazar.auth
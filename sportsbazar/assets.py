@@ -0,0 +1,146 @@
+"""
+    Fingerprinted and precompressed static files.
+
+    The build step copies every file of the static folder to static/build/
+    under a name holding a hash of its content (css/styles.css becomes
+    build/css/styles.<hash>.css). Next to the text files it writes a gzip
+    version and, when the brotli package is installed, a Brotli one. All of
+    them are listed in static/build/manifest.json. Files from earlier
+    builds are kept, so pages rendered before a deploy still load.
+
+    When the manifest exists, url_for('static', filename=...) returns the
+    fingerprinted URLs. They are served in the best precompressed version
+    the client accepts and cached by browsers for a year as immutable: a
+    changed file gets a new URL. Other static files are served as before.
+    The manifest is read when the app starts.
+
+    Usage (from the project root, after changing a static file):
+        python -m sportsbazar.assets
+"""
+
+
+import hashlib
+import json
+import mimetypes
+import os
+from flask import send_from_directory
+from sportsbazar import app
+from sportsbazar.compression import brotli, compress, negotiate
+
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+# Extensions of the files worth precompressing.
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.html')
+# Extension of the precompressed file for each encoding.
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+# A year, the longest lifetime browsers honour.
+IMMUTABLE_MAX_AGE = 31536000
+
+_manifest = {}
+# Entries of the manifest by fingerprinted path.
+_built = {}
+
+
+def build(static_folder):
+    """
+        Fingerprints and precompresses the files of static_folder.
+
+        Returns:
+            The manifest, a dict of {filename: {'path', 'encodings'}}.
+    """
+    build_folder = os.path.join(static_folder, BUILD_DIR)
+    manifest = {}
+    for directory, subdirectories, filenames in os.walk(static_folder):
+        if directory == static_folder and BUILD_DIR in subdirectories:
+            subdirectories.remove(BUILD_DIR)
+        for filename in filenames:
+            source = os.path.join(directory, filename)
+            name = os.path.relpath(source, static_folder).replace(
+                os.sep, '/')
+            with open(source, 'rb') as content:
+                data = content.read()
+            root, extension = os.path.splitext(name)
+            path = '%s.%s%s' % (root, hashlib.md5(data).hexdigest()[:12],
+                                extension)
+            target = os.path.join(build_folder, *path.split('/'))
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            _write(target, data)
+
+            encodings = []
+            if extension.lower() in COMPRESSIBLE:
+                candidates = [('gzip', 9)]
+                if brotli is not None:
+                    candidates.insert(0, ('br', 11))
+                for encoding, level in candidates:
+                    compressed = compress(data, encoding, level)
+                    if len(compressed) < len(data):
+                        _write(target + SUFFIXES[encoding], compressed)
+                        encodings.append(encoding)
+            manifest[name] = {'path': BUILD_DIR + '/' + path,
+                              'encodings': encodings}
+            print '%s -> %s %s' % (name, path, ' '.join(encodings))
+
+    with open(os.path.join(build_folder, MANIFEST), 'w') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    return manifest
+
+
+def _write(path, data):
+    with open(path + '.tmp', 'wb') as output:
+        output.write(data)
+    os.rename(path + '.tmp', path)
+
+
+def load_manifest():
+    """
+        Reads the manifest of the last build, if any.
+    """
+    path = os.path.join(app.static_folder, BUILD_DIR, MANIFEST)
+    manifest = {}
+    if os.path.isfile(path):
+        with open(path) as source:
+            manifest = json.load(source)
+    _manifest.clear()
+    _manifest.update(manifest)
+    _built.clear()
+    _built.update((entry['path'], entry) for entry in manifest.values())
+
+
+@app.url_defaults
+def fingerprintStaticUrl(endpoint, values):
+    if endpoint == 'static' and app.config['STATIC_FINGERPRINT']:
+        entry = _manifest.get(values.get('filename'))
+        if entry is not None:
+            values['filename'] = entry['path']
+
+
+def sendStaticFile(filename):
+    """
+        Serves a static file, with far-future caching and the best
+        precompressed version for fingerprinted ones.
+    """
+    entry = _built.get(filename)
+    if entry is None:
+        return app.send_static_file(filename)
+    encoding = negotiate(entry['encodings'])
+    response = send_from_directory(
+        app.static_folder, filename + SUFFIXES.get(encoding, ''),
+        mimetype=mimetypes.guess_type(filename)[0],
+        cache_timeout=IMMUTABLE_MAX_AGE)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    if entry['encodings']:
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = \
+        'public, max-age=%d, immutable' % IMMUTABLE_MAX_AGE
+    return response
+
+
+app.view_functions['static'] = sendStaticFile
+load_manifest()
+
+
+if __name__ == '__main__':
+    build(app.static_folder)
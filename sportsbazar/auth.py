@@ -6,11 +6,10 @@
 import random
 import string
 from flask import render_template, request, redirect, url_for, flash
-from oauth2client.client import flow_from_clientsecrets
+from oauth2client import crypt
 from oauth2client.client import FlowExchangeError
 from flask import session as login_session
 from sqlalchemy.orm.exc import NoResultFound
-import httplib2
 import json
 from flask import make_response
 import requests
@@ -18,10 +17,13 @@ import requests
 from sportsbazar import app
 from sportsbazar.db_setup import User, Category
 from sportsbazar.db_connect import db_connect
+from sportsbazar.cache import cached, get_user_cache
+from sportsbazar.google_oauth import clientSecrets, exchangeCode
+from sportsbazar.google_oauth import verifyIdToken, tokenInfo, userInfo
+from sportsbazar.google_oauth import revokeToken
+from sportsbazar.sessions import renewSession
 
 
-CLIENT_ID = json.loads(
-    open('g_client_secrets.json', 'r').read())['web']['client_id']
 APPLICATION_NAME = "SPORTS BAZAR"
 
 
@@ -51,46 +53,60 @@ def gconnect():
 
     try:
         # Upgrade the authorization one-time code into a credentials object
-        oauth_flow = flow_from_clientsecrets('g_client_secrets.json',
-                                             scope='email profile')
-        oauth_flow.redirect_uri = 'postmessage'
-        credentials = oauth_flow.step2_exchange(code)
+        credentials = exchangeCode(code)
     except FlowExchangeError:
         response = make_response(
             json.dumps('Failed to upgrade the authorization code.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
 
-    # Check that the access token is valid.
-    access_token = credentials.access_token
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-           % access_token)
-    http = httplib2.Http()
-    result = json.loads(http.request(url, 'GET')[1])
-
-    # If there was an error in the access token info, abort.
-    if result.get('error') is not None:
-        response = make_response(json.dumps(result.get('error')), 500)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-
-    # Verify that the access token is used for the intended user.
-    gplus_id = credentials.id_token['sub']
-    if result['user_id'] != gplus_id:
-        response = make_response(
-            json.dumps("Token's user ID doesn't match given user ID."), 401)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-
-    # Verify that the access token is valid for this app.
-    g_client_id = json.loads(
-        open('g_client_secrets.json', 'r').read())['web']['client_id']
-    if result['issued_to'] != g_client_id:
-        response = make_response(
-            json.dumps("Token's client ID doesn't match app's."), 401)
-        print "Token's client ID doesn't match app's."
-        response.headers['Content-Type'] = 'application/json'
-        return response
+    # Verify the signed ID token locally, which proves the token was
+    # issued to this app for this user.
+    claims = None
+    id_token = credentials.token_response.get('id_token')
+    if app.config['GOOGLE_VERIFY_ID_TOKEN'] and id_token:
+        try:
+            claims = verifyIdToken(id_token)
+        except crypt.AppIdentityError as error:
+            app.logger.warning('Invalid ID token: %s', error)
+            response = make_response(json.dumps('Invalid ID token.'), 401)
+            response.headers['Content-Type'] = 'application/json'
+            return response
+        except (requests.RequestException, ValueError):
+            # Certs unavailable, ask Google about the access token instead.
+            pass
+
+    if claims is not None:
+        gplus_id = claims['sub']
+    else:
+        # Check that the access token is valid.
+        try:
+            result = tokenInfo(credentials.access_token)
+        except (requests.RequestException, ValueError):
+            result = {'error': 'Failed to reach Google.'}
+
+        # If there was an error in the access token info, abort.
+        if result.get('error') is not None:
+            response = make_response(json.dumps(result.get('error')), 500)
+            response.headers['Content-Type'] = 'application/json'
+            return response
+
+        # Verify that the access token is used for the intended user.
+        gplus_id = credentials.id_token['sub']
+        if result['user_id'] != gplus_id:
+            response = make_response(
+                json.dumps("Token's user ID doesn't match given user ID."),
+                401)
+            response.headers['Content-Type'] = 'application/json'
+            return response
+
+        # Verify that the access token is valid for this app.
+        if result['issued_to'] != clientSecrets()['client_id']:
+            response = make_response(
+                json.dumps("Token's client ID doesn't match app's."), 401)
+            app.logger.warning("Token's client ID doesn't match app's.")
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
     # Check to see if user is already logged in.
     stored_access_token = login_session.get('access_token')
@@ -101,16 +117,26 @@ def gconnect():
         response.headers['Content-Type'] = 'application/json'
         return response
 
+    # Log in under a new session id, not the one handed out before.
+    renewSession()
+
     # Store the access token in the session for later use.
     login_session['provider'] = 'google'
     login_session['access_token'] = credentials.access_token
     login_session['gplus_id'] = gplus_id
 
-    # Get user info
-    userinfo_url = "https://www.googleapis.com/oauth2/v2/userinfo"
-    params = {'access_token': credentials.access_token, 'alt': 'json'}
-    answer = requests.get(userinfo_url, params=params)
-    data = json.loads(answer.text)
+    # Get user info, from the verified ID token when it has it all
+    if claims is not None and all(
+            claims.get(key) for key in ('name', 'picture', 'email')):
+        data = claims
+    else:
+        try:
+            data = userInfo(credentials.access_token)
+        except (requests.RequestException, ValueError):
+            response = make_response(
+                json.dumps('Failed to get the user info.'), 500)
+            response.headers['Content-Type'] = 'application/json'
+            return response
 
     login_session['username'] = data["name"]
     login_session['picture'] = data["picture"]
@@ -132,7 +158,7 @@ def gconnect():
     output += login_session['username']
     output += '</h4></div></div>'
     flash("You are now logged in as %s" % login_session['username'])
-    print "done!"
+    app.logger.info('User %d logged in with Google.', userId)
     return output
 
 
@@ -145,11 +171,7 @@ def gdisconnect():
             json.dumps('Current user not connected.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
-    url = ('https://accounts.google.com/o/oauth2/revoke?token=%s'
-           % login_session['access_token'])
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[0]
-    if result['status'] == '200':
+    if revokeToken(access_token) == 200:
         response = make_response(json.dumps('Successfully disconnected.'), 200)
         response.headers['Content-Type'] = 'application/json'
         return response
@@ -192,12 +214,13 @@ def createNewUser():
     session = db_connect()
     session.add(newUser)
     session.commit()
-    user = session.query(User).filter_by(email=login_session['email']).one()
-    session.close()
-    return user.id
+    # Replace any stale entry of the email -> id map (see getUserId).
+    get_user_cache().set('user_id:%s' % newUser.email, newUser.id)
+    return newUser.id
 
 
 def getUserInfo(user_id):
+    session = db_connect()
     user = session.query(User).filter_by(id=user_id).one()
     return user
 
@@ -212,11 +235,11 @@ def getUserId(email):
     Returns:
         The user id number stored in the database.
     """
-    session = db_connect()
-    try:
-        user = session.query(User).filter_by(email=email).one()
-        session.close()
-        return user.id
-    except NoResultFound:
-        session.close()
-        return None
+    def load():
+        session = db_connect()
+        try:
+            user = session.query(User).filter_by(email=email).one()
+            return user.id
+        except NoResultFound:
+            return None
+    return cached('user_id:%s' % email, load, get_user_cache())
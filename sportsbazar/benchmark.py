@@ -0,0 +1,497 @@
+"""
+    Benchmark of the app's routes.
+
+    Seeds a synthetic catalog in a scratch database, then drives the real
+    routes - either through the Flask test client or over a real socket
+    with keep-alive HTTP - and reports per route: latency percentiles,
+    requests per second, SQL statements per request and response size,
+    along with the peak RSS of the process, and the time spent loading and
+    saving the login session with each session store (see sessions.py).
+    The JSON report can be saved and diffed between commits.
+
+    With --concurrency N, N threads then send a mix of item page reads and
+    new item writes over the socket for --duration seconds, and the read
+    and write throughput and errors are reported. --sqlite-defaults turns
+    off the SQLite pragmas and the single writer lock, for comparison.
+    --accept-encoding gzip (or br) measures compressed responses, the
+    sizes reported are then the bytes sent on the wire.
+
+    Usage (from the project root, next to g_client_secrets.json):
+        python -m sportsbazar.benchmark --items 10000 --output bench.json
+        python -m sportsbazar.benchmark --concurrency 16 --requests 1
+"""
+
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import requests
+from flask import url_for
+from sqlalchemy import event, func
+from werkzeug.serving import make_server, WSGIRequestHandler
+from werkzeug.test import EnvironBuilder
+
+from sportsbazar import app
+from sportsbazar.db_setup import Category, Item
+from sportsbazar.db_connect import db_connect, get_engine, dispose_engine
+from sportsbazar.db_generate import generate
+
+
+# First synthetic user, used for the stubbed login session.
+BENCH_EMAIL = 'user1@sportsbazar.test'
+
+
+def samples(count=10, seed_value=0):
+    """
+        Returns (category_name, item_name) pairs of random existing items.
+    """
+    rand = random.Random(seed_value)
+    session = db_connect()
+    last_id = session.query(func.max(Item.id)).scalar()
+    ids = [rand.randint(1, last_id) for i in xrange(count)]
+    rows = session.query(Category.name, Item.name).join(
+        Item, Item.category_id == Category.id).filter(Item.id.in_(ids)).all()
+    session.close()
+    return rows
+
+
+def percentile(values, fraction):
+    """
+        Returns the value below which the given fraction of values fall.
+    """
+    values = sorted(values)
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+
+class QueryCounter(object):
+    """
+        Counts the SQL statements executed by the engine.
+    """
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._executed)
+
+    def _executed(self, *args):
+        self.count += 1
+
+
+class TestClientDriver(object):
+    """
+        Sends requests through the Flask test client.
+    """
+
+    def __init__(self, accept_encoding='identity'):
+        self.client = app.test_client()
+        self.headers = {'Accept-Encoding': accept_encoding}
+
+    def login(self):
+        with self.client.session_transaction() as login_session:
+            login_session.update(stubSession())
+
+    def request(self, method, url, data=None):
+        response = self.client.open(url, method=method, data=data,
+                                    headers=self.headers)
+        return response.status_code, len(response.get_data())
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """
+        Request handler that does not log every request to stderr.
+    """
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class SocketDriver(object):
+    """
+        Serves the app on a local socket and sends requests to it with a
+        keep-alive HTTP session.
+    """
+
+    def __init__(self, accept_encoding='identity'):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True,
+                                  request_handler=QuietRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://127.0.0.1:%d' % self.server.server_port
+        self.http = requests.Session()
+        self.http.headers['Accept-Encoding'] = accept_encoding
+
+    def login(self, http=None):
+        (http or self.http).cookies.set(
+            app.session_cookie_name,
+            app.session_interface.createSession(app, stubSession()))
+
+    def request(self, method, url, data=None):
+        response = self.http.request(method, self.base + url, data=data,
+                                     allow_redirects=False, stream=True)
+        # Bytes as sent on the wire, before requests decompresses them.
+        return response.status_code, len(
+            response.raw.read(decode_content=False))
+
+    def close(self):
+        self.server.shutdown()
+
+
+def stubSession():
+    """
+        Returns the login session of the benchmark user, as set by gconnect.
+    """
+    return {'username': 'Synthetic User 1', 'email': BENCH_EMAIL,
+            'user_id': 1,
+            'provider': 'google', 'picture': '', 'access_token': 'bench',
+            'gplus_id': 'bench'}
+
+
+def measure(driver, counter, name, calls):
+    """
+        Runs the given (method, url, data) calls and summarises them.
+    """
+    latencies = []
+    queries = 0
+    size = 0
+    statuses = {}
+    started = time.time()
+    for method, url, data in calls:
+        counter.count = 0
+        start = time.time()
+        status, length = driver.request(method, url, data)
+        latencies.append((time.time() - start) * 1000.0)
+        queries += counter.count
+        size += length
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    elapsed = time.time() - started
+    result = {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'queries_per_request': round(float(queries) / len(latencies), 2),
+        'bytes_per_request': size // len(latencies),
+        'status': statuses,
+    }
+    print '%-14s %8.2f %8.2f %8.2f %10.1f %8.2f %10d' % (
+        name, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+        result['requests_per_sec'], result['queries_per_request'],
+        result['bytes_per_request'])
+    return result
+
+
+def sessionOverhead(count, stores=('cookie', 'memory', 'sql', 'redis')):
+    """
+        Measures the time spent loading and saving the login session of a
+        request with each session store, for requests that only read the
+        session and requests that change it (e.g. a flash message).
+
+        Returns:
+            {store: {'read_us', 'write_us', 'cookie_bytes'}}, without the
+            stores that can't be used here (redis without CACHE_REDIS_URL
+            or SESSION_REDIS_URL).
+    """
+    interface = app.session_interface
+    saved_store = app.config['SESSION_STORE']
+    results = {}
+    try:
+        for store in stores:
+            if store == 'redis' and not (app.config['SESSION_REDIS_URL'] or
+                                         app.config['CACHE_REDIS_URL']):
+                continue
+            app.config['SESSION_STORE'] = store
+            cookie = interface.createSession(app, stubSession())
+            environ = EnvironBuilder('/', headers={'Cookie': '%s=%s' % (
+                app.session_cookie_name, cookie)}).get_environ()
+            result = {'cookie_bytes': len(cookie)}
+            for kind in ('read', 'write'):
+                start = time.time()
+                for i in xrange(count):
+                    session = interface.open_session(
+                        app, app.request_class(environ))
+                    'username' in session
+                    if kind == 'write':
+                        session['_flashes'] = [('message', 'Hi %d' % i)]
+                    interface.save_session(app, session,
+                                           app.response_class())
+                result[kind + '_us'] = (time.time() - start) * 1e6 / count
+            results[store] = result
+            print '%-14s %8.1f %8.1f %8d' % (
+                'session:' + store, result['read_us'], result['write_us'],
+                result['cookie_bytes'])
+    finally:
+        app.config['SESSION_STORE'] = saved_store
+    return results
+
+
+def summarize(latencies, elapsed, errors):
+    """
+        Returns the throughput and latency percentiles of a list of
+        latencies (ms) measured over elapsed seconds.
+    """
+    if not latencies:
+        return {'requests': 0, 'errors': errors}
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+    }
+
+
+def concurrent(driver, samples, threads, duration, write_ratio):
+    """
+        Sends item page reads and new item writes from several threads at
+        once.
+
+        Args:
+            driver (SocketDriver): Server to send the requests to.
+            samples: (category_name, item_name) pairs of existing items.
+            threads (int): Number of concurrent clients.
+            duration (float): Seconds to run for.
+            write_ratio (float): Fraction of the requests that are writes.
+
+        Returns:
+            A dict with the summary of the reads and of the writes. A write
+            is an error unless it redirects to the category page.
+    """
+    token = '%x' % random.getrandbits(32)
+    category = samples[0][0]
+    latencies = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    deadline = time.time() + duration
+
+    def client(index):
+        http = requests.Session()
+        driver.login(http)
+        rand = random.Random(index)
+        count = 0
+        while time.time() < deadline:
+            if rand.random() < write_ratio:
+                kind = 'write'
+                count += 1
+                start = time.time()
+                response = http.post(
+                    driver.base + '/catalog/%s/new' % category,
+                    data={'name': 'Load %s %d %d' % (token, index, count),
+                          'description': 'Load test item', 'price': '10',
+                          'quantity': '1'},
+                    allow_redirects=False)
+                failed = response.status_code != 302 or \
+                    response.headers['Location'].endswith('/new')
+            else:
+                kind = 'read'
+                start = time.time()
+                response = http.get(driver.base + '/catalog/%s/%s/' %
+                                    rand.choice(samples))
+                failed = response.status_code != 200
+            latencies[kind].append((time.time() - start) * 1000.0)
+            if failed:
+                errors[kind] += 1
+
+    started = time.time()
+    workers = [threading.Thread(target=client, args=(index,))
+               for index in xrange(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - started
+
+    result = dict((kind, summarize(latencies[kind], elapsed, errors[kind]))
+                  for kind in ('read', 'write'))
+    for kind in ('read', 'write'):
+        print '%-6s %8d requests %10.1f req/s p50 %8.2f ms p99 %8.2f ms ' \
+            '%6d errors' % (
+                kind, result[kind]['requests'],
+                result[kind].get('requests_per_sec', 0),
+                result[kind].get('p50_ms', 0), result[kind].get('p99_ms', 0),
+                result[kind]['errors'])
+    return result
+
+
+def routes(samples, count):
+    """
+        Returns the (name, calls) of every benchmarked route.
+
+        Args:
+            samples: (category_name, item_name) pairs of existing items.
+            count (int): Number of calls to each route.
+    """
+    def cycle(urls):
+        return [('GET', urls[i % len(urls)], None) for i in xrange(count)]
+
+    token = '%x' % random.getrandbits(32)
+    new_names = ['Bench %s %d' % (token, i) for i in xrange(count)]
+    category = samples[0][0]
+    with app.test_request_context():
+        css = url_for('static', filename='css/bootstrap.min.css')
+        js = url_for('static', filename='js/bootstrap.min.js')
+    return [
+        ('homepage', cycle(['/'])),
+        ('showItems', cycle(['/catalog/%s/' % c for c, i in samples])),
+        ('showItem', cycle(['/catalog/%s/%s/' % sample
+                            for sample in samples])),
+        ('showMyItems', cycle(['/catalog/myitems/'])),
+        ('categoryJSON', cycle(['/catalog.json'])),
+        ('itemJSON', cycle(['/catalog/%s/%s/JSON' % sample
+                            for sample in samples])),
+        ('newItem', [('POST', '/catalog/%s/new' % category,
+                      {'name': name, 'description': 'Benchmark item',
+                       'price': '10', 'quantity': '1'})
+                     for name in new_names]),
+        ('editItem', [('POST', '/catalog/%s/%s/edit' % (category, name),
+                       {'name': name, 'description': 'Edited',
+                        'price': '11', 'quantity': '2'})
+                      for name in new_names]),
+        ('deleteItem', [('POST', '/catalog/%s/%s/delete' % (category, name),
+                         None) for name in new_names]),
+        ('staticCss', cycle([css])),
+        ('staticJs', cycle([js])),
+    ]
+
+
+def run(items, categories, users, count, socket=False, json_count=None,
+        concurrency=0, duration=10.0, write_ratio=0.2,
+        sqlite_defaults=False, accept_encoding='identity'):
+    """
+        Seeds a scratch database and benchmarks every route.
+
+        Args:
+            items (int): Number of synthetic items.
+            categories (int): Number of synthetic categories.
+            users (int): Number of synthetic users owning the items.
+            count (int): Requests sent to each route.
+            socket (bool): Go through a real socket instead of the test
+                client.
+            json_count (int): Requests sent to the full catalog dump,
+                which is much slower on large catalogs (default: count).
+            concurrency (int): Number of threads of the concurrent load
+                test run after the routes, 0 to skip it. Implies socket.
+            duration (float): Seconds the concurrent load test runs for.
+            write_ratio (float): Fraction of writes in the load test.
+            sqlite_defaults (bool): Run without the SQLite pragmas and the
+                single writer lock.
+            accept_encoding (str): Accept-Encoding header of the requests,
+                e.g. 'gzip' or 'br, gzip' to measure compressed responses.
+
+        Returns:
+            The report as a dict.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        db_url = 'sqlite:///%s' % os.path.join(directory, 'bench.db')
+        dispose_engine()
+        app.config['DB_URL'] = db_url
+        app.config['ADMIN_ID'] = 1
+        app.config['ADMIN_EMAIL'] = BENCH_EMAIL
+        if not app.secret_key:
+            app.secret_key = 'benchmark'
+        if sqlite_defaults:
+            app.config['SQLITE_PRAGMAS'] = []
+            app.config['SQLITE_SINGLE_WRITER'] = False
+        socket = socket or concurrency > 0
+        generate(db_url, items, categories, users)
+
+        counter = QueryCounter(get_engine())
+        driver = SocketDriver(accept_encoding) if socket else \
+            TestClientDriver(accept_encoding)
+        driver.login()
+        print '%-14s %8s %8s %8s %10s %8s %10s' % (
+            'route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries',
+            'bytes')
+        results = {}
+        for name, calls in routes(samples(), count):
+            if name == 'categoryJSON' and json_count is not None:
+                calls = calls[:json_count]
+            results[name] = measure(driver, counter, name, calls)
+        print 'Bytes sent for one request to each route: %d' % sum(
+            result['bytes_per_request'] for result in results.values())
+        print '%-14s %8s %8s %8s' % ('session', 'read us', 'write us',
+                                     'cookie')
+        sessions = sessionOverhead(count * 5)
+        load = None
+        if concurrency:
+            load = concurrent(driver, samples(100), concurrency, duration,
+                              write_ratio)
+        if socket:
+            driver.close()
+        dispose_engine()
+    finally:
+        shutil.rmtree(directory)
+
+    return {
+        'config': {'items': items, 'categories': categories,
+                   'users': users, 'requests': count, 'socket': socket,
+                   'concurrency': concurrency, 'duration': duration,
+                   'write_ratio': write_ratio,
+                   'sqlite_defaults': sqlite_defaults,
+                   'accept_encoding': accept_encoding},
+        'routes': results,
+        'sessions': sessions,
+        'concurrent': load,
+        # ru_maxrss is in kilobytes on Linux.
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the Sports Bazar routes.')
+    parser.add_argument('--items', type=int, default=1000,
+                        help='number of synthetic items (default: 1000)')
+    parser.add_argument('--categories', type=int, default=None,
+                        help='number of categories (default: items / 100)')
+    parser.add_argument('--users', type=int, default=10,
+                        help='number of users owning the items '
+                             '(default: 10)')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per route (default: 200)')
+    parser.add_argument('--json-requests', type=int, default=None,
+                        help='requests to /catalog.json (default: same '
+                             'as --requests)')
+    parser.add_argument('--socket', action='store_true',
+                        help='serve the app on a local socket')
+    parser.add_argument('--concurrency', type=int, default=0,
+                        help='threads of the concurrent read/write load '
+                             'test (default: 0, no load test)')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds the load test runs (default: 10)')
+    parser.add_argument('--write-ratio', type=float, default=0.2,
+                        help='fraction of writes in the load test '
+                             '(default: 0.2)')
+    parser.add_argument('--sqlite-defaults', action='store_true',
+                        help='disable the SQLite pragmas and the single '
+                             'writer lock')
+    parser.add_argument('--accept-encoding', default='identity',
+                        help='Accept-Encoding of the requests, e.g. gzip '
+                             '(default: identity)')
+    parser.add_argument('--output', help='write the JSON report to a file')
+    args = parser.parse_args()
+
+    categories = args.categories or max(1, args.items // 100)
+    report = run(args.items, categories, args.users, args.requests,
+                 socket=args.socket, json_count=args.json_requests,
+                 concurrency=args.concurrency, duration=args.duration,
+                 write_ratio=args.write_ratio,
+                 sqlite_defaults=args.sqlite_defaults,
+                 accept_encoding=args.accept_encoding)
+    print 'Peak RSS: %d kB' % report['peak_rss_kb']
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,527 @@
+"""
+    Caches for catalog data and user lookups.
+
+    Cached values are tagged with the version of their namespace and the
+    generation of their scope at the time they were computed. The catalog
+    values are scoped: 'category:<id>' for the data of one category,
+    'categories' for the list of categories and the name -> id lookups,
+    'catalog' for the values depending on the whole catalog. A session
+    committing a change to a Category or an Item bumps the generations of
+    the categories it touched ('categories' too for a Category) and of
+    'catalog', which makes only those values stale. Bumping the namespace
+    version drops every value at once.
+
+    By default each process keeps its own LocalCache. When CACHE_REDIS_URL
+    is configured, a RedisCache is shared by all the worker processes and
+    version and generation bumps are broadcast to them over Redis pub/sub.
+
+    The same flushes move the updated_at of the categories they touch to
+    the current time, in the same transaction: the changed categories and
+    the categories of the changed items. conditional.py builds the ETag
+    and Last-Modified headers from these times.
+"""
+
+
+import cPickle as pickle
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from sportsbazar import app
+from sportsbazar.db_connect import readingFromPrimary
+from sportsbazar.db_setup import Category, Item
+
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# Pub/sub channels announcing new namespace versions and new scope
+# generations to every worker.
+INVALIDATION_CHANNEL = 'sportsbazar:invalidate'
+SCOPE_INVALIDATION_CHANNEL = 'sportsbazar:invalidate-scopes'
+
+
+class LocalCache(object):
+    """
+        Thread safe, size and time bounded LRU cache for a single process.
+
+        Attributes:
+            max_size: Maximum number of entries kept, least recently used
+                entries are evicted first.
+            ttl: Seconds an entry stays valid, even without a write.
+            version: Current version of the cached data.
+            invalidated_at: Time of the last invalidation.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = 0
+        self.invalidated_at = 0.0
+        self._generations = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0,
+                          'invalidations': 0, 'evictions': 0}
+
+    def generation(self, scope):
+        """
+            Returns the current generation of a scope (0 for no scope).
+        """
+        return self._generations.get(scope, 0) if scope else 0
+
+    def get(self, key, scope=None):
+        """
+            Returns the cached value for key, or None if it is missing,
+            expired or was computed at an older version or generation of
+            its scope.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                version, generation, expires, value = entry
+                if version == self.version and \
+                        generation == self.generation(scope) and \
+                        expires > time.time():
+                    del self._entries[key]
+                    self._entries[key] = entry
+                    self._counters['hits'] += 1
+                    return value
+                del self._entries[key]
+            self._counters['misses'] += 1
+            return None
+
+    def set(self, key, value, version=None, scope=None, generation=None):
+        """
+            Stores value under key for the given (default: current) version
+            and generation of its scope.
+        """
+        with self._lock:
+            if version is None:
+                version = self.version
+            if generation is None:
+                generation = self.generation(scope)
+            if version != self.version or \
+                    generation != self.generation(scope):
+                # A write committed while the value was being computed.
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (version, generation,
+                                  time.time() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, version=None):
+        """
+            Bumps the version (or moves it to the given one) and drops every
+            cached value.
+        """
+        with self._lock:
+            self.version = self.version + 1 if version is None else version
+            self.invalidated_at = time.time()
+            self._entries.clear()
+            self._counters['invalidations'] += 1
+
+    def invalidateScopes(self, scopes):
+        """
+            Bumps the generations of the given scopes, which makes their
+            values stale (they are dropped when next read or evicted).
+        """
+        with self._lock:
+            for scope in scopes:
+                self._generations[scope] = self.generation(scope) + 1
+            self.invalidated_at = time.time()
+            self._counters['invalidations'] += 1
+
+    def setGenerations(self, generations):
+        """
+            Moves scopes forward to the given generations, e.g. the ones
+            published by another worker.
+        """
+        with self._lock:
+            for scope, generation in generations.items():
+                if generation > self.generation(scope):
+                    self._generations[scope] = generation
+                    self.invalidated_at = time.time()
+
+    def stats(self):
+        """
+            Returns the cache counters along with its size and version.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['size'] = len(self._entries)
+            stats['version'] = self.version
+            return stats
+
+
+class RedisCache(object):
+    """
+        Cache shared by every worker through Redis, with the same interface
+        as LocalCache.
+
+        Values are pickled and stored under a key that includes the
+        namespace version and the generation of their scope, so bumping
+        either (an INCR / HINCRBY) orphans the older entries, which then
+        expire through their TTL. Each worker also keeps a small LocalCache
+        in front of Redis, kept in step with the versions and generations
+        other workers publish. A scope's generation is read from Redis the
+        first time the worker sees the scope.
+
+        Attributes:
+            namespace: Prefix of every key, e.g. 'catalog' or 'users'.
+            ttl: Seconds an entry stays valid, even without a write.
+            version: Last version of the namespace seen by this worker.
+    """
+
+    def __init__(self, client, namespace, max_size, ttl):
+        self.client = client
+        self.namespace = namespace
+        self.ttl = ttl
+        self._local = LocalCache(max_size, ttl)
+        self._counters = {'hits': 0, 'misses': 0, 'errors': 0}
+        self._version_key = 'sportsbazar:%s:version' % namespace
+        self._generations_key = 'sportsbazar:%s:generations' % namespace
+        self._scopes_seen = set()
+        self._local.version = int(client.get(self._version_key) or 0)
+
+    @property
+    def version(self):
+        return self._local.version
+
+    @property
+    def invalidated_at(self):
+        return self._local.invalidated_at
+
+    def generation(self, scope):
+        """
+            Returns the generation of a scope, or None if it is not known
+            yet and Redis can not be reached.
+        """
+        if not scope:
+            return 0
+        if scope not in self._scopes_seen:
+            try:
+                generation = int(self.client.hget(self._generations_key,
+                                                  scope) or 0)
+            except redis.RedisError:
+                self._counters['errors'] += 1
+                return None
+            self._local.setGenerations({scope: generation})
+            self._scopes_seen.add(scope)
+        return self._local.generation(scope)
+
+    def _key(self, key, version, scope, generation):
+        if not scope:
+            return 'sportsbazar:%s:%d:%s' % (self.namespace, version, key)
+        return 'sportsbazar:%s:%d:%s:%d:%s' % (self.namespace, version,
+                                               scope, generation, key)
+
+    def get(self, key, scope=None):
+        """
+            Returns the cached value for key, looking in the local cache
+            first and in Redis second, or None on a miss.
+        """
+        generation = self.generation(scope)
+        if generation is None:
+            self._counters['misses'] += 1
+            return None
+        value = self._local.get(key, scope)
+        if value is not None:
+            return value
+        version = self.version
+        try:
+            data = self.client.get(self._key(key, version, scope, generation))
+        except redis.RedisError:
+            self._counters['errors'] += 1
+            data = None
+        if data is None:
+            self._counters['misses'] += 1
+            return None
+        self._counters['hits'] += 1
+        value = pickle.loads(data)
+        self._local.set(key, value, version, scope, generation)
+        return value
+
+    def set(self, key, value, version=None, scope=None, generation=None):
+        """
+            Stores value under key for the given (default: current) version
+            and generation of its scope.
+        """
+        if version is None:
+            version = self.version
+        if generation is None:
+            generation = self.generation(scope)
+        if version != self.version or generation is None or \
+                generation != self.generation(scope):
+            return
+        try:
+            self.client.setex(self._key(key, version, scope, generation),
+                              self.ttl,
+                              pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        except redis.RedisError:
+            self._counters['errors'] += 1
+        self._local.set(key, value, version, scope, generation)
+
+    def invalidate(self, version=None):
+        """
+            Bumps the shared version and announces it to the other workers.
+        """
+        try:
+            version = self.client.incr(self._version_key)
+            self.client.publish(INVALIDATION_CHANNEL,
+                                '%s:%d' % (self.namespace, version))
+        except redis.RedisError:
+            self._counters['errors'] += 1
+            version = None
+        self._local.invalidate(version)
+
+    def remoteInvalidate(self, version):
+        """
+            Applies a version published by a worker (possibly this one).
+        """
+        if version > self.version:
+            self._local.invalidate(version)
+
+    def invalidateScopes(self, scopes):
+        """
+            Bumps the shared generations of the scopes and announces them
+            to the other workers.
+        """
+        scopes = list(scopes)
+        try:
+            pipe = self.client.pipeline()
+            for scope in scopes:
+                pipe.hincrby(self._generations_key, scope, 1)
+            generations = dict(zip(scopes, pipe.execute()))
+            self.client.publish(SCOPE_INVALIDATION_CHANNEL, json.dumps(
+                {'namespace': self.namespace, 'generations': generations}))
+        except redis.RedisError:
+            self._counters['errors'] += 1
+            self._local.invalidateScopes(scopes)
+            return
+        self.remoteInvalidateScopes(generations)
+
+    def remoteInvalidateScopes(self, generations):
+        """
+            Applies scope generations published by a worker (possibly this
+            one).
+        """
+        self._local.setGenerations(generations)
+        self._scopes_seen.update(generations)
+
+    def stats(self):
+        """
+            Returns the Redis counters, with the local cache ones prefixed
+            by 'local_'.
+        """
+        stats = dict(self._counters)
+        for name, value in self._local.stats().items():
+            stats['local_' + name] = value
+        stats['version'] = self.version
+        return stats
+
+
+_caches = {}
+_cache_lock = threading.Lock()
+_subscriber = None
+
+
+def _onInvalidation(message):
+    """
+        Pub/sub handler: applies another worker's version bump locally.
+    """
+    namespace, version = message['data'].rsplit(':', 1)
+    cache = _caches.get(namespace)
+    if isinstance(cache, RedisCache):
+        cache.remoteInvalidate(int(version))
+
+
+def _onScopeInvalidation(message):
+    """
+        Pub/sub handler: applies another worker's scope generations
+        locally.
+    """
+    data = json.loads(message['data'])
+    cache = _caches.get(data['namespace'])
+    if isinstance(cache, RedisCache):
+        cache.remoteInvalidateScopes(data['generations'])
+
+
+def _makeCache(namespace):
+    """
+        Creates the cache for a namespace: Redis backed when CACHE_REDIS_URL
+        is set and the redis package is installed, in-process otherwise.
+    """
+    global _subscriber
+    max_size = app.config['CACHE_MAX_SIZE']
+    ttl = app.config['CACHE_TTL']
+    url = app.config['CACHE_REDIS_URL']
+    if not url or redis is None:
+        return LocalCache(max_size, ttl)
+
+    client = redis.StrictRedis.from_url(url)
+    try:
+        cache = RedisCache(client, namespace, max_size, ttl)
+        if _subscriber is None:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{
+                INVALIDATION_CHANNEL: _onInvalidation,
+                SCOPE_INVALIDATION_CHANNEL: _onScopeInvalidation})
+            _subscriber = pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+    except redis.RedisError:
+        app.logger.warning('Redis at %s is unavailable, using the in-process '
+                           'cache for "%s".', url, namespace)
+        return LocalCache(max_size, ttl)
+    return cache
+
+
+def get_cache(namespace):
+    """
+        Returns the process-wide cache of a namespace, creating it on first
+        use.
+
+        Args:
+            namespace (str): 'catalog' for categories and items, 'users' for
+                user lookups.
+    """
+    cache = _caches.get(namespace)
+    if cache is None:
+        with _cache_lock:
+            cache = _caches.get(namespace)
+            if cache is None:
+                cache = _caches[namespace] = _makeCache(namespace)
+    return cache
+
+
+def get_cache_stats():
+    """
+        Returns the counters of every cache created in this process, by
+        namespace.
+    """
+    return dict((namespace, cache.stats())
+                for namespace, cache in _caches.items())
+
+
+def get_catalog_cache():
+    """
+        Returns the process-wide catalog cache, creating it on first use.
+    """
+    return get_cache('catalog')
+
+
+def get_user_cache():
+    """
+        Returns the process-wide user lookup cache.
+    """
+    return get_cache('users')
+
+
+def cached(key, loader, cache=None, scope=None):
+    """
+        Returns the cached value for key, calling loader() to compute and
+        store it on a miss. A loader returning None is not cached.
+
+        Args:
+            key (str): Cache key.
+            loader: Function without arguments returning the value.
+            cache: Cache to use, the catalog cache by default.
+            scope (str): Scope of the value in the catalog cache:
+                'category:<id>', 'categories' or 'catalog' (see above).
+    """
+    if cache is None:
+        cache = get_catalog_cache()
+    value = cache.get(key, scope)
+    if value is None:
+        version = cache.version
+        generation = cache.generation(scope)
+        if time.time() - cache.invalidated_at < \
+                app.config['DB_READ_YOUR_WRITES']:
+            # The replicas may not have the change yet.
+            with readingFromPrimary():
+                value = loader()
+        else:
+            value = loader()
+        if value is not None:
+            cache.set(key, value, version, scope, generation)
+    return value
+
+
+def touchCategories(session, category_ids):
+    """
+        Marks categories as changed by statements that bypass the ORM flush
+        (bulk inserts and updates), so that the session's next commit
+        invalidates them like any other change, and moves their updated_at
+        forward.
+
+        Args:
+            session: Session the statements were executed in.
+            category_ids: Ids of the categories whose items changed.
+    """
+    scopes = set('category:%d' % id for id in category_ids if id is not None)
+    session.info.setdefault('catalog_scopes', set()).update(scopes)
+    _touchCategories(session, scopes)
+
+
+def _touchCategories(session, scopes):
+    """
+        Sets updated_at of the categories of the given 'category:<id>'
+        scopes to the current time.
+    """
+    ids = [int(scope.split(':')[1]) for scope in scopes
+           if scope.startswith('category:')]
+    if not ids:
+        return
+    table = Category.__table__
+    session.execute(table.update().where(table.c.id.in_(sorted(ids))).values(
+        updated_at=datetime.utcnow()))
+
+
+# Invalidate the touched scopes of the catalog cache on commits that change
+# categories or items
+def _catalogScopes(obj):
+    """
+        Returns the scopes that a change to obj makes stale.
+    """
+    if isinstance(obj, Category):
+        return ['categories', 'category:%d' % obj.id]
+    if isinstance(obj, Item):
+        # Both the old and the new category of a moved item are stale.
+        history = inspect(obj).attrs.category_id.history
+        ids = set(history.added or ()) | set(history.deleted or ())
+        ids.add(obj.category_id)
+        return ['category:%d' % id for id in ids if id is not None]
+    return None
+
+
+@event.listens_for(Session, 'after_flush')
+def _catalogFlushed(session, flush_context):
+    flushed = set()
+    dirty = [obj for obj in session.dirty
+             if session.is_modified(obj, include_collections=False)]
+    for obj in list(session.new) + dirty + list(session.deleted):
+        scopes = _catalogScopes(obj)
+        if scopes is not None:
+            flushed.update(scopes)
+    if flushed:
+        session.info.setdefault('catalog_scopes', set()).update(flushed)
+        _touchCategories(session, flushed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _catalogCommitted(session):
+    scopes = session.info.pop('catalog_scopes', None)
+    if scopes is not None:
+        get_catalog_cache().invalidateScopes(['catalog'] + sorted(scopes))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _catalogRolledBack(session):
+    session.info.pop('catalog_scopes', None)
@@ -0,0 +1,118 @@
+"""
+    Compression of the responses, negotiated with Accept-Encoding.
+
+    Responses of a COMPRESS_MIMETYPES type are compressed with Brotli when
+    the brotli package is installed and the client accepts it, with gzip
+    otherwise. Complete responses are only compressed from
+    COMPRESS_MIN_SIZE bytes, below that the headers would outweigh the
+    savings. Streamed responses (e.g. /catalog.json, the exports) are
+    compressed on the fly, chunk by chunk.
+
+    Files sent as they are (the static files, see assets.py) and responses
+    that are already encoded (the page cache's gzipped pages) are left
+    alone. ETags of compressed responses are made weak, the compressed
+    bytes differing from the ones they were computed on.
+"""
+
+
+import zlib
+from flask import request
+from sportsbazar import app
+
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def encodings():
+    """
+        Returns the encodings the server can produce, preferred first.
+    """
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate(available):
+    """
+        Returns the available encoding the client prefers, or None if it
+        accepts none of them.
+
+        Args:
+            available: Encodings that can be sent, preferred first on equal
+                quality.
+    """
+    best, best_quality = None, 0
+    for encoding in available:
+        quality = request.accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compressor(encoding, level):
+    """
+        Returns a (compress, finish) pair of functions for an encoding.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        return compressor.process, compressor.finish
+    # wbits 31: gzip header and trailer.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def compress(data, encoding, level):
+    """
+        Compresses data with 'gzip' (level 1-9) or 'br' (level 0-11).
+    """
+    process, finish = _compressor(encoding, level)
+    return process(data) + finish()
+
+
+def _level(encoding):
+    if encoding == 'br':
+        return app.config['COMPRESS_BROTLI_QUALITY']
+    return app.config['COMPRESS_LEVEL']
+
+
+def _compressStream(chunks, encoding, close):
+    process, finish = _compressor(encoding, _level(encoding))
+    try:
+        for chunk in chunks:
+            data = process(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if close is not None:
+            close()
+
+
+@app.after_request
+def compressResponse(response):
+    if not app.config['COMPRESS'] or response.direct_passthrough or \
+            response.status_code != 200 or \
+            'Content-Encoding' in response.headers or \
+            response.mimetype not in app.config['COMPRESS_MIMETYPES']:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(encodings())
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compressStream(
+            response.iter_encoded(), encoding,
+            getattr(response.response, 'close', None))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compress(data, encoding, _level(encoding)))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
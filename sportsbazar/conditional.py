@@ -0,0 +1,159 @@
+"""
+    HTTP conditional GET (ETag / Last-Modified) for the catalog pages.
+
+    The validators are read from the database, so every worker process
+    and every writer (bulk imports, db_generate, other processes) agree
+    on them. They come from the updated_at of the categories: a commit
+    changing a category or its items moves the category's updated_at
+    forward (see cache.py). The ETag of a category's pages is a hash of
+    its updated_at and their Last-Modified that time, read with a single
+    primary key lookup. For the whole catalog they come from the number
+    of categories and their latest updated_at, one aggregate query whose
+    result is kept in the catalog cache under the 'catalog' scope, like
+    the catalog data the pages are rendered from. A request whose
+    If-None-Match / If-Modified-Since still matches gets a 304 before the
+    view runs, so no ORM object is loaded and no template is rendered.
+
+    The category validators are read on the request's session, from the
+    same copy of the data as the page (a lagging replica serves an old
+    page with its old ETag, never an old page with a new one).
+"""
+
+
+import hashlib
+from datetime import datetime
+from functools import wraps
+from flask import g, request, make_response
+from flask import session as login_session
+from sqlalchemy import func
+from sportsbazar import app
+from sportsbazar.db_setup import Category
+from sportsbazar.db_connect import db_connect
+from sportsbazar.cache import cached
+
+
+def categoryId(category_name):
+    """
+        Returns the id of a category from its name, or None if there is no
+        such category. Served from the catalog cache.
+    """
+    def load():
+        session = db_connect()
+        row = session.query(Category.id).filter_by(
+            name=category_name).first()
+        return row.id if row is not None else None
+    return cached('category_id:%s' % category_name, load,
+                  scope='categories')
+
+
+def scopeName(scope, view_args):
+    """
+        Returns the name of the version scope a view depends on, or None.
+    """
+    if scope == 'catalog':
+        return 'catalog'
+    category_id = categoryId(view_args['category_name'])
+    if category_id is None:
+        return None
+    return 'category:%d' % category_id
+
+
+def _version(key, updated_at):
+    token = hashlib.md5('%s:%s' % (
+        key, updated_at and updated_at.isoformat())).hexdigest()[:16]
+    # Without a time (no categories left, or rows older than the
+    # updated_at column), If-Modified-Since can not match.
+    last_modified = updated_at or datetime.utcnow()
+    return token, last_modified.replace(microsecond=0)
+
+
+def _loadCatalogVersion():
+    # Adding a category raises the count or the latest time, deleting one
+    # lowers the count, any other change moves the latest time.
+    session = db_connect()
+    count, updated_at = session.query(
+        func.count(Category.id), func.max(Category.updated_at)).one()
+    return _version(count, updated_at)
+
+
+def _loadVersion(name):
+    if name == 'catalog':
+        return cached('catalog_version', _loadCatalogVersion,
+                      scope='catalog')
+    category_id = int(name.split(':')[1])
+    row = db_connect().query(Category.updated_at).filter_by(
+        id=category_id).first()
+    if row is None:
+        return None
+    return _version(category_id, row.updated_at)
+
+
+def scopeVersion(name):
+    """
+        Returns (token, last modified) of a scope, or None if it does not
+        exist (anymore). Read once per request, from the catalog cache
+        for the whole catalog and from the database for a category.
+
+        Args:
+            name (str): 'catalog' or 'category:<id>', see scopeName().
+    """
+    versions = g.setdefault('scope_versions', {})
+    if name not in versions:
+        versions[name] = _loadVersion(name)
+    return versions[name]
+
+
+def _isNotModified(etag, last_modified):
+    """
+        Evaluates the request's preconditions (If-None-Match wins over
+        If-Modified-Since, as in RFC 7232).
+    """
+    if request.if_none_match:
+        # Weak comparison, as compressed responses have weak ETags.
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def conditional(scope, per_user=False):
+    """
+        Decorator adding ETag / Last-Modified validation to a GET view.
+
+        Args:
+            scope (str): 'catalog' if the view depends on the whole catalog,
+                'category' if it only depends on the category named by its
+                category_name argument.
+            per_user (bool): True for HTML pages, whose content depends on
+                who is logged in. Their ETags are weak: the page cache
+                sends the same page gzipped or not (see page_cache.py).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # Pending flash messages must be rendered by the view.
+            if request.method not in ('GET', 'HEAD') or \
+                    '_flashes' in login_session:
+                return view(**kwargs)
+            name = scopeName(scope, kwargs)
+            version = scopeVersion(name) if name else None
+            if version is None:
+                return view(**kwargs)
+
+            etag, last_modified = version
+            if per_user:
+                etag = '%s-%s' % (etag, g.current_user.id
+                                  if g.current_user else 'anon')
+            if _isNotModified(etag, last_modified):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=per_user)
+            response.last_modified = last_modified
+            if per_user:
+                response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
@@ -1,21 +1,333 @@
 """
     Methods to handle connection with the database.
+
+    A single engine (and its connection pool) is created for the whole
+    process the first time it is needed. Inside a Flask app context every
+    call to db_connect() returns the same session, which is closed by the
+    teardown hook at the end of the request.
+
+    SQLite files are set up for concurrent use: every pooled connection
+    gets the SQLITE_PRAGMAS (WAL journaling, so that readers never wait for
+    the writer, a busy timeout instead of immediate "database is locked"
+    errors, larger page cache and memory mapped I/O), and with
+    SQLITE_SINGLE_WRITER the threads of a process take turns to write, one
+    transaction at a time, while reads go on concurrently.
+
+    With DB_REPLICA_URLS set, the sessions of GET and HEAD requests read
+    from the replicas, taken in turn. Every other request, every write and
+    the requests of a user who wrote in the last DB_READ_YOUR_WRITES
+    seconds (e.g. the page shown after adding an item) use the primary
+    (DB_URL). A replica is checked with a SELECT 1 before its first use
+    and then every DB_REPLICA_CHECK_INTERVAL seconds, and is skipped for
+    DB_REPLICA_RETRY seconds when that fails or it loses a connection.
+
+    Replicas are assumed to lag by less than DB_READ_YOUR_WRITES seconds.
+    For that long after a change, the catalog cache is filled from the
+    primary (see readingFromPrimary()), so that it never keeps what a
+    lagging replica returned. The ETag / Last-Modified validators and the
+    page cache keys are read on the request's session (see
+    conditional.py): a lagging replica gives the old page with its old
+    validators, which are replaced as soon as it catches up.
+
+    To try it locally, copy sportsbazar.db to replica.db and set
+    SPORTSBAZAR_DB_REPLICA_URLS='["sqlite:///replica.db"]'; the copy is
+    not kept up to date, which makes the routing easy to see.
 """
 
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context, has_request_context, request
+from flask import session as login_session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
 from sportsbazar import app
-from sportsbazar.db_setup import Base, DB_URL
+from sportsbazar.db_setup import Base
+
+
+_engine = None
+_session_factory = None
+# Replica of each DB_REPLICA_URLS, and the counter taking them in turn.
+_replicas = []
+_next_replica = itertools.count()
+_engine_lock = threading.Lock()
+# Held by the connection whose transaction is writing to a SQLite file.
+_writer_lock = threading.Lock()
+# First words of the statements that write to the database.
+_WRITES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def _engine_options(db_url):
+    """
+        Builds the keyword arguments for create_engine() from app.config.
+
+        Args:
+            db_url: URL of the database the engine will connect to.
+    """
+    options = {
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+    }
+    url = make_url(db_url)
+    if url.drivername.startswith('sqlite'):
+        if url.database in (None, '', ':memory:'):
+            # An in-memory database only lives as long as its connection,
+            # so keep SQLAlchemy's default single connection pool.
+            return options
+        # SQLite files default to NullPool, which reopens the file on
+        # every checkout. Pool the connections like any other backend;
+        # a pooled connection is then used by several threads in turn,
+        # which the sqlite3 module refuses unless check_same_thread is off.
+        options['poolclass'] = QueuePool
+        options['connect_args'] = {'check_same_thread': False}
+    elif url.get_backend_name() == 'postgresql' and \
+            url.get_driver_name() == 'psycopg2':
+        options['use_batch_mode'] = app.config['PG_BATCH_MODE']
+        options['client_encoding'] = 'utf8'
+        connect_args = {'application_name': 'sportsbazar'}
+        if app.config['PG_STATEMENT_TIMEOUT']:
+            connect_args['options'] = '-c statement_timeout=%d' % (
+                app.config['PG_STATEMENT_TIMEOUT'])
+        options['connect_args'] = connect_args
+    options['pool_size'] = app.config['DB_POOL_SIZE']
+    options['max_overflow'] = app.config['DB_MAX_OVERFLOW']
+    return options
+
+
+def _setPragmas(dbapi_connection, connection_record):
+    """
+        Applies SQLITE_PRAGMAS to a new SQLite connection.
+    """
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS']:
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
+
+
+def _startWriting(conn, cursor, statement, parameters, context,
+                  executemany):
+    """
+        Waits for the writer lock before the first write of a transaction.
+    """
+    if conn.info.get('writer') or \
+            not statement.lstrip()[:7].upper().startswith(_WRITES):
+        return
+    _writer_lock.acquire()
+    conn.info['writer'] = True
+
+
+def _stopWriting(conn_or_record, *args):
+    """
+        Releases the writer lock at the end of the writing transaction, or
+        when its connection goes back to the pool whatever happened.
+    """
+    if conn_or_record.info.pop('writer', False):
+        _writer_lock.release()
+
+
+def _configureSqlite(engine, url):
+    """
+        Registers the SQLite pragmas and the single writer lock on an
+        engine.
+    """
+    if app.config['SQLITE_PRAGMAS']:
+        event.listen(engine, 'connect', _setPragmas)
+    if app.config['SQLITE_SINGLE_WRITER'] and \
+            url.database not in (None, '', ':memory:'):
+        event.listen(engine, 'before_cursor_execute', _startWriting)
+        event.listen(engine, 'commit', _stopWriting)
+        event.listen(engine, 'rollback', _stopWriting)
+        event.listen(engine.pool, 'checkin',
+                     lambda dbapi_connection, record: _stopWriting(record))
+
+
+def _createEngine(db_url):
+    """
+        Creates the engine of the primary or of a replica.
+    """
+    engine = create_engine(db_url, **_engine_options(db_url))
+    url = make_url(db_url)
+    if url.drivername.startswith('sqlite'):
+        _configureSqlite(engine, url)
+    return engine
+
+
+class Replica(object):
+    """
+        Engine of a read replica and its health.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.down_until = 0.0
+        self.checked_at = 0.0
+        event.listen(engine, 'handle_error', self._onError)
+
+    def _onError(self, context):
+        if context.is_disconnect:
+            self.markDown()
+
+    def markDown(self):
+        self.down_until = time.time() + app.config['DB_REPLICA_RETRY']
+        app.logger.warning('Replica %s is down, reading from the primary',
+                           self.engine.url)
+
+    def isHealthy(self):
+        """
+            Whether the replica can be used, checking it if it is due.
+        """
+        now = time.time()
+        if self.down_until > now:
+            return False
+        if now - self.checked_at < app.config['DB_REPLICA_CHECK_INTERVAL']:
+            return True
+        try:
+            with self.engine.connect() as connection:
+                connection.execute('SELECT 1')
+        except Exception:
+            self.markDown()
+            return False
+        self.checked_at = now
+        return True
+
+
+def _pickReplica():
+    """
+        Returns the engine of the next healthy replica, or None.
+    """
+    for _ in range(len(_replicas)):
+        replica = _replicas[next(_next_replica) % len(_replicas)]
+        if replica.isHealthy():
+            return replica.engine
+    return None
+
+
+class RoutingSession(Session):
+    """
+        Session reading from a replica when it is flagged read_only (see
+        db_connect()), and from the primary otherwise. Writes always go to
+        the primary. A session keeps the same replica until it is closed,
+        so that a request sees a single copy of the data.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+            self.info['read_only'] = False
+        if not self.info.get('read_only'):
+            return get_engine()
+        if 'replica' not in self.info:
+            self.info['replica'] = _pickReplica() or get_engine()
+        return self.info['replica']
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _rememberWrite(session):
+    # The user's next requests read their own writes from the primary.
+    if session.info.pop('wrote', False) and _replicas and \
+            has_request_context():
+        login_session['db_primary_until'] = \
+            time.time() + app.config['DB_READ_YOUR_WRITES']
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forgetWrite(session):
+    session.info.pop('wrote', None)
+
+
+def _readsFromReplica():
+    """
+        Whether the current request can read from a replica.
+    """
+    return bool(_replicas) and has_request_context() and \
+        request.method in ('GET', 'HEAD') and \
+        login_session.get('db_primary_until', 0) < time.time()
+
+
+@contextmanager
+def readingFromPrimary():
+    """
+        Context manager routing the reads of the request's session to the
+        primary within its block, e.g. to fill a cache with data that a
+        replica may not have yet.
+    """
+    if not _readsFromReplica():
+        yield
+        return
+    session = db_connect()
+    read_only = session.info.get('read_only')
+    session.info['read_only'] = False
+    try:
+        yield
+    finally:
+        session.info['read_only'] = read_only
+
+
+def get_engine():
+    """
+        Returns the process-wide engine of the primary, creating it and the
+        replicas' on first use.
+    """
+    global _engine, _session_factory
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = _createEngine(app.config['DB_URL'])
+                _replicas[:] = [Replica(_createEngine(db_url))
+                                for db_url in app.config['DB_REPLICA_URLS']]
+                Base.metadata.bind = engine
+                _session_factory = sessionmaker(bind=engine,
+                                                class_=RoutingSession)
+                _engine = engine
+    return _engine
+
+
+def dispose_engine():
+    """
+        Closes all pooled connections and forgets the engines, so that the
+        next call to get_engine() picks up the current app.config.
+    """
+    global _engine, _session_factory
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        for replica in _replicas:
+            replica.engine.dispose()
+        del _replicas[:]
+        _engine = None
+        _session_factory = None
 
 
 def db_connect():
     """
-        Connects to the database and returns an sqlalchemy session object.
+        Returns an sqlalchemy session object.
+
+        Within an app context the session is created lazily and shared by
+        every caller for the rest of the request. Outside of one (e.g. the
+        db_populate script) a new session is returned and the caller is
+        responsible for closing it.
     """
-    engine = create_engine(DB_URL)
-    Base.metadata.bind = engine
-    db_session = sessionmaker(bind=engine)
-    session = db_session()
+    get_engine()
+    if not has_app_context():
+        return _session_factory()
 
+    session = getattr(g, 'db_session', None)
+    if session is None:
+        session = g.db_session = _session_factory(
+            info={'read_only': _readsFromReplica()})
     return session
+
+
+@app.teardown_appcontext
+def db_disconnect(exception=None):
+    """
+        Closes the request's session and returns its connection to the pool.
+    """
+    session = g.pop('db_session', None)
+    if session is not None:
+        session.close()
@@ -0,0 +1,182 @@
+"""
+    Script to fill a database with a large synthetic catalog.
+
+    Generates users, categories and items from a deterministic seed and
+    inserts them with executemany() in large batches and few transactions,
+    which is orders of magnitude faster than adding and committing one
+    object at a time. Meant to stand up performance test environments.
+
+    Usage:
+        python -m sportsbazar.db_generate --items 1000000 --categories 500 \
+            --users 1000 --db-url sqlite:///perf.db
+"""
+
+
+import argparse
+import random
+import sys
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine.url import make_url
+from sportsbazar.db_setup import Base, User, Category, Item, DB_URL
+from sportsbazar.db_setup import create_search_index
+
+
+SPORTS = ['Cricket', 'Football', 'Hockey', 'Basket Ball', 'Snooker',
+          'Tennis', 'Badminton', 'Golf', 'Swimming', 'Cycling', 'Running',
+          'Boxing', 'Baseball', 'Volleyball', 'Squash', 'Table Tennis']
+BRANDS = ['Addidas', 'Nike', 'Puma', 'Reebok', 'Gray Nicolls', 'Kookaburra',
+          'Wilson', 'Yonex', 'Spalding', 'Mikasa', 'Everlast', 'Speedo']
+ADJECTIVES = ['Pro', 'Classic', 'Ultra', 'Lite', 'Elite', 'Junior',
+              'Training', 'Match', 'Premium', 'Carbon', 'Super', 'Original']
+PRODUCTS = ['Bat', 'Ball', 'Shoes', 'Kit', 'Helmet', 'Gloves', 'Racket',
+            'Stick', 'Shirt', 'Shorts', 'Socks', 'Bag', 'Cap', 'Net', 'Pads']
+MATERIALS = ['cotton', 'nylon', 'leather', 'carbon fibre', 'willow',
+             'polyester', 'rubber', 'aluminium']
+
+
+def _maxId(connection, table):
+    return connection.execute(select([func.max(table.c.id)])).scalar() or 0
+
+
+def _touchCategories(connection, category_offset):
+    # The HTTP validators of the app come from the categories' updated_at
+    # (see conditional.py): move those of the generated ones forward.
+    table = Category.__table__
+    connection.execute(table.update().where(
+        table.c.id > category_offset).values(updated_at=datetime.utcnow()))
+
+
+def _report(label, done, total, started):
+    elapsed = max(time.time() - started, 1e-6)
+    sys.stdout.write('\r%s: %d / %d rows (%d rows/s)' % (
+        label, done, total, done / elapsed))
+    sys.stdout.flush()
+
+
+def generate(db_url, items, categories, users, seed=0, batch_size=10000,
+             commit_every=200000):
+    """
+        Appends a synthetic catalog to a database.
+
+        Args:
+            db_url: URL of the database, its tables are created if needed.
+            items (int): Number of items to generate.
+            categories (int): Number of categories to generate.
+            users (int): Number of users owning the items.
+            seed (int): Seed of the random generator, the same seed always
+                produces the same catalog.
+            batch_size (int): Rows sent in each executemany() call.
+            commit_every (int): Rows inserted per transaction.
+
+        Returns:
+            A dict with the number of rows inserted and the rows per second.
+    """
+    rand = random.Random(seed)
+    url = make_url(db_url)
+    options = {}
+    if url.get_driver_name() == 'psycopg2':
+        # Send the rows of executemany() in pages, not one by one.
+        options = {'use_batch_mode': True, 'client_encoding': 'utf8'}
+    engine = create_engine(db_url, **options)
+    Base.metadata.create_all(engine)
+    create_search_index(engine)
+    started = time.time()
+
+    with engine.begin() as connection:
+        user_offset = _maxId(connection, User.__table__)
+        category_offset = _maxId(connection, Category.__table__)
+        item_offset = _maxId(connection, Item.__table__)
+
+        connection.execute(User.__table__.insert(), [
+            {'id': user_offset + i + 1,
+             'name': 'Synthetic User %d' % (user_offset + i + 1),
+             'email': 'user%d@sportsbazar.test' % (user_offset + i + 1)}
+            for i in xrange(users)])
+        # Categories belong to the first generated user (the "admin").
+        connection.execute(Category.__table__.insert(), [
+            {'id': category_offset + i + 1,
+             'name': '%s %d' % (SPORTS[i % len(SPORTS)],
+                                category_offset + i + 1),
+             'user_id': user_offset + 1}
+            for i in xrange(categories)])
+
+    done = 0
+    connection = engine.connect()
+    transaction = connection.begin()
+    try:
+        while done < items:
+            batch = []
+            for i in xrange(done, min(done + batch_size, items)):
+                item_id = item_offset + i + 1
+                product = rand.choice(PRODUCTS)
+                batch.append({
+                    'id': item_id,
+                    'name': '%s %s %s %d' % (rand.choice(BRANDS),
+                                             rand.choice(ADJECTIVES),
+                                             product, item_id),
+                    'description': '%s %s, made of %s.' % (
+                        rand.choice(ADJECTIVES), product.lower(),
+                        rand.choice(MATERIALS)),
+                    'price': rand.randint(1, 500),
+                    'quantity': rand.randint(0, 200),
+                    'category_id': category_offset +
+                    rand.randrange(categories) + 1,
+                    'user_id': user_offset + rand.randrange(users) + 1,
+                })
+            connection.execute(Item.__table__.insert(), batch)
+            previous, done = done, done + len(batch)
+            if done // commit_every != previous // commit_every:
+                _touchCategories(connection, category_offset)
+                transaction.commit()
+                transaction = connection.begin()
+            _report('Items', done, items, started)
+        _touchCategories(connection, category_offset)
+        transaction.commit()
+        if engine.dialect.name == 'postgresql':
+            # The ids were given explicitly, move the sequences past them.
+            quote = engine.dialect.identifier_preparer.quote
+            for table in (User.__table__, Category.__table__,
+                          Item.__table__):
+                connection.execute(
+                    "SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+                    "(SELECT max(id) FROM %s))" % (quote(table.name),
+                                                   quote(table.name)))
+    except Exception:
+        transaction.rollback()
+        raise
+    finally:
+        connection.close()
+        engine.dispose()
+
+    elapsed = time.time() - started
+    rows = users + categories + items
+    print
+    print 'Inserted %d rows in %.1fs (%d rows/s)' % (
+        rows, elapsed, rows / max(elapsed, 1e-6))
+    return {'rows': rows, 'seconds': elapsed,
+            'rows_per_sec': rows / max(elapsed, 1e-6)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fill a database with a synthetic catalog.')
+    parser.add_argument('--db-url', default=DB_URL,
+                        help='database URL (default: %s)' % DB_URL)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--categories', type=int, default=100)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--commit-every', type=int, default=200000)
+    args = parser.parse_args()
+    if args.categories < 1 or args.users < 1:
+        parser.error('at least one category and one user are needed')
+    generate(args.db_url, args.items, args.categories, args.users,
+             seed=args.seed, batch_size=args.batch_size,
+             commit_every=args.commit_every)
+
+
+if __name__ == '__main__':
+    main()
@@ -38,28 +38,22 @@ def db_populate():
                 + "/commons/5/55/User-admin-gear.svg"
     )
     session.add(admin)
-    session.commit()
 
     # Creates categories of items.
     category1 = Category(name="Cricket", user=admin)
     session.add(category1)
-    session.commit()
 
     category2 = Category(name="Football", user=admin)
     session.add(category2)
-    session.commit()
 
     category3 = Category(name="Hockey", user=admin)
     session.add(category3)
-    session.commit()
 
     category4 = Category(name="Basket Ball", user=admin)
     session.add(category4)
-    session.commit()
 
     category5 = Category(name="Snooker", user=admin)
     session.add(category5)
-    session.commit()
 
     # Adds items -- Cricket
     item1 = Item(
@@ -73,7 +67,6 @@ def db_populate():
         quantity=100,
     )
     session.add(item1)
-    session.commit()
 
     item2 = Item(
         user=admin,
@@ -86,7 +79,6 @@ def db_populate():
         quantity=50,
     )
     session.add(item2)
-    session.commit()
 
     # Adds items -- Football
     item3 = Item(
@@ -100,7 +92,6 @@ def db_populate():
         quantity=100,
     )
     session.add(item3)
-    session.commit()
 
     item4 = Item(
         user=admin,
@@ -113,7 +104,6 @@ def db_populate():
         quantity=50,
     )
     session.add(item4)
-    session.commit()
 
     # Adds items -- Hockey
     item5 = Item(
@@ -127,7 +117,6 @@ def db_populate():
         quantity=50,
     )
     session.add(item5)
-    session.commit()
 
     item6 = Item(
         user=admin,
@@ -140,7 +129,6 @@ def db_populate():
         quantity=30,
     )
     session.add(item6)
-    session.commit()
 
     # Add items -- BasketBall
     item7 = Item(
@@ -154,7 +142,6 @@ def db_populate():
         quantity=100,
     )
     session.add(item7)
-    session.commit()
 
     item8 = Item(
         user=admin,
@@ -167,7 +154,6 @@ def db_populate():
         quantity=30,
     )
     session.add(item8)
-    session.commit()
 
     # Add items -- Snooker
     item9 = Item(
@@ -181,7 +167,6 @@ def db_populate():
         quantity=10,
     )
     session.add(item9)
-    session.commit()
 
     item10 = Item(
         user=admin,
@@ -194,8 +179,10 @@ def db_populate():
         quantity=5,
     )
     session.add(item10)
-    session.commit()
 
+    # Everything is written in a single transaction, committing each row
+    # would cost one fsync per row on SQLite.
+    session.commit()
     session.close()
     print "Test data populated ..."
 
@@ -4,18 +4,32 @@
     and then the db_populate.py file to fill the databse with the test data.
     The database is contain following tables and attributes:
     -- user: id, name, email, picture
-    -- category: id, name, user_id
-    -- item: id, name, description, price, quantity, category_id, user_id
+    -- category: id, name, user_id, updated_at
+    -- item: id, name, description, price, quantity, category_id, user_id,
+             updated_at
+    -- web_session: id, data, expires_at (server-side sessions, see
+                    sessions.py)
+    User emails, category names and item names are unique, and every
+    column used for lookups is indexed. Item names and descriptions are
+    also indexed for full-text search (see search.py). db_migrate() brings
+    the tables and indexes of an existing database up to date.
 """
 
 
-from sqlalchemy import Column, ForeignKey, Integer, String
+import warnings
+from datetime import datetime
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, DateTime
+from sqlalchemy import Text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.exc import IntegrityError, OperationalError, SAWarning
+from sqlalchemy.schema import CreateColumn
+from sportsbazar.config import database_url
 
 
-DB_URL = "sqlite:///sportsbazar.db?check_same_thread=False"
+# Database of the scripts run on their own, see config.py.
+DB_URL = database_url()
 
 
 # Base class mapper from SQLalchemy
@@ -37,7 +51,7 @@ class User(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False)
-    email = Column(String(250), nullable=False)
+    email = Column(String(250), nullable=False, unique=True, index=True)
     picture = Column(String(250))
 
 
@@ -52,14 +66,17 @@ class Category(Base):
             user_id: ID of the user / owner.
             user: Relationship with the user / owner.
             items: Relationship with individual items.
+            updated_at: Time (UTC) of the last change to the category.
     """
     __tablename__ = 'category'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String(100), nullable=False)
+    name = Column(String(100), nullable=False, unique=True, index=True)
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship(User)
     items = relationship('Item', cascade="save-update, merge, delete")
+    updated_at = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
 
     # To return category data in aa serialiseable format for JSON API.
     @property
@@ -86,11 +103,12 @@ class Item(Base):
             category: Relationship with the category / item type.
             user_id: User ID of the owner of the item.
             user: Relationship with the user (owner / vendor) of the item.
+            updated_at: Time (UTC) of the last change to the item.
     """
     __tablename__ = 'item'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String(250), nullable=False)
+    name = Column(String(250), nullable=False, unique=True, index=True)
     description = Column(String)
     price = Column(Integer)
     quantity = Column(Integer)
@@ -98,6 +116,14 @@ class Item(Base):
     category = relationship(Category)
     user_id = Column(Integer, ForeignKey('user.id'))
     user = relationship(User)
+    updated_at = Column(DateTime, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+
+    # Access paths for the keyset pagination of a category's / user's items
+    __table_args__ = (
+        Index('ix_item_category_id_id', 'category_id', 'id'),
+        Index('ix_item_user_id_id', 'user_id', 'id'),
+    )
 
     # To return category data in aa serialiseable format for the JSON API.
     @property
@@ -112,6 +138,98 @@ class Item(Base):
         }
 
 
+class WebSession(Base):
+    """
+        Table to store the server-side sessions of the SQL session store.
+
+        Attributes:
+            __tablename__: Name of the table.
+            id: Opaque session ID sent in the session cookie.
+            data: Serialized content of the session.
+            expires_at: Time (UTC) after which the session is swept.
+    """
+    __tablename__ = 'web_session'
+
+    id = Column(String(64), primary_key=True)
+    data = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+# Full-text index over item names and descriptions. On SQLite an FTS5
+# table mirrors the item table through triggers, on PostgreSQL a GIN index
+# covers the same tsvector expression that search.py queries.
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE item_fts USING fts5("
+    "name, description, content='item', content_rowid='id', "
+    "prefix='2 3')",
+    "CREATE TRIGGER item_fts_insert AFTER INSERT ON item BEGIN "
+    "INSERT INTO item_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER item_fts_delete AFTER DELETE ON item BEGIN "
+    "INSERT INTO item_fts(item_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER item_fts_update AFTER UPDATE ON item BEGIN "
+    "INSERT INTO item_fts(item_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO item_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); END",
+    # Index the rows that existed before the table was created.
+    "INSERT INTO item_fts(item_fts) VALUES ('rebuild')",
+]
+POSTGRES_SEARCH_VECTOR = (
+    "to_tsvector('english', coalesce(item.name, '') || ' ' || "
+    "coalesce(item.description, ''))")
+POSTGRES_SEARCH_INDEX = 'ix_item_search'
+POSTGRES_SEARCH_DDL = [
+    "CREATE INDEX %s ON item USING gin(%s)"
+    % (POSTGRES_SEARCH_INDEX, POSTGRES_SEARCH_VECTOR),
+]
+
+
+def search_index_exists(engine):
+    """
+        Returns True if the database has the full-text index of the items.
+    """
+    if engine.dialect.name == 'sqlite':
+        exists = "SELECT 1 FROM sqlite_master WHERE name = 'item_fts'"
+    elif engine.dialect.name == 'postgresql':
+        exists = "SELECT 1 FROM pg_indexes WHERE indexname = '%s'" % (
+            POSTGRES_SEARCH_INDEX)
+    else:
+        return False
+    return engine.execute(exists).first() is not None
+
+
+def create_search_index(engine):
+    """
+        Creates the full-text index of the items, if it does not exist yet.
+        SQLite builds without FTS5 get none, search.py then falls back to
+        LIKE.
+
+        Args:
+            engine: Engine of the database to index.
+    """
+    if engine.dialect.name == 'sqlite':
+        name, statements = 'item_fts', SQLITE_SEARCH_DDL
+    elif engine.dialect.name == 'postgresql':
+        name, statements = POSTGRES_SEARCH_INDEX, POSTGRES_SEARCH_DDL
+    else:
+        return
+    if search_index_exists(engine):
+        return
+    try:
+        with engine.begin() as connection:
+            for statement in statements:
+                connection.execute(statement)
+    except OperationalError as error:
+        if engine.dialect.name != 'sqlite' or 'fts5' not in str(error):
+            raise
+        print "Warning: SQLite has no FTS5, search will scan the items " \
+              "with LIKE ..."
+        return
+    print "Created full-text index %s ..." % name
+
+
 def db_create(DB_URL):
     """
         Creates a new empty database.
@@ -121,8 +239,61 @@ def db_create(DB_URL):
     """
     engine = create_engine(DB_URL)
     Base.metadata.create_all(engine)
+    create_search_index(engine)
     print "Database created successfully ..."
 
 
+def db_migrate(DB_URL):
+    """
+        Upgrades an existing database to the current schema.
+
+        Creates any missing table, adds the columns missing from existing
+        tables, then creates any index (including the unique ones) missing
+        from an existing table and drops the 'ix_' indexes that the schema
+        no longer defines. A unique index can not be built while duplicate
+        values exist, those are reported and left for the admin to clean
+        up.
+
+        Args:
+            db_url: Path of the db file to upgrade
+    """
+    engine = create_engine(DB_URL)
+    Base.metadata.create_all(engine)
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = set(column['name']
+                      for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in columns:
+                engine.execute('ALTER TABLE %s ADD COLUMN %s' % (
+                    engine.dialect.identifier_preparer.format_table(table),
+                    CreateColumn(column).compile(dialect=engine.dialect)))
+                print "Added column %s.%s ..." % (table.name, column.name)
+        with warnings.catch_warnings():
+            # SQLAlchemy does not reflect the expression of the full-text
+            # index on PostgreSQL, only its name is needed here.
+            warnings.simplefilter('ignore', SAWarning)
+            existing = set(index['name']
+                           for index in inspector.get_indexes(table.name))
+        defined = set(index.name for index in table.indexes)
+        # The full-text index is not part of the table's metadata.
+        for name in existing - defined - set([POSTGRES_SEARCH_INDEX]):
+            if name.startswith('ix_'):
+                engine.execute('DROP INDEX %s' %
+                               engine.dialect.identifier_preparer.quote(name))
+                print "Dropped index %s ..." % name
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                index.create(engine)
+                print "Created index %s ..." % index.name
+            except IntegrityError:
+                print "Could not create unique index %s: " \
+                      "duplicate values in %s." % (index.name, table.name)
+    create_search_index(engine)
+    engine.dispose()
+
+
 if __name__ == '__main__':
-    db_create(DB_URL)
+    db_migrate(DB_URL)
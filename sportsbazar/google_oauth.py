@@ -0,0 +1,222 @@
+"""
+    Calls made by the server to Google during sign in and sign out.
+
+    The client secrets are read once, and the calls reuse kept-alive
+    connections: a requests session shared by the threads for the JSON
+    endpoints, and an httplib2.Http per thread for the code exchange done
+    by oauth2client (httplib2 is not thread safe). Every call times out
+    after GOOGLE_HTTP_TIMEOUT seconds.
+
+    The ID token returned with the access token is verified locally
+    against Google's public certs, which are cached for as long as their
+    Cache-Control allows and fetched again when a token is signed with a
+    key they do not hold (Google rotates its keys), so the tokeninfo call
+    is only needed when that is disabled or the certs can't be fetched.
+
+    Every endpoint is configurable (GOOGLE_* settings in config.py), so
+    sign in can be tried against a local stub server.
+"""
+
+
+import base64
+import json
+import re
+import socket
+import threading
+import time
+import httplib2
+import requests
+from oauth2client import crypt
+from oauth2client.client import OAuth2WebServerFlow, FlowExchangeError
+from sportsbazar import app
+
+
+# Scopes asked for at sign in.
+SCOPE = 'email profile'
+# Lifetime of the certs when Google's response doesn't give one, and the
+# minimum delay between two fetches triggered by an unknown key.
+CERTS_DEFAULT_MAX_AGE = 3600
+CERTS_MIN_REFRESH = 60
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+_secrets = {}
+_flow = []
+_secrets_lock = threading.Lock()
+_session = requests.Session()
+_local = threading.local()
+
+
+def clientSecrets():
+    """
+        Returns the 'web' client secrets of GOOGLE_CLIENT_SECRETS, read on
+        first use.
+    """
+    if not _secrets:
+        with _secrets_lock:
+            if not _secrets:
+                with open(app.config['GOOGLE_CLIENT_SECRETS']) as source:
+                    _secrets.update(json.load(source)['web'])
+    return _secrets
+
+
+def _oauthFlow():
+    """
+        Returns the flow exchanging the one-time codes of the sign in
+        button, built once.
+    """
+    if not _flow:
+        secrets = clientSecrets()
+        _flow.append(OAuth2WebServerFlow(
+            secrets['client_id'], secrets['client_secret'], SCOPE,
+            redirect_uri='postmessage',
+            auth_uri=secrets['auth_uri'],
+            token_uri=app.config['GOOGLE_TOKEN_URI'] or secrets['token_uri'],
+            revoke_uri=app.config['GOOGLE_REVOKE_URL']))
+    return _flow[0]
+
+
+def _http():
+    """
+        Returns the httplib2.Http of the current thread.
+    """
+    http = getattr(_local, 'http', None)
+    if http is None:
+        http = _local.http = httplib2.Http(
+            timeout=app.config['GOOGLE_HTTP_TIMEOUT'])
+    return http
+
+
+def exchangeCode(code):
+    """
+        Upgrades the one-time code of the sign in button into credentials.
+
+        Raises:
+            FlowExchangeError: if Google refused the code or could not be
+                reached.
+    """
+    try:
+        return _oauthFlow().step2_exchange(code, http=_http())
+    except (socket.error, httplib2.HttpLib2Error) as error:
+        # Drop the connection, it may be left in a broken state.
+        _local.http = None
+        raise FlowExchangeError('Token endpoint unreachable: %s' % error)
+
+
+def _getJson(url, **params):
+    response = _session.get(url, params=params,
+                            timeout=app.config['GOOGLE_HTTP_TIMEOUT'])
+    return response.json()
+
+
+def tokenInfo(access_token):
+    """
+        Returns what Google knows of an access token (user_id, issued_to,
+        or error).
+    """
+    return _getJson(app.config['GOOGLE_TOKENINFO_URL'],
+                    access_token=access_token)
+
+
+def userInfo(access_token):
+    """
+        Returns the name, email and picture of the user of an access token.
+    """
+    return _getJson(app.config['GOOGLE_USERINFO_URL'],
+                    access_token=access_token, alt='json')
+
+
+def revokeToken(access_token):
+    """
+        Revokes an access token.
+
+        Returns:
+            The HTTP status code of Google's answer.
+    """
+    try:
+        response = _session.get(app.config['GOOGLE_REVOKE_URL'],
+                                params={'token': access_token},
+                                timeout=app.config['GOOGLE_HTTP_TIMEOUT'])
+    except requests.RequestException:
+        return None
+    return response.status_code
+
+
+class Certs(object):
+    """
+        Cache of Google's public certs, keyed by key id.
+    """
+
+    def __init__(self):
+        self._certs = {}
+        self._expires = 0.0
+        self._fetched = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key_id):
+        """
+            Returns the certs, fetched again if they expired or if key_id
+            is not one of them.
+
+            Raises:
+                requests.RequestException: if the certs could not be
+                    fetched.
+        """
+        with self._lock:
+            now = time.time()
+            if now >= self._expires or (
+                    key_id not in self._certs and
+                    now - self._fetched >= CERTS_MIN_REFRESH):
+                self._fetch()
+            return self._certs
+
+    def _fetch(self):
+        response = _session.get(app.config['GOOGLE_CERTS_URL'],
+                                timeout=app.config['GOOGLE_HTTP_TIMEOUT'])
+        response.raise_for_status()
+        certs = response.json()
+        match = _MAX_AGE.search(response.headers.get('Cache-Control', ''))
+        max_age = int(match.group(1)) if match else CERTS_DEFAULT_MAX_AGE
+        self._certs = certs
+        self._fetched = time.time()
+        self._expires = self._fetched + max_age
+
+    def clear(self):
+        with self._lock:
+            self._certs = {}
+            self._expires = 0.0
+
+
+certs = Certs()
+
+
+def _keyId(id_token):
+    """
+        Returns the id of the key that signed a JWT, or None.
+    """
+    header = id_token.split('.')[0]
+    try:
+        header = json.loads(base64.urlsafe_b64decode(
+            str(header) + '=' * (-len(header) % 4)))
+    except (TypeError, ValueError):
+        return None
+    return header.get('kid') if isinstance(header, dict) else None
+
+
+def verifyIdToken(id_token):
+    """
+        Verifies the signature, lifetime, audience and issuer of an ID
+        token.
+
+        Returns:
+            The claims of the token (sub, email, name, picture...).
+
+        Raises:
+            crypt.AppIdentityError: if the token is not valid.
+            requests.RequestException: if the certs could not be fetched.
+    """
+    claims = crypt.verify_signed_jwt_with_certs(
+        id_token, certs.get(_keyId(id_token)),
+        audience=clientSecrets()['client_id'])
+    if claims.get('iss') not in app.config['GOOGLE_ISSUERS']:
+        raise crypt.AppIdentityError('Wrong issuer: %s' % claims.get('iss'))
+    return claims
@@ -0,0 +1,38 @@
+"""
+    Identity of the user making the request.
+
+    g.current_user is resolved once per request, before the view runs. It
+    is built from the login session, where gconnect stores the user's id.
+    For sessions without the id, it comes from the cached email -> id map
+    of auth.getUserId and is then kept in the session. Authenticated pages
+    therefore run no identity query in the steady state. Anonymous
+    requests get None.
+"""
+
+
+from collections import namedtuple
+from flask import g
+from flask import session as login_session
+from sportsbazar import app
+from sportsbazar.auth import getUserId
+
+
+CurrentUser = namedtuple('CurrentUser',
+                         ['id', 'name', 'email', 'picture', 'is_admin'])
+
+
+@app.before_request
+def loadCurrentUser():
+    g.current_user = None
+    if 'username' not in login_session:
+        return
+    user_id = login_session.get('user_id')
+    if user_id is None:
+        user_id = getUserId(login_session['email'])
+        if user_id is None:
+            return
+        login_session['user_id'] = user_id
+    g.current_user = CurrentUser(
+        user_id, login_session['username'], login_session['email'],
+        login_session.get('picture'),
+        login_session['email'] == app.config['ADMIN_EMAIL'])
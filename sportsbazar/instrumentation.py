@@ -0,0 +1,185 @@
+"""
+    Opt-in per request instrumentation.
+
+    When INSTRUMENTATION is set, every request records its wall time, the
+    time spent in and the number of SQL statements (from the engine's
+    cursor events), the time spent rendering templates and the response
+    size. The timings are returned in a Server-Timing header, so they show
+    up in the browser's developer tools, and are handed to the functions
+    registered with onRequestRecorded().
+
+    Requests can also be profiled with cProfile: on demand with
+    ?__profile=1 for the admin, or every PROFILE_EVERY requests. The
+    pstats dumps are written to PROFILE_DIR and can be read with
+    python -m pstats <file>.
+
+    The body of streamed responses (e.g. /catalog.json) is produced after
+    the request is recorded, so its queries are not counted.
+"""
+
+
+import cProfile
+import itertools
+import os
+import time
+from flask import g, request, has_request_context
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sportsbazar import app
+
+
+# Functions called with the record of every instrumented request.
+_listeners = []
+# Request counter used to pick the requests profiled every PROFILE_EVERY.
+_requests = itertools.count(1)
+
+
+def onRequestRecorded(listener):
+    """
+        Registers a function called with the record of every instrumented
+        request: a dict with the endpoint, method, status, wall_ms, db_ms,
+        db_count, template_ms and size (None for streamed responses).
+        Can be used as a decorator.
+    """
+    _listeners.append(listener)
+    return listener
+
+
+def _stats():
+    """
+        Returns the counters of the current request, or None if it is not
+        instrumented.
+    """
+    if not has_request_context():
+        return None
+    return g.get('request_stats')
+
+
+class TimedTemplate(Template):
+    """
+        Jinja template adding its render time to the request's counters.
+        Included and extended templates are rendered within the same call,
+        so they are not counted twice.
+    """
+
+    def render(self, *args, **kwargs):
+        stats = _stats()
+        if stats is None:
+            return Template.render(self, *args, **kwargs)
+        start = time.time()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            stats['template_ms'] += (time.time() - start) * 1000.0
+
+
+app.jinja_env.template_class = TimedTemplate
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _beforeExecute(conn, cursor, statement, parameters, context,
+                   executemany):
+    stats = _stats()
+    if stats is not None:
+        stats['db_started'] = time.time()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _afterExecute(conn, cursor, statement, parameters, context, executemany):
+    stats = _stats()
+    if stats is not None and stats['db_started'] is not None:
+        stats['db_ms'] += (time.time() - stats['db_started']) * 1000.0
+        stats['db_count'] += 1
+        stats['db_started'] = None
+
+
+def _wantsProfile():
+    """
+        Whether the current request is to be profiled.
+    """
+    every = app.config['PROFILE_EVERY']
+    if every and next(_requests) % every == 0:
+        return True
+    # Only a signed in admin (see identity.py) can ask for a profile.
+    return (request.args.get('__profile') == '1' and
+            g.current_user is not None and g.current_user.is_admin)
+
+
+@app.before_request
+def _startRecording():
+    # The metrics (see metrics.py) are built from the same records.
+    if not (app.config['INSTRUMENTATION'] or app.config['METRICS']):
+        return
+    g.request_stats = {'started': time.time(), 'db_started': None,
+                       'db_ms': 0.0, 'db_count': 0, 'template_ms': 0.0}
+    if app.config['INSTRUMENTATION'] and _wantsProfile():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _dumpProfile(profiler):
+    """
+        Writes a profile to PROFILE_DIR and returns the file name.
+    """
+    directory = app.config['PROFILE_DIR']
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, '%s-%s-%d.prof' % (
+        time.strftime('%Y%m%d-%H%M%S'), request.endpoint or 'none',
+        os.getpid()))
+    profiler.dump_stats(path)
+    return path
+
+
+@app.after_request
+def _finishRecording(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        response.headers['X-Profile'] = os.path.basename(
+            _dumpProfile(profiler))
+
+    wall_ms = (time.time() - stats['started']) * 1000.0
+    if app.config['INSTRUMENTATION']:
+        response.headers.add(
+            'Server-Timing',
+            'app;dur=%.1f, db;dur=%.1f;desc="%d queries", tpl;dur=%.1f' % (
+                wall_ms, stats['db_ms'], stats['db_count'],
+                stats['template_ms']))
+    record = {
+        'endpoint': request.endpoint,
+        'method': request.method,
+        'status': response.status_code,
+        'wall_ms': wall_ms,
+        'db_ms': stats['db_ms'],
+        'db_count': stats['db_count'],
+        'template_ms': stats['template_ms'],
+        'size': (None if response.is_streamed
+                 else response.calculate_content_length()),
+    }
+    for listener in _listeners:
+        listener(record)
+    return response
+
+
+@onRequestRecorded
+def _logRecord(record):
+    if not app.config['INSTRUMENTATION']:
+        return
+    app.logger.info(
+        '%(method)s %(endpoint)s %(status)d %(wall_ms).1fms '
+        'db=%(db_ms).1fms/%(db_count)d tpl=%(template_ms).1fms '
+        'size=%(size)s', record)
+
+
+@app.teardown_request
+def _stopProfiler(exception=None):
+    # A request failing before after_request must not leave its profiler
+    # running on this thread.
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
@@ -0,0 +1,485 @@
+"""
+    Bulk import and export of items as CSV or JSON lines.
+
+    Both formats use the columns name, description, price, quantity and
+    category (the category name), so an exported file can be imported
+    again. Imports are read from the upload stream and written in batches
+    of IMPORT_BATCH rows: the names of a batch are checked against the
+    database with a single query, the valid rows go in with one executemany
+    insert (and one update in upsert mode) and every batch is committed on
+    its own. On PostgreSQL, upserts go through INSERT ... ON CONFLICT.
+    Rows failing validation are skipped and reported with their line
+    number. Exports are streamed from a server side cursor.
+"""
+
+
+import csv
+import json
+from cStringIO import StringIO
+from flask import render_template, request, redirect, url_for, flash
+from flask import Response, jsonify, stream_with_context
+from flask import g
+from flask.json import dumps
+from sqlalchemy import bindparam, literal_column
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from sportsbazar import app
+from sportsbazar.db_setup import Category, Item
+from sportsbazar.db_connect import db_connect
+from sportsbazar.cache import touchCategories
+from sportsbazar.conditional import categoryId
+from sportsbazar.validation import itemNameError
+from sportsbazar.views import getCategories
+
+
+# Rows validated, inserted and committed together.
+IMPORT_BATCH = 1000
+# Rows fetched from the cursor at a time by the exports.
+EXPORT_BATCH = 1000
+# Errors listed in an import report, the rest are only counted.
+IMPORT_MAX_ERRORS = 1000
+# Columns of the import and export files.
+ITEM_FIELDS = ('name', 'description', 'price', 'quantity', 'category')
+# File extensions of the supported formats.
+IMPORT_FORMATS = {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl',
+                  'json': 'jsonl'}
+
+
+def _csvRows(stream):
+    """
+        Yields (line, fields, error) for every row of a UTF-8 CSV file
+        whose first row holds the column names.
+    """
+    reader = csv.reader(stream)
+    header = None
+    for row in reader:
+        if header is None:
+            if row and row[0].startswith('\xef\xbb\xbf'):
+                row[0] = row[0][3:]
+            header = [column.strip().lower() for column in row]
+            continue
+        if not any(row):
+            continue
+        try:
+            values = [value.decode('utf-8') for value in row]
+        except UnicodeDecodeError:
+            yield reader.line_num, None, 'Error: Row is not valid UTF-8.'
+            continue
+        yield reader.line_num, dict(zip(header, values)), None
+
+
+def _jsonLines(stream):
+    """
+        Yields (line, fields, error) for every line of a JSON lines file,
+        each line holding one JSON object.
+    """
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            fields = json.loads(text)
+        except ValueError:
+            yield line, None, 'Error: Line is not valid JSON.'
+            continue
+        if not isinstance(fields, dict):
+            yield line, None, 'Error: Line is not a JSON object.'
+            continue
+        yield line, fields, None
+
+
+def _wholeNumber(value, field):
+    """
+        Converts a price or quantity to an int.
+
+        Returns:
+            (value, error): None for an empty value, and the error message
+            if the value is not a positive whole number.
+    """
+    if value is None or value == '':
+        return None, None
+    error = 'Error: %s must be a positive whole number.' % field
+    if isinstance(value, bool):
+        return None, error
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, basestring):
+        try:
+            value = int(value.strip())
+        except ValueError:
+            return None, error
+    if not isinstance(value, (int, long)) or value < 0:
+        return None, error
+    return value, None
+
+
+def _itemValues(fields, categories, default_category_id):
+    """
+        Validates the fields of one row, with the same rules as the item
+        forms.
+
+        Returns:
+            (values, error): the column values of the item, or the error
+            message of the first invalid field.
+    """
+    name = fields.get('name')
+    if name is not None and not isinstance(name, basestring):
+        return None, 'Error: Item name must be text.'
+    error = itemNameError(name)
+    if error:
+        return None, error
+    if len(name) > Item.name.type.length:
+        return None, 'Error: Item name is longer than %d characters.' % (
+            Item.name.type.length)
+
+    category_name = fields.get('category')
+    if category_name:
+        category_id = categories.get(category_name)
+        if category_id is None:
+            return None, ('Error: Could not find any category named "%s" '
+                          'in the record.' % category_name)
+    elif default_category_id is not None:
+        category_id = default_category_id
+    else:
+        return None, 'Error: No category given for the item.'
+
+    description = fields.get('description') or None
+    if description is not None and not isinstance(description, basestring):
+        return None, 'Error: Item description must be text.'
+    price, error = _wholeNumber(fields.get('price'), 'Price')
+    if error:
+        return None, error
+    quantity, error = _wholeNumber(fields.get('quantity'), 'Quantity')
+    if error:
+        return None, error
+
+    return {'name': name, 'description': description, 'price': price,
+            'quantity': quantity, 'category_id': category_id}, None
+
+
+def _batches(rows, size):
+    """
+        Groups an iterable in lists of at most size elements.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _writeBatch(session, batch, user_id, upsert):
+    """
+        Inserts (or updates) one batch of validated rows, without
+        committing.
+
+        Args:
+            batch: (line, values) pairs with distinct names.
+
+        Returns:
+            (inserted, updated, errors)
+    """
+    names = [values['name'] for line, values in batch]
+    existing = dict(
+        (row.name, row) for row in session.query(
+            Item.id, Item.name, Item.user_id, Item.category_id
+        ).filter(Item.name.in_(names)))
+
+    inserts, updates, errors = [], [], []
+    touched = set()
+    for line, values in batch:
+        row = existing.get(values['name'])
+        if row is None:
+            values['user_id'] = user_id
+            inserts.append(values)
+        elif not upsert:
+            errors.append((line, values['name'],
+                           'Error: Item already exists.'))
+            continue
+        elif row.user_id != user_id:
+            errors.append((line, values['name'],
+                           'Error: You cannot edit an item that you did '
+                           'not add !'))
+            continue
+        else:
+            values['item_id'] = row.id
+            updates.append(values)
+            touched.add(row.category_id)
+        touched.add(values['category_id'])
+
+    table = Item.__table__
+    if updates and session.get_bind().dialect.name == 'postgresql':
+        # A single INSERT ... ON CONFLICT for the whole batch, which also
+        # copes with names added since the check above. Rows conflicting
+        # with another user's item are skipped by the WHERE clause and
+        # missing from RETURNING; xmax is 0 for the inserted rows.
+        lines = dict((values['name'], line) for line, values in batch)
+        for values in updates:
+            del values['item_id']
+            values['user_id'] = user_id
+        statement = postgresql.insert(table).values(inserts + updates)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_=dict((column, statement.excluded[column]) for column in (
+                'description', 'price', 'quantity', 'category_id',
+                'updated_at')),
+            where=table.c.user_id == statement.excluded.user_id).returning(
+            table.c.name, literal_column('(xmax = 0)').label('inserted'))
+        written = dict(session.execute(statement).fetchall())
+        for values in inserts + updates:
+            if values['name'] not in written:
+                errors.append((lines[values['name']], values['name'],
+                               'Error: You cannot edit an item that you '
+                               'did not add !'))
+        inserted = sum(1 for name in written if written[name])
+        updated = len(written) - inserted
+    else:
+        if inserts:
+            session.execute(table.insert(), inserts)
+        if updates:
+            session.execute(
+                table.update().where(table.c.id == bindparam('item_id')),
+                updates)
+        inserted, updated = len(inserts), len(updates)
+    touchCategories(session, touched)
+    return inserted, updated, errors
+
+
+def loadItems(session, rows, user_id, default_category_id=None,
+              upsert=False, batch_size=IMPORT_BATCH):
+    """
+        Imports items, committing one batch at a time.
+
+        Args:
+            session: Database session.
+            rows: (line, fields, error) triples, as read by _csvRows() or
+                _jsonLines().
+            user_id (int): Owner of the new items.
+            default_category_id (int): Category of the rows without one.
+            upsert (bool): Overwrite the items that already exist (if
+                owned by user_id) with the row's values instead of
+                rejecting them.
+            batch_size (int): Rows written per transaction.
+
+        Returns:
+            A dict with the number of items inserted, updated and rejected,
+            and the first IMPORT_MAX_ERRORS errors as {line, name, error}.
+    """
+    categories = dict(session.query(Category.name, Category.id))
+    report = {'inserted': 0, 'updated': 0, 'rejected': 0, 'errors': []}
+    seen = set()
+
+    def reject(line, name, error):
+        report['rejected'] += 1
+        if len(report['errors']) < IMPORT_MAX_ERRORS:
+            report['errors'].append(
+                {'line': line, 'name': name, 'error': error})
+
+    for batch in _batches(rows, batch_size):
+        valid = []
+        for line, fields, error in batch:
+            values = None
+            if error is None:
+                values, error = _itemValues(
+                    fields, categories, default_category_id)
+            if error is None and values['name'] in seen:
+                error = 'Error: Item appears more than once in the file.'
+            if error:
+                reject(line, fields.get('name') if fields else None, error)
+                continue
+            seen.add(values['name'])
+            valid.append((line, values))
+        if not valid:
+            continue
+
+        # A concurrent request may add one of the names between the check
+        # and the insert; the batch is then checked again once.
+        for attempt in (1, 2):
+            try:
+                inserted, updated, errors = _writeBatch(
+                    session, [(line, dict(values)) for line, values in valid],
+                    user_id, upsert)
+                session.commit()
+                break
+            except IntegrityError:
+                session.rollback()
+                inserted, updated = 0, 0
+                errors = [(line, values['name'], 'Error: Item already exists.')
+                          for line, values in valid]
+        report['inserted'] += inserted
+        report['updated'] += updated
+        for error in errors:
+            reject(*error)
+    report['errors'].sort(key=lambda error: error['line'])
+    return report
+
+
+def _importFormat(upload):
+    """
+        Returns 'csv' or 'jsonl' from the form or the file name, or None.
+    """
+    if request.form.get('format') in ('csv', 'jsonl'):
+        return request.form['format']
+    if upload is None or '.' not in (upload.filename or ''):
+        return None
+    return IMPORT_FORMATS.get(upload.filename.rsplit('.', 1)[1].lower())
+
+
+def _isEmpty(upload):
+    """
+        Whether an uploaded file has no content, leaving it unread.
+    """
+    position = upload.stream.tell()
+    empty = not upload.stream.read(1)
+    upload.stream.seek(position)
+    return empty
+
+
+def _wantsJson():
+    return request.accept_mimetypes.best == 'application/json'
+
+
+@app.route('/catalog/import', methods=['GET', 'POST'])
+def importItems():
+    """
+    Imports items from an uploaded CSV or JSON lines file.
+    """
+    if g.current_user is None:
+        flash('Please sign in to import items')
+        return redirect('/login')
+
+    categories = getCategories()
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        file_format = _importFormat(upload)
+        category_name = request.form.get('category') or None
+        default_category_id = None
+        error = None
+        if not upload or file_format is None:
+            # No file part, or no file chosen (a part without a name).
+            error = ('Error: Please choose a CSV (.csv) or JSON lines '
+                     '(.jsonl) file.')
+        elif _isEmpty(upload):
+            error = 'Error: The file "%s" is empty.' % upload.filename
+        elif category_name is not None:
+            default_category_id = categoryId(category_name)
+            if default_category_id is None:
+                error = ('Error: Could not find any category named "%s" in '
+                         'the record.' % category_name)
+        if error:
+            if _wantsJson():
+                return jsonify(error=error), 400
+            flash(error)
+            return redirect(url_for('importItems'))
+
+        reader = _csvRows if file_format == 'csv' else _jsonLines
+        report = loadItems(db_connect(), reader(upload.stream),
+                           g.current_user.id, default_category_id,
+                           upsert=bool(request.form.get('upsert')))
+        if _wantsJson():
+            return jsonify(report)
+        flash('%d item(s) added, %d updated and %d rejected.' % (
+            report['inserted'], report['updated'], report['rejected']))
+        return render_template('importitems.html', categories=categories,
+                               category_name=category_name, report=report)
+    else:
+        return render_template('importitems.html', categories=categories,
+                               category_name=request.args.get('category'),
+                               report=None)
+
+
+def _exportRows(session, criterion):
+    """
+        Yields (name, description, price, quantity, category) for the
+        items matching criterion, in id order.
+    """
+    return session.query(
+        Item.name, Item.description, Item.price, Item.quantity,
+        Category.name
+    ).join(Category, Category.id == Item.category_id).filter(
+        criterion
+    ).order_by(Item.id).execution_options(
+        stream_results=True).yield_per(EXPORT_BATCH)
+
+
+def _streamCsv(rows):
+    """
+        Encodes rows as UTF-8 CSV, EXPORT_BATCH rows per chunk.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(ITEM_FIELDS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([value.encode('utf-8')
+                         if isinstance(value, unicode) else value
+                         for value in row])
+        if count % EXPORT_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _streamJsonLines(rows):
+    """
+        Encodes rows as JSON lines, EXPORT_BATCH rows per chunk.
+    """
+    lines = []
+    for row in rows:
+        lines.append(dumps(dict(zip(ITEM_FIELDS, row))))
+        if len(lines) == EXPORT_BATCH:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def _exportResponse(rows, filename):
+    """
+        Streams rows in the format asked for by ?format=csv|jsonl.
+    """
+    if request.args.get('format') == 'jsonl':
+        body, mimetype, extension = \
+            _streamJsonLines(rows), 'application/x-ndjson', 'jsonl'
+    else:
+        body, mimetype, extension = _streamCsv(rows), 'text/csv', 'csv'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers.add('Content-Disposition', 'attachment',
+                         filename='%s.%s' % (
+                             secure_filename(filename) or 'items', extension))
+    return response
+
+
+@app.route('/catalog/<category_name>/export')
+def exportCategoryItems(category_name):
+    """
+    Downloads the items of a category as CSV or JSON lines.
+
+    Args:
+        category_name (str): Name of the category to export.
+    """
+    category_id = categoryId(category_name)
+    if category_id is None:
+        flash('Error: Could not find any category named "%s" in the record.'
+              % category_name)
+        return redirect(url_for('showCategories'))
+    return _exportResponse(
+        _exportRows(db_connect(), Item.category_id == category_id),
+        category_name)
+
+
+@app.route('/catalog/myitems/export')
+def exportMyItems():
+    """
+    Downloads the items added by the user as CSV or JSON lines.
+    """
+    if g.current_user is None:
+        flash('Please sign in to export your items')
+        return redirect(url_for('showLogin'))
+    return _exportResponse(
+        _exportRows(db_connect(), Item.user_id == g.current_user.id),
+        'myitems')
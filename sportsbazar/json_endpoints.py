@@ -3,32 +3,140 @@
 """
 
 
-from flask import jsonify, redirect, url_for, flash
-from sqlalchemy.orm.exc import NoResultFound
+from flask import jsonify, redirect, url_for, flash, abort
+from flask import Response, current_app, stream_with_context
+from flask.json import dumps
 
 from sportsbazar import app
 from sportsbazar.db_setup import Category, Item
 from sportsbazar.db_connect import db_connect
+from sportsbazar.cache import cached
+from sportsbazar.pagination import pageArgs, paginate, addLinkHeader
+from sportsbazar.conditional import conditional, categoryId
+
+
+# Number of rows fetched from the cursor at a time by the catalog stream.
+CATALOG_STREAM_BATCH = 1000
+
+
+def _catalogRows(session):
+    """
+        Yields one (category, items) pair at a time for the whole catalog,
+        in the same shape as Category.serialize, without holding more than
+        a single batch of rows in memory.
+    """
+    rows = session.query(
+        Category.id, Category.name,
+        Item.id, Item.name, Item.description, Item.price, Item.quantity,
+        Item.category_id
+    ).outerjoin(Item, Item.category_id == Category.id).order_by(
+        Category.id, Item.id
+    ).execution_options(stream_results=True).yield_per(CATALOG_STREAM_BATCH)
+
+    current = None
+    for row in rows:
+        if current is None or current['id'] != row[0]:
+            if current is not None:
+                yield current
+            current = {'name': row[1], 'id': row[0], 'Items': []}
+        if row[2] is not None:
+            current['Items'].append({
+                'name': row[3],
+                'id': row[2],
+                'description': row[4],
+                'price': row[5],
+                'quantity': row[6],
+                'category_id': row[7]
+            })
+    if current is not None:
+        yield current
+
+
+def _streamCatalog(session):
+    """
+        Encodes the catalog category by category, producing the same bytes
+        as jsonify(Categories=[cat.serialize for cat in categories]).
+    """
+    pretty = (current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or
+              current_app.debug)
+    if pretty:
+        indent, separators = 2, (', ', ': ')
+        opening, delimiter, closing = '{\n  "Categories": [\n    ', \
+            ', \n    ', '\n  ]\n}\n'
+    else:
+        indent, separators = None, (',', ':')
+        opening, delimiter, closing = '{"Categories":[', ',', ']}\n'
+
+    first = True
+    for category in _catalogRows(session):
+        chunk = dumps(category, indent=indent, separators=separators)
+        if pretty:
+            chunk = chunk.replace('\n', '\n    ')
+        yield (opening if first else delimiter) + chunk
+        first = False
+
+    if first:
+        # Empty catalog: match jsonify's rendering of an empty list.
+        yield '{\n  "Categories": []\n}\n' if pretty else '{"Categories":[]}\n'
+    else:
+        yield closing
 
 
 @app.route('/catalog/JSON')
 @app.route('/catalog.json')
+@conditional('catalog')
 def categoryJSON():
     session = db_connect()
-    categories = session.query(Category).all()
-    return jsonify(Categories=[cat.serialize for cat in categories])
+    return Response(stream_with_context(_streamCatalog(session)),
+                    mimetype=current_app.config['JSONIFY_MIMETYPE'])
 
 
 @app.route('/catalog/<category_name>/JSON')
+@conditional('category')
 def categoryItemsJSON(category_name):
-    session = db_connect()
-    category = session.query(Category).filter_by(name=category_name).one()
-    return jsonify(category=category.serialize)
+    """
+        One page of a category's items (see pagination.py), with the cursor
+        of the next page in 'next_after' and in a Link header.
+    """
+    category_id = categoryId(category_name)
+    if category_id is None:
+        abort(404, 'Category named "%s" is not in the record.'
+              % category_name)
+
+    def load():
+        session = db_connect()
+        items, next_after = paginate(
+            session.query(Item).filter_by(category_id=category_id), Item.id)
+        return {
+            'category': {
+                'name': category_name,
+                'id': category_id,
+                'Items': [i.serialize for i in items]
+            },
+            'next_after': next_after
+        }
+    payload = cached('category_json:%s:%s:%d' % (
+        (category_name,) + pageArgs()), load,
+        scope='category:%d' % category_id)
+    return addLinkHeader(jsonify(payload), payload['next_after'])
 
 
 @app.route('/catalog/<category_name>/<item_name>/JSON')
-def itemJSON(item_name, category_name=None):
-    session = db_connect()
-    item = session.query(Item).filter_by(name=item_name).one()
-    return jsonify(Item=item.serialize)
+@conditional('category')
+def itemJSON(category_name, item_name):
+    category_id = categoryId(category_name)
+
+    def load():
+        session = db_connect()
+        item = session.query(Item).filter_by(
+            name=item_name, category_id=category_id).first()
+        return item.serialize if item is not None else None
+    item = None
+    if category_id is not None:
+        item = cached('item_json:%s:%s' % (category_name, item_name), load,
+                      scope='category:%d' % category_id)
+    if item is None:
+        abort(404, 'No item named "%s" is in "%s" category.' % (
+            item_name, category_name))
+    return jsonify(Item=item)
 # End JSON Endpoints
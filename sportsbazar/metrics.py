@@ -0,0 +1,292 @@
+"""
+    Prometheus metrics of the app, served on /metrics when METRICS is set.
+
+    Each request recorded by instrumentation.py updates per endpoint
+    counters and a latency histogram. Histograms are kept as cumulative
+    bucket counters, so every sample of a process is a plain counter and
+    the samples of several worker processes add up.
+
+    With METRICS_DIR set, each process writes its samples to its own file
+    in that directory (at most every METRICS_FLUSH_INTERVAL seconds, and
+    at exit) and /metrics adds up the files of every process, as the
+    multiprocess mode of the official client does. Counters of processes
+    that exited are kept, gauges (connection pool, cache size) only come
+    from live processes. The directory should be emptied when the server
+    is restarted.
+"""
+
+
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from sportsbazar import app
+from sportsbazar.cache import get_cache_stats
+from sportsbazar.db_connect import get_engine
+from sportsbazar.instrumentation import onRequestRecorded
+
+
+# Upper bounds (seconds) of the latency histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Type and help text of every metric, in the order they are exported.
+METRICS = [
+    ('sportsbazar_requests_total', 'counter',
+     'Requests handled, by endpoint, method and status code.'),
+    ('sportsbazar_request_duration_seconds', 'histogram',
+     'Time taken to handle a request, by endpoint.'),
+    ('sportsbazar_db_queries_total', 'counter',
+     'SQL statements executed, by endpoint.'),
+    ('sportsbazar_db_duration_seconds_total', 'counter',
+     'Time spent executing SQL statements, by endpoint.'),
+    ('sportsbazar_template_duration_seconds_total', 'counter',
+     'Time spent rendering templates, by endpoint.'),
+    ('sportsbazar_response_bytes_total', 'counter',
+     'Size of the responses that are not streamed, by endpoint.'),
+    ('sportsbazar_db_pool_size', 'gauge',
+     'Connections kept open by the pools of the live processes.'),
+    ('sportsbazar_db_pool_checked_out', 'gauge',
+     'Connections in use in the live processes.'),
+    ('sportsbazar_db_pool_overflow', 'gauge',
+     'Connections opened beyond the pool size in the live processes.'),
+    ('sportsbazar_cache_hits_total', 'counter', 'Cache hits, by cache.'),
+    ('sportsbazar_cache_misses_total', 'counter', 'Cache misses, by cache.'),
+    ('sportsbazar_cache_evictions_total', 'counter',
+     'Entries evicted from the local caches, by cache.'),
+    ('sportsbazar_cache_invalidations_total', 'counter',
+     'Invalidations of the local caches, by cache.'),
+    ('sportsbazar_cache_size', 'gauge',
+     'Entries held by the local caches of the live processes, by cache.'),
+    ('sportsbazar_cache_hit_ratio', 'gauge',
+     'Hits over lookups of each cache, over all processes.'),
+]
+
+
+class Samples(object):
+    """
+        Counters of the current process, keyed by (name, labels) where
+        labels is a sorted tuple of (label, value) pairs.
+    """
+
+    def __init__(self):
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._values[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        """
+            Adds an observation to a histogram.
+        """
+        with self._lock:
+            for bound in BUCKETS:
+                if value <= bound:
+                    self._values[(name + '_bucket',
+                                  labels + (('le', repr(bound)),))] += 1
+            self._values[(name + '_bucket', labels + (('le', '+Inf'),))] += 1
+            self._values[(name + '_sum', labels)] += value
+            self._values[(name + '_count', labels)] += 1
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+
+_samples = Samples()
+# (pid, name) of this process' file in METRICS_DIR.
+_file = [None, None]
+_last_flush = [0.0]
+
+
+@onRequestRecorded
+def _recordRequest(record):
+    if not app.config['METRICS']:
+        return
+    endpoint = (('endpoint', record['endpoint'] or 'none'),)
+    _samples.inc('sportsbazar_requests_total', endpoint + (
+        ('method', record['method']), ('status', str(record['status']))))
+    _samples.observe('sportsbazar_request_duration_seconds', endpoint,
+                     record['wall_ms'] / 1000.0)
+    _samples.inc('sportsbazar_db_queries_total', endpoint,
+                 record['db_count'])
+    _samples.inc('sportsbazar_db_duration_seconds_total', endpoint,
+                 record['db_ms'] / 1000.0)
+    _samples.inc('sportsbazar_template_duration_seconds_total', endpoint,
+                 record['template_ms'] / 1000.0)
+    if record['size'] is not None:
+        _samples.inc('sportsbazar_response_bytes_total', endpoint,
+                     record['size'])
+    if time.time() - _last_flush[0] > app.config['METRICS_FLUSH_INTERVAL']:
+        flush()
+
+
+def _processSamples():
+    """
+        Returns (counters, gauges) of this process as lists of
+        [name, labels, value].
+    """
+    counters = [[name, labels, value]
+                for (name, labels), value in _samples.items()]
+    gauges = []
+
+    pool = get_engine().pool
+    if hasattr(pool, 'checkedout'):
+        gauges.append(['sportsbazar_db_pool_size', (), pool.size()])
+        gauges.append(['sportsbazar_db_pool_checked_out', (),
+                       pool.checkedout()])
+        gauges.append(['sportsbazar_db_pool_overflow', (),
+                       max(0, pool.overflow())])
+
+    for namespace, stats in get_cache_stats().items():
+        labels = (('cache', namespace),)
+        for counter in ('hits', 'misses', 'evictions', 'invalidations'):
+            # The Redis caches count their local front cache separately.
+            value = stats.get(counter, stats.get('local_' + counter))
+            if value is not None:
+                counters.append(
+                    ['sportsbazar_cache_%s_total' % counter, labels, value])
+        size = stats.get('size', stats.get('local_size'))
+        if size is not None:
+            gauges.append(['sportsbazar_cache_size', labels, size])
+    return counters, gauges
+
+
+def _fileName():
+    """
+        Returns the name of this process' file in METRICS_DIR, picked again
+        after a fork. The random part keeps a restarted worker with a
+        recycled pid from overwriting the counters of its predecessor.
+    """
+    if _file[0] != os.getpid():
+        _file[:] = [os.getpid(), 'metrics-%d-%s.json' % (
+            os.getpid(), uuid.uuid4().hex[:8])]
+    return _file[1]
+
+
+def flush():
+    """
+        Writes the samples of this process to METRICS_DIR, if set.
+    """
+    directory = app.config['METRICS_DIR']
+    _last_flush[0] = time.time()
+    if not directory:
+        return
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    counters, gauges = _processSamples()
+    path = os.path.join(directory, _fileName())
+    with open(path + '.tmp', 'w') as output:
+        json.dump({'pid': os.getpid(), 'counters': counters,
+                   'gauges': gauges}, output)
+    # Readers never see a half written file.
+    os.rename(path + '.tmp', path)
+
+
+@atexit.register
+def _flushAtExit():
+    if app.config['METRICS'] and app.config['METRICS_DIR']:
+        flush()
+
+
+def _isAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def collect():
+    """
+        Adds up the samples of every process.
+
+        Returns:
+            A dict of {(name, labels): value}.
+    """
+    directory = app.config['METRICS_DIR']
+    if not directory:
+        counters, gauges = _processSamples()
+        files = [{'pid': os.getpid(), 'counters': counters,
+                  'gauges': gauges}]
+    else:
+        flush()
+        files = []
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            try:
+                with open(path) as source:
+                    files.append(json.load(source))
+            except (IOError, ValueError):
+                continue
+
+    totals = defaultdict(float)
+    for content in files:
+        samples = content['counters']
+        if _isAlive(content['pid']):
+            samples = samples + content['gauges']
+        for name, labels, value in samples:
+            totals[(name, tuple(tuple(label) for label in labels))] += value
+
+    for namespace in set(dict(labels).get('cache') for name, labels in totals
+                         if name == 'sportsbazar_cache_hits_total'):
+        labels = (('cache', namespace),)
+        hits = totals[('sportsbazar_cache_hits_total', labels)]
+        lookups = hits + totals[('sportsbazar_cache_misses_total', labels)]
+        if lookups:
+            totals[('sportsbazar_cache_hit_ratio', labels)] = hits / lookups
+    return totals
+
+
+def _formatLabels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, unicode(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for name, value in labels)
+
+
+def _sortKey(sample):
+    (name, labels), value = sample
+    # Buckets are listed by increasing bound, +Inf last.
+    bound = dict(labels).get('le')
+    return (0 if name.endswith('_bucket') else 1, name,
+            tuple(item for item in labels if item[0] != 'le'),
+            float(bound) if bound is not None else 0)
+
+
+def exposition(totals):
+    """
+        Renders samples in the Prometheus text format.
+    """
+    lines = []
+    for metric, kind, description in METRICS:
+        names = (metric,) if kind != 'histogram' else \
+            (metric + '_bucket', metric + '_sum', metric + '_count')
+        samples = sorted([sample for sample in totals.items()
+                          if sample[0][0] in names], key=_sortKey)
+        if not samples:
+            continue
+        lines.append('# HELP %s %s' % (metric, description))
+        lines.append('# TYPE %s %s' % (metric, kind))
+        for (name, labels), value in samples:
+            lines.append('%s%s %r' % (name, _formatLabels(labels),
+                                      float(value)))
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Exports the metrics of every worker in the Prometheus text format.
+    """
+    if not app.config['METRICS']:
+        return app.response_class('Metrics are disabled.\n', status=404,
+                                  mimetype='text/plain')
+    return app.response_class(exposition(collect()),
+                              mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,118 @@
+"""
+    Cache of the rendered category and item pages.
+
+    A page is cached gzipped, under its path and the version token of the
+    scope it depends on (see conditional.py): the token read from the
+    database changes as soon as a change to the category or one of its
+    items is committed, by any process, so a stale page is never served
+    again and simply ages out of the cache.
+
+    Pages are shared by every visitor: there is one copy for anonymous
+    visitors and one for signed in users. The part of the page showing
+    who is signed in (usernav.html) is left out of the cached copy and
+    rendered for each request. Pages with pending flash messages are
+    neither served from nor stored in the cache.
+
+    Anonymous pages are sent as stored to the clients accepting gzip. The
+    same page is thus sent gzipped or not depending on the client and on
+    whether it was cached, which is why conditional.py gives the pages
+    weak ETags.
+"""
+
+
+import gzip
+from functools import wraps
+from cStringIO import StringIO
+from flask import g, request, render_template
+from flask import session as login_session
+from sportsbazar import app
+from sportsbazar.cache import get_cache
+from sportsbazar.compression import negotiate
+from sportsbazar.conditional import scopeName, scopeVersion
+
+
+# Placeholder of usernav.html in the cached pages (see jumbotron.html).
+USER_NAV_MARKER = '<!--sportsbazar:user-nav-->'
+
+
+def get_page_cache():
+    """
+        Returns the process-wide cache of rendered pages.
+    """
+    return get_cache('pages')
+
+
+def _compress(html):
+    buffer = StringIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6) as output:
+        output.write(html.encode('utf-8'))
+    return buffer.getvalue()
+
+
+def _decompress(data):
+    with gzip.GzipFile(fileobj=StringIO(data)) as source:
+        return source.read().decode('utf-8')
+
+
+def _response(data, signed_in):
+    """
+        Builds the response of a cached page.
+    """
+    if not signed_in and negotiate(['gzip']) is not None:
+        response = app.response_class(data, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        html = _decompress(data)
+        if signed_in:
+            html = html.replace(USER_NAV_MARKER,
+                                render_template('usernav.html'), 1)
+        response = app.response_class(html, mimetype='text/html')
+    response.vary.add('Accept-Encoding')
+    response.headers['X-Page-Cache'] = 'hit'
+    return response
+
+
+def cachedPage(scope):
+    """
+        Decorator caching the HTML page rendered by a GET view.
+
+        Args:
+            scope (str): 'category' for the views of a category's pages,
+                taking its name as category_name argument.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not app.config['PAGE_CACHE'] or \
+                    request.method not in ('GET', 'HEAD') or \
+                    '_flashes' in login_session:
+                return view(**kwargs)
+            name = scopeName(scope, kwargs)
+            version = scopeVersion(name) if name else None
+            if version is None:
+                return view(**kwargs)
+
+            signed_in = g.current_user is not None
+            key = 'page:%s:%s:%s' % ('user' if signed_in else 'anon',
+                                     version[0], request.full_path)
+            cache = get_page_cache()
+            data = cache.get(key)
+            if data is not None:
+                return _response(data, signed_in)
+
+            g.defer_user_nav = signed_in
+            try:
+                html = view(**kwargs)
+            finally:
+                g.defer_user_nav = False
+            if not isinstance(html, basestring):
+                return html
+            # Not stored if a message was flashed while rendering.
+            if not login_session.modified:
+                cache.set(key, _compress(html))
+            if signed_in:
+                html = html.replace(USER_NAV_MARKER,
+                                    render_template('usernav.html'), 1)
+            return html
+        return wrapper
+    return decorator
@@ -0,0 +1,76 @@
+"""
+    Keyset (cursor) pagination for the item listings.
+
+    A page is requested with ?after=<id>&limit=N and holds the first N rows
+    whose id is greater than the cursor, so every page costs one index
+    range scan however deep into the listing it is.
+"""
+
+
+from flask import request, url_for
+from sportsbazar import app
+
+
+# Largest id the databases store (a 64 bit integer), cursors are clamped
+# to it.
+MAX_ID = 2 ** 63 - 1
+
+
+def pageArgs():
+    """
+        Reads the cursor and page size from the query string.
+
+        Returns:
+            (after, limit): the last id of the previous page (None for the
+            first page), clamped to +/-MAX_ID, and the number of rows to
+            return, clamped between 1 and PAGE_SIZE_MAX.
+    """
+    after = request.args.get('after', type=int)
+    if after is not None:
+        after = max(-MAX_ID, min(after, MAX_ID))
+    limit = request.args.get('limit', app.config['PAGE_SIZE'], type=int)
+    return after, max(1, min(limit, app.config['PAGE_SIZE_MAX']))
+
+
+def paginate(query, key):
+    """
+        Returns one page of a query ordered by a unique, increasing column.
+
+        Args:
+            query: Query to paginate, already filtered.
+            key: Column used as the cursor, e.g. Item.id.
+
+        Returns:
+            (rows, next_after): the rows of the page and the cursor of the
+            next page, or None if this is the last one.
+    """
+    after, limit = pageArgs()
+    if after is not None:
+        query = query.filter(key > after)
+    rows = query.order_by(key).limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, getattr(rows[-1], key.key)
+    return rows, None
+
+
+def nextPageUrl(next_after, external=False):
+    """
+        Returns the URL of the next page of the current view, or None.
+    """
+    if next_after is None:
+        return None
+    args = dict(request.view_args)
+    args['after'] = next_after
+    args['limit'] = pageArgs()[1]
+    return url_for(request.endpoint, _external=external, **args)
+
+
+def addLinkHeader(response, next_after):
+    """
+        Adds a 'Link: <...>; rel="next"' header pointing to the next page.
+    """
+    if next_after is not None:
+        response.headers['Link'] = '<%s>; rel="next"' % nextPageUrl(
+            next_after, external=True)
+    return response
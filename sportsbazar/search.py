@@ -0,0 +1,179 @@
+"""
+    Full-text search over item names and descriptions.
+
+    Queries go through the full-text index created by
+    db_setup.create_search_index(): the FTS5 table item_fts (ranked with
+    bm25) on SQLite, or the GIN indexed tsvector (ranked with ts_rank) on
+    PostgreSQL. The last word of a query is matched as a prefix, so the
+    endpoints can serve type-ahead suggestions. Databases without the
+    index (other backends, SQLite built without FTS5) are scanned with
+    LIKE instead.
+
+    Results are ordered by relevance, which a keyset cursor can not
+    follow, so they are paginated with ?page=N&limit=N, up to MAX_PAGE.
+"""
+
+
+import re
+from flask import render_template, request, jsonify, url_for
+from sqlalchemy import text
+from sportsbazar import app
+from sportsbazar.db_setup import POSTGRES_SEARCH_VECTOR, search_index_exists
+from sportsbazar.db_connect import db_connect
+from sportsbazar.conditional import categoryId
+from sportsbazar.pagination import pageArgs
+
+
+# Words of a query, anything else (quotes, operators) is ignored.
+WORD = re.compile(r'\w+', re.UNICODE)
+# Longest query accepted, in words.
+MAX_TERMS = 10
+# Deepest page served, the database reads every row of the pages before.
+MAX_PAGE = 1000
+
+SQLITE_SEARCH = """
+    SELECT item.id, item.name, item.description, item.price, item.quantity,
+           item.category_id, category.name AS category_name,
+           bm25(item_fts, 10.0, 1.0) AS rank
+    FROM item_fts
+    JOIN item ON item.id = item_fts.rowid
+    JOIN category ON category.id = item.category_id
+    WHERE item_fts MATCH :query %s
+    ORDER BY rank
+    LIMIT :limit OFFSET :offset
+"""
+
+POSTGRES_SEARCH = """
+    SELECT item.id, item.name, item.description, item.price, item.quantity,
+           item.category_id, category.name AS category_name,
+           ts_rank(%(vector)s, to_tsquery('english', :query)) AS rank
+    FROM item
+    JOIN category ON category.id = item.category_id
+    WHERE %(vector)s @@ to_tsquery('english', :query) %%s
+    ORDER BY rank DESC
+    LIMIT :limit OFFSET :offset
+""" % {'vector': POSTGRES_SEARCH_VECTOR}
+
+# Without a full-text index, fall back to a scan.
+FALLBACK_SEARCH = """
+    SELECT item.id, item.name, item.description, item.price, item.quantity,
+           item.category_id, category.name AS category_name, 0 AS rank
+    FROM item
+    JOIN category ON category.id = item.category_id
+    WHERE (item.name LIKE :query OR item.description LIKE :query) %s
+    ORDER BY item.id
+    LIMIT :limit OFFSET :offset
+"""
+
+
+# Whether the database of each engine URL has the full-text index.
+_indexed = {}
+
+
+def _searchDialect(session):
+    """
+        Returns 'sqlite' or 'postgresql' when the database has the
+        full-text index, None otherwise.
+    """
+    engine = session.bind
+    key = str(engine.url)
+    if key not in _indexed:
+        _indexed[key] = search_index_exists(engine)
+        if not _indexed[key]:
+            app.logger.warning('No full-text index, searching with LIKE.')
+    return engine.dialect.name if _indexed[key] else None
+
+
+def _matchQuery(terms, dialect):
+    """
+        Builds the full-text query matching every term, the last one as a
+        prefix.
+    """
+    if dialect == 'sqlite':
+        return ' '.join('"%s"' % term for term in terms) + '*'
+    if dialect == 'postgresql':
+        return ' & '.join(terms) + ':*'
+    return '%%%s%%' % ' '.join(terms)
+
+
+def searchItems(query, category_id=None, page=1, limit=20):
+    """
+        Finds the items whose name or description match a query.
+
+        Args:
+            query (str): Words to look for.
+            category_id (int): Only return items of this category.
+            page (int): Page of results to return, from 1 to MAX_PAGE.
+            limit (int): Number of results per page.
+
+        Returns:
+            (results, has_next): a list of dicts with the item columns,
+            'category_name' and 'rank', and whether more results follow.
+    """
+    terms = WORD.findall(query)[:MAX_TERMS]
+    if not terms or page > MAX_PAGE:
+        return [], False
+
+    session = db_connect()
+    dialect = _searchDialect(session)
+    statement = {'sqlite': SQLITE_SEARCH,
+                 'postgresql': POSTGRES_SEARCH}.get(dialect, FALLBACK_SEARCH)
+    params = {'query': _matchQuery(terms, dialect),
+              'limit': limit + 1, 'offset': (page - 1) * limit}
+    if category_id is not None:
+        statement = statement % 'AND item.category_id = :category_id'
+        params['category_id'] = category_id
+    else:
+        statement = statement % ''
+
+    rows = session.execute(text(statement), params).fetchall()
+    results = [dict(row.items()) for row in rows[:limit]]
+    return results, len(rows) > limit and page < MAX_PAGE
+
+
+def _searchArgs():
+    """
+        Reads the query, category filter and page from the query string and
+        runs the search.
+
+        Returns:
+            (query, category_name, page, results, next_page)
+    """
+    query = request.args.get('q', '')
+    category_name = request.args.get('category') or None
+    page = max(1, request.args.get('page', 1, type=int))
+    limit = pageArgs()[1]
+
+    category_id = None
+    if category_name is not None:
+        category_id = categoryId(category_name)
+        if category_id is None:
+            return query, category_name, page, [], None
+
+    results, has_next = searchItems(query, category_id, page, limit)
+    return (query, category_name, page, results,
+            page + 1 if has_next else None)
+
+
+@app.route('/catalog/search')
+def searchPage():
+    """
+    Shows the items matching ?q=, optionally within ?category=.
+    """
+    query, category_name, page, results, next_page = _searchArgs()
+    next_url = None
+    if next_page is not None:
+        next_url = url_for('searchPage', q=query, category=category_name,
+                           page=next_page, limit=pageArgs()[1])
+    return render_template('search.html', query=query,
+                           category_name=category_name,
+                           results=results, next_url=next_url)
+
+
+@app.route('/catalog/search/JSON')
+def searchJSON():
+    """
+    JSON version of the search page, also used for type-ahead.
+    """
+    query, category_name, page, results, next_page = _searchArgs()
+    return jsonify(Items=results, page=page, next_page=next_page)
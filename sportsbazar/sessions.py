@@ -0,0 +1,351 @@
+"""
+    Server-side sessions.
+
+    By default (SESSION_STORE 'cookie') the login session is Flask's signed
+    cookie, which holds the whole session: it is sent, verified and
+    deserialized on every request. The other stores keep the session on
+    the server and only send a short opaque id in the cookie:
+        - 'memory': an LRU dict in the process, for a single process;
+        - 'sql': the web_session table of the app's database, shared by
+          every worker;
+        - 'redis': SESSION_REDIS_URL (or CACHE_REDIS_URL), shared by every
+          worker.
+
+    A session is written back only when it changed, or when half of its
+    SESSION_TTL has passed so that it does not expire while in use.
+    renewSession() gives it a new id on login, so that an id handed out
+    before the login cannot be used to ride on it.
+    Expired sessions are swept every SESSION_SWEEP_INTERVAL seconds (Redis
+    expires them itself). Anonymous visitors that never store anything
+    get no session at all.
+"""
+
+
+import base64
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from flask import session as login_session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from flask.sessions import SecureCookieSessionInterface
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import CallbackDict
+from sportsbazar import app
+from sportsbazar.db_setup import WebSession
+from sportsbazar.db_connect import get_engine
+
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+# Session ids: 24 random bytes, URL-safe base64.
+_SID = re.compile(r'^[A-Za-z0-9_-]{32}$')
+REDIS_PREFIX = 'sportsbazar:session:'
+
+
+def _newSid():
+    return base64.urlsafe_b64encode(os.urandom(24))
+
+
+class MemoryStore(object):
+    """
+        Sessions of this process, the least recently used ones dropped
+        beyond max_entries.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        """
+            Returns (data, expires) of a session, or None if it does not
+            exist or expired.
+        """
+        with self._lock:
+            entry = self._entries.pop(sid, None)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self._entries[sid] = entry
+            return entry
+
+    def save(self, sid, data, expires):
+        with self._lock:
+            self._entries.pop(sid, None)
+            self._entries[sid] = (data, expires)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def sweep(self):
+        """
+            Drops the expired sessions and returns their number.
+        """
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (data, expires) in self._entries.items()
+                       if expires <= now]
+            for sid in expired:
+                del self._entries[sid]
+        return len(expired)
+
+
+class SqlStore(object):
+    """
+        Sessions kept in the web_session table. They are always read from
+        and written to the primary database.
+    """
+
+    table = WebSession.__table__
+
+    def load(self, sid):
+        row = get_engine().execute(
+            select([self.table.c.data, self.table.c.expires_at]).where(
+                self.table.c.id == sid)).first()
+        if row is None or row.expires_at <= datetime.utcnow():
+            return None
+        return row.data, time.time() + (
+            row.expires_at - datetime.utcnow()).total_seconds()
+
+    def save(self, sid, data, expires):
+        values = {'data': data,
+                  'expires_at': datetime.utcfromtimestamp(expires)}
+        with get_engine().begin() as connection:
+            updated = connection.execute(self.table.update().where(
+                self.table.c.id == sid).values(**values)).rowcount
+        if updated:
+            return
+        try:
+            get_engine().execute(self.table.insert().values(id=sid, **values))
+        except IntegrityError:
+            # Inserted by a concurrent request of the same session.
+            get_engine().execute(self.table.update().where(
+                self.table.c.id == sid).values(**values))
+
+    def delete(self, sid):
+        get_engine().execute(
+            self.table.delete().where(self.table.c.id == sid))
+
+    def sweep(self):
+        return get_engine().execute(self.table.delete().where(
+            self.table.c.expires_at <= datetime.utcnow())).rowcount
+
+
+class RedisStore(object):
+    """
+        Sessions kept in Redis, which expires them itself.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def load(self, sid):
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.get(REDIS_PREFIX + sid)
+        pipeline.ttl(REDIS_PREFIX + sid)
+        data, ttl = pipeline.execute()
+        if data is None:
+            return None
+        return data, time.time() + (ttl or 0)
+
+    def save(self, sid, data, expires):
+        self.client.setex(REDIS_PREFIX + sid,
+                          max(1, int(expires - time.time())), data)
+
+    def delete(self, sid):
+        self.client.delete(REDIS_PREFIX + sid)
+
+    def sweep(self):
+        return 0
+
+
+def _makeStore(kind):
+    """
+        Creates the store of a SESSION_STORE setting.
+    """
+    if kind == 'memory':
+        return MemoryStore(app.config['SESSION_MAX_ENTRIES'])
+    if kind == 'sql':
+        return SqlStore()
+    if kind == 'redis':
+        url = app.config['SESSION_REDIS_URL'] or app.config['CACHE_REDIS_URL']
+        if url and redis is not None:
+            return RedisStore(redis.StrictRedis.from_url(url))
+        app.logger.warning('Redis is not configured or installed, keeping '
+                           'the sessions in memory.')
+        return MemoryStore(app.config['SESSION_MAX_ENTRIES'])
+    raise ValueError('Unknown SESSION_STORE: %r' % kind)
+
+
+class StoredSession(CallbackDict, SessionMixin):
+    """
+        Session kept in a store. sid is None until it is first saved.
+        Like Flask's SecureCookieSession it records whether it was read,
+        as the response then depends on the cookie.
+    """
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+        self.previous_sid = None
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super(StoredSession, self).__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super(StoredSession, self).get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super(StoredSession, self).setdefault(key, default)
+
+    def renew(self):
+        """
+            Moves the session to a new id when it is saved, dropping the
+            old one.
+        """
+        if self.sid is not None:
+            self.previous_sid = self.previous_sid or self.sid
+        self.sid = None
+        self.new = True
+        self.modified = True
+
+
+def renewSession():
+    """
+        Gives the current session a new id, e.g. on login. The signed
+        cookie session has no id to renew.
+    """
+    if isinstance(login_session._get_current_object(), StoredSession):
+        login_session.renew()
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+        Keeps the sessions in the store picked by SESSION_STORE, or in
+        Flask's signed cookie for 'cookie'.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self):
+        self.cookie_interface = SecureCookieSessionInterface()
+        self._stores = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def store(self, app):
+        """
+            Returns the store of the current SESSION_STORE, or None for the
+            signed cookie.
+        """
+        kind = app.config['SESSION_STORE']
+        if kind == 'cookie':
+            return None
+        store = self._stores.get(kind)
+        if store is None:
+            with self._lock:
+                store = self._stores.get(kind)
+                if store is None:
+                    store = self._stores[kind] = _makeStore(kind)
+        return store
+
+    def open_session(self, app, request):
+        store = self.store(app)
+        if store is None:
+            return self.cookie_interface.open_session(app, request)
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid and _SID.match(sid):
+            entry = store.load(sid)
+            if entry is not None:
+                return StoredSession(self.serializer.loads(entry[0]), sid,
+                                     entry[1])
+        return StoredSession()
+
+    def save_session(self, app, session, response):
+        if not isinstance(session, StoredSession):
+            return self.cookie_interface.save_session(app, session, response)
+        store = self.store(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        if session.previous_sid is not None:
+            store.delete(session.previous_sid)
+
+        if not session:
+            # Emptied, e.g. by logout: forget it on both sides.
+            if (session.sid is not None or session.previous_sid is not None) \
+                    and session.modified:
+                if session.sid is not None:
+                    store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+
+        now = time.time()
+        ttl = app.config['SESSION_TTL']
+        if session.new or session.modified or \
+                session.expires - now < ttl / 2.0:
+            if session.sid is None:
+                session.sid = _newSid()
+            store.save(session.sid, self.serializer.dumps(dict(session)),
+                       now + ttl)
+        self._sweep(store, now)
+
+        if session.new or (session.permanent and
+                           self.should_set_cookie(app, session)):
+            response.set_cookie(
+                app.session_cookie_name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain, path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app))
+
+    def _sweep(self, store, now):
+        if now - self._last_sweep < app.config['SESSION_SWEEP_INTERVAL']:
+            return
+        self._last_sweep = now
+        removed = store.sweep()
+        if removed:
+            app.logger.info('Swept %d expired sessions', removed)
+
+    def createSession(self, app, data):
+        """
+            Stores a session holding data and returns the value of its
+            cookie, e.g. to log a client in from a script.
+        """
+        store = self.store(app)
+        if store is None:
+            return self.cookie_interface.get_signing_serializer(app).dumps(
+                data)
+        sid = _newSid()
+        store.save(sid, self.serializer.dumps(data),
+                   time.time() + app.config['SESSION_TTL'])
+        return sid
+
+
+app.session_interface = ServerSessionInterface()
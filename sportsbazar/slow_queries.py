@@ -0,0 +1,219 @@
+"""
+    Log of the SQL statements slower than SLOW_QUERY_THRESHOLD_MS.
+
+    Slow statements are logged with the view that ran them and, the first
+    time a statement is seen, its query plan: EXPLAIN QUERY PLAN on
+    SQLite, EXPLAIN on PostgreSQL (EXPLAIN ANALYZE with
+    SLOW_QUERY_EXPLAIN_ANALYZE, for SELECT statements only, as it runs the
+    statement again). On PostgreSQL the EXPLAIN runs in a savepoint that
+    is rolled back, so that it can neither abort nor change the request's
+    transaction. They are also aggregated in memory by normalized
+    statement (literals and IN lists replaced by placeholders), and the
+    top offenders are listed on /admin/slow-queries for the admin.
+
+    Parameters are only logged at DEBUG level, and never for the
+    statements on SENSITIVE_TABLES (the server-side sessions hold OAuth
+    access tokens).
+
+    The time measured is the time to execute the statement, not to fetch
+    rows streamed afterwards.
+"""
+
+
+import re
+import threading
+import time
+from flask import jsonify, redirect, url_for, flash, has_request_context
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sportsbazar import app
+
+
+# Literals and lists of placeholders, replaced to group statements.
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:\?|%\(\w+\)s|:\w+)\s*,?)+\)',
+                      re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+# Statements kept in the aggregation, the others are only logged.
+MAX_STATEMENTS = 500
+# Tables whose statements' parameters are never logged or kept.
+SENSITIVE_TABLES = ('web_session',)
+_SENSITIVE = re.compile(r'\b(?:%s)\b' % '|'.join(SENSITIVE_TABLES),
+                        re.IGNORECASE)
+REDACTED = '<redacted>'
+# Savepoint wrapping the EXPLAIN on PostgreSQL.
+_SAVEPOINT = 'slow_query_explain'
+
+
+def redact(statement, parameters):
+    """
+        Returns the parameters of a statement as they can be logged.
+    """
+    if _SENSITIVE.search(statement):
+        return REDACTED
+    return parameters
+
+
+def normalize(statement):
+    """
+        Returns statement with its literals replaced by ? and its IN lists
+        by IN (...), so that the runs of a query with different values are
+        grouped.
+    """
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _IN_LIST.sub('IN (...)', statement)
+    return _SPACES.sub(' ', statement).strip()
+
+
+class SlowQueries(object):
+    """
+        Slow statements of this process, aggregated by normalized
+        statement.
+    """
+
+    def __init__(self):
+        self._statements = {}
+        self._lock = threading.Lock()
+
+    def add(self, statement, duration_ms, parameters, endpoint):
+        """
+            Records a slow run of statement.
+
+            Returns:
+                True if the statement was not seen before.
+        """
+        key = normalize(statement)
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                if len(self._statements) >= MAX_STATEMENTS:
+                    return False
+                entry = self._statements[key] = {
+                    'statement': key, 'count': 0, 'total_ms': 0.0,
+                    'max_ms': 0.0, 'endpoints': set(), 'plan': None,
+                }
+            first = entry['count'] == 0
+            entry['count'] += 1
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            entry['last_parameters'] = repr(redact(statement, parameters))
+            if endpoint is not None:
+                entry['endpoints'].add(endpoint)
+            return first
+
+    def setPlan(self, statement, plan):
+        with self._lock:
+            entry = self._statements.get(normalize(statement))
+            if entry is not None:
+                entry['plan'] = plan
+
+    def top(self, count=20):
+        """
+            Returns the count statements with the largest total time.
+        """
+        with self._lock:
+            entries = [dict(entry, endpoints=sorted(entry['endpoints']))
+                       for entry in self._statements.values()]
+        entries.sort(key=lambda entry: entry['total_ms'], reverse=True)
+        return entries[:count]
+
+    def clear(self):
+        with self._lock:
+            self._statements.clear()
+
+
+slow_queries = SlowQueries()
+
+
+def explain(conn, statement, parameters):
+    """
+        Returns the query plan of a statement as text, or None if the
+        backend or the statement is not supported.
+
+        Runs on the DBAPI connection, so that the EXPLAIN itself is not
+        seen by the engine events. On PostgreSQL it runs in a savepoint,
+        rolled back whatever happens: a failing EXPLAIN leaves the
+        transaction usable, and whatever ANALYZE ran is undone.
+    """
+    dialect = conn.dialect.name
+    savepoint = dialect == 'postgresql'
+    if dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif dialect == 'postgresql' and \
+            statement.lstrip().upper().startswith('SELECT'):
+        prefix = 'EXPLAIN ANALYZE ' if \
+            app.config['SLOW_QUERY_EXPLAIN_ANALYZE'] else 'EXPLAIN '
+    else:
+        return None
+    cursor = conn.connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute('SAVEPOINT ' + _SAVEPOINT)
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        finally:
+            if savepoint:
+                cursor.execute('ROLLBACK TO SAVEPOINT ' + _SAVEPOINT)
+                cursor.execute('RELEASE SAVEPOINT ' + _SAVEPOINT)
+    except Exception as error:
+        return 'EXPLAIN failed: %s' % error
+    finally:
+        cursor.close()
+    # SQLite returns (id, parent, notused, detail), PostgreSQL one column.
+    return '\n'.join(row[-1] for row in rows)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _startTimer(conn, cursor, statement, parameters, context, executemany):
+    if app.config['SLOW_QUERY_THRESHOLD_MS'] is not None:
+        conn.info.setdefault('slow_query_start', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _checkTimer(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('slow_query_start')
+    if not starts:
+        return
+    duration_ms = (time.time() - starts.pop()) * 1000.0
+    threshold = app.config['SLOW_QUERY_THRESHOLD_MS']
+    if threshold is None or duration_ms < threshold:
+        return
+
+    endpoint = request.endpoint if has_request_context() else None
+    first = slow_queries.add(statement, duration_ms, parameters, endpoint)
+    plan = None
+    if first and app.config['SLOW_QUERY_EXPLAIN'] and not executemany:
+        plan = explain(conn, statement, parameters)
+        slow_queries.setPlan(statement, plan)
+    app.logger.warning(
+        'Slow query (%.1f ms) in %s: %s%s',
+        duration_ms, endpoint or 'no request', statement,
+        '\nPlan:\n%s' % plan if plan else '')
+    app.logger.debug('Parameters of the slow query: %r',
+                     redact(statement, parameters))
+
+
+@event.listens_for(Engine, 'handle_error')
+def _dropTimer(context):
+    # A failed statement never reaches after_cursor_execute.
+    starts = context.connection.info.get('slow_query_start') \
+        if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+@app.route('/admin/slow-queries')
+def showSlowQueries():
+    """
+    Lists the slowest statements by total time, for the admin.
+    """
+    if g.current_user is None or not g.current_user.is_admin:
+        flash('Warning: Only admin(s) can see the slow queries.')
+        return redirect(url_for('showCategories'))
+    count = request.args.get('count', 20, type=int)
+    return jsonify(threshold_ms=app.config['SLOW_QUERY_THRESHOLD_MS'],
+                   statements=slow_queries.top(count))
@@ -0,0 +1,27 @@
+"""
+    Validation rules for the names entered by users, shared by the item
+    forms and the bulk import.
+"""
+
+
+# Item names that would be mistaken for parts of a route.
+ITEM_ROUTE_KEYWORDS = ('categories', 'item', 'items')
+
+
+def itemNameError(name):
+    """
+        Checks the name of a new or edited item.
+
+        Args:
+            name (str): Name entered for the item.
+
+        Returns:
+            The error message to show, or None if the name is valid.
+            Duplicate names are not checked here, they are rejected by the
+            unique index on item.name.
+    """
+    if (not name) or name.isspace():
+        return "Error: Item cannot be created with an empty name field."
+    if name.lower() in ITEM_ROUTE_KEYWORDS:
+        return "Error: Route keywords cannot be used as item name(s)."
+    return None
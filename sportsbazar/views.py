@@ -3,76 +3,129 @@ Script to manage the routes / URLs
 """
 
 import os
+from collections import namedtuple
 from flask import render_template, request, redirect, url_for, flash
-from flask import send_from_directory
-from flask import session as login_session
-from sqlalchemy import desc, asc, literal
+from flask import send_from_directory, jsonify, abort
+from flask import g
+from sqlalchemy import desc, asc
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager
 from sqlalchemy.orm.exc import NoResultFound
 
 from sportsbazar import app
-from sportsbazar.db_setup import Category, Item, User
+from sportsbazar.db_setup import Category, Item
 from sportsbazar.db_connect import db_connect
-from sportsbazar.auth import getUserId
+from sportsbazar.cache import cached
+from sportsbazar.pagination import paginate, nextPageUrl
+from sportsbazar.conditional import conditional, categoryId
+from sportsbazar.page_cache import cachedPage
+from sportsbazar.validation import itemNameError
+
+
+# Detached, cacheable copy of the category columns used by the templates.
+CategoryRow = namedtuple('CategoryRow', ['id', 'name'])
+# Same for the latest items listed on the homepage.
+LatestItemRow = namedtuple('LatestItemRow', ['name', 'category_name'])
+
+
+def findItem(category_name, item_name):
+    """
+    Loads an item together with its category and owner in a single query.
+
+    Args:
+        category_name (str): Name of the category of the item.
+        item_name (str): Name of the item.
+
+    Returns:
+        The item, with item.category and item.user already loaded.
+        Aborts with a 404 if there is no such item in the category.
+    """
+    session = db_connect()
+    item = session.query(Item).join(Item.category).outerjoin(
+        Item.user).options(
+        contains_eager(Item.category), contains_eager(Item.user)).filter(
+        Item.name == item_name, Category.name == category_name).first()
+    if item is None:
+        abort(404, 'No item named "%s" is in "%s" category.' % (
+            item_name, category_name))
+    return item
+
+
+def getCategories():
+    """
+    Returns every category sorted by name, served from the catalog cache.
+    """
+    def load():
+        session = db_connect()
+        return [CategoryRow(*row) for row in session.query(
+            Category.id, Category.name).order_by(asc(Category.name))]
+    return cached('categories', load, scope='categories')
 
 
 @app.route('/')
 @app.route('/catalog/')
+@conditional('catalog', per_user=True)
 def homepage():
     """
     Shows the Homepage that list the 10 recently added items.
     """
-    session = db_connect()
-    categories = session.query(Category).order_by(asc(Category.name)).all()
-    latest_items = session.query(Item).order_by(desc(Item.id))[0:10]
-    session.close()
+    def load():
+        session = db_connect()
+        return [LatestItemRow(*row) for row in session.query(
+            Item.name, Category.name).join(
+            Category, Category.id == Item.category_id).order_by(
+            desc(Item.id))[0:10]]
+    categories = getCategories()
+    latest_items = cached('latest_items', load, scope='catalog')
     return render_template('homepage.html',
                            categories=categories,
                            latest_items=latest_items)
 
 
 @app.route('/catalog/categories/')
+@conditional('catalog', per_user=True)
 def showCategories():
     """
     Shows all categories.
     """
-    session = db_connect()
-    categories = session.query(Category).order_by(asc(Category.name)).all()
+    categories = getCategories()
     if (not categories):
         flash('Warning: No category is added yet.')
-    session.close()
     return render_template('categories.html', categories=categories)
 
 
 @app.route('/catalog/<category_name>/')
+@conditional('category', per_user=True)
+@cachedPage('category')
 def showItems(category_name):
     """
-    Shows items in a specific category.
+    Shows items in a specific category, one page at a time.
 
     Args:
         category_name (str): Name of the category to be displayed.
 
     Returns:
-        A web page: showing all the items in the specified category.
-        Homepage: if the specified category does not exist.
+        A web page: showing a page of the items in the specified category.
+        A 404 page: if the specified category does not exist.
     """
-    session = db_connect()
-    # check for invalid category
-    try:
-        category = session.query(Category).filter_by(name=category_name).one()
-    except NoResultFound:
-        flash('Error: Category named "%s" is not in the record.'
+    # the category's id comes from the catalog cache
+    category_id = categoryId(category_name)
+    if category_id is None:
+        abort(404, 'Category named "%s" is not in the record.'
               % category_name)
-        session.close()
-        return redirect(url_for('showCategories'))
-    category = session.query(Category).filter_by(name=category_name).one()
-    items = session.query(Item).filter_by(category_id=category.id).all()
-    if not items:
+    category = CategoryRow(category_id, category_name)
+    session = db_connect()
+    items, next_after = paginate(
+        session.query(Item).filter_by(category_id=category.id), Item.id)
+    if not items and 'after' not in request.args:
         flash('Warning: No item is added in this category yet.')
-    session.close()
-    return render_template('items.html', items=items, category=category)
+    return render_template('items.html', items=items, category=category,
+                           next_url=nextPageUrl(next_after))
 
 
 @app.route('/catalog/<category_name>/<item_name>/')
+@conditional('category', per_user=True)
+@cachedPage('category')
 def showItem(category_name, item_name):
     """
     Shows the details of a particular item from the specified category.
@@ -84,53 +137,34 @@ def showItem(category_name, item_name):
 
     Returns:
         A web page displaying the information of the specified item.
+        A 404 page: if there is no such item in the category.
     """
-    session = db_connect()
-    # check for invalid category
-    try:
-        category = session.query(Category).filter_by(name=category_name).one()
-    except NoResultFound:
-        flash('Error: Could not find any category named "%s" in the record.'
-              % category_name)
-        session.close()
-        return redirect(url_for('showCategories'))
-    # check for invalid item
-    try:
-        item = session.query(Item).filter_by(
-            name=item_name, category_id=category.id).one()
-    except NoResultFound:
-        flash('Error: No item named "%s" is in "%s" category.' % (
-            item_name, category_name))
-        session.close()
-        return redirect(url_for('showItems', category_name=category_name))
-
-    user = session.query(User).filter_by(id=item.user_id).one()
-    session.close()
+    item = findItem(category_name, item_name)
     return render_template(
-        'item.html', item=item, category=category, user=user)
+        'item.html', item=item, category=item.category, user=item.user)
 
 
 @app.route('/catalog/myitems/')
 def showMyItems():
     """
-    Displays the items added by a user.
+    Displays the items added by a user, one page at a time.
     """
-    if 'username' not in login_session:
+    if g.current_user is None:
         flash('Please sign in to view your items !')
         return redirect(url_for('showLogin'))
 
-    user_id = getUserId(login_session['email'])
-
     session = db_connect()
-    categories = session.query(Category).all()
-    items = session.query(Item).filter_by(user_id=user_id).all()
-    session.close()
-    if not items:
+    items, next_after = paginate(
+        session.query(Item.id, Item.name, Item.description, Item.price,
+                      Category.name.label('category_name')).join(
+            Category, Category.id == Item.category_id).filter(
+            Item.user_id == g.current_user.id), Item.id)
+    if not items and 'after' not in request.args:
         flash("Warning: You have not added any item yet.")
         return redirect(url_for('homepage'))
     else:
         return render_template(
-            'myitems.html', categories=categories, items=items)
+            'myitems.html', items=items, next_url=nextPageUrl(next_after))
 
 
 @app.route('/catalog/new', methods=['GET', 'POST'])
@@ -138,11 +172,11 @@ def newCategory():
     """
     Interface for the user to add a new category.
     """
-    if 'username' not in login_session:
+    if g.current_user is None:
         flash('Warning: Please sign in to add new category.')
         return redirect('/login')
     else:
-        if login_session['email'] != app.config['ADMIN_EMAIL']:
+        if not g.current_user.is_admin:
             flash(
                 'Warning: Only admin(s) can add, remove or modify a category.')
             return redirect(url_for('showCategories'))
@@ -154,34 +188,29 @@ def newCategory():
         if (not request.form['name']) or (request.form['name'].isspace()):
             flash(
                 "Error: Category cannot be created with an empty name field.")
-            session.close()
             return redirect(url_for('newCategory'))
         # Check for invalid input
-        if (request.form['name'].lower() == "categories".lower()):
-            # Setting "categories" as category name will cause routing issues
+        if (request.form['name'].lower() == "categories".lower()) or \
+           (request.form['name'].lower() == "search".lower()):
+            # Setting "categories" or "search" as category name will cause
+            # routing issues
             flash("Error: Route keywords cannot be used as category name(s).")
-            session.close()
             return redirect(url_for('newCategory'))
 
-        # Check for duplicate category name
-        category = session.query(Category).filter(
-            Category.name == request.form['name'])
-        isDuplicate = (session.query(literal(True)).
-                       filter(category.exists()).scalar())
-        if (isDuplicate):
+        newCategory = Category(
+            name=request.form['name'], user_id=app.config['ADMIN_ID'])
+        session.add(newCategory)
+        # Duplicate category names are rejected by the unique index
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
             flash("Category already exists. "
                   "Please enter a new one.")
-            session.close()
             return redirect(url_for('newCategory'))
-        else:
-            newCategory = Category(
-                name=request.form['name'], user_id=app.config['ADMIN_ID'])
-            session.add(newCategory)
-            flash(
-                'New category "%s" is successfully added.' % newCategory.name)
-            session.commit()
-            session.close()
-            return redirect(url_for('showCategories'))
+        flash('New category "%s" is successfully added.'
+              % request.form['name'])
+        return redirect(url_for('showCategories'))
     else:
         return render_template('newcategory.html')
 
@@ -194,11 +223,11 @@ def editCategory(category_name):
     Args:
     category_name (str): Name of category to be edited.
     """
-    if 'username' not in login_session:
+    if g.current_user is None:
         flash('Warning: Please sign in to edit the category.')
         return redirect('/login')
     else:
-        if login_session['email'] != app.config['ADMIN_EMAIL']:
+        if not g.current_user.is_admin:
             flash(
                 'Warning: Only admin(s) can add, remove or modify a category.')
             return redirect(url_for('showCategories'))
@@ -211,49 +240,41 @@ def editCategory(category_name):
     except NoResultFound:
         flash('Error: Could not find any category named "%s" in the record.'
               % category_name)
-        session.close()
         return redirect(url_for('showCategories'))
 
     if (request.method == 'POST'):
-        # Check for duplicate with category name
-        if request.form['name'] != categoryToEdit.name:
-            category = session.query(Category).filter(
-                Category.name == request.form['name'])
-            isDuplicate = (session.query(literal(True)).
-                           filter(category.exists()).scalar())
-            if (isDuplicate):
-                flash("Error: Category already exists. "
-                      "Please enter a new one.")
-                session.close()
-                return render_template(
-                    'editcategory.html', category=categoryToEdit)
-
         # Check for empty name
         if (not request.form['name']) or (request.form['name'].isspace()):
             flash(
                 "Error: Category cannot be created with an empty name field.")
-            session.close()
             return render_template(
                 'editcategory.html', category=categoryToEdit)
 
         # Check for invalid input
-        if (request.form['name'].lower() == "categories".lower()):
-            # Setting "categories" as category name will cause routing issues
+        if (request.form['name'].lower() == "categories".lower()) or \
+           (request.form['name'].lower() == "search".lower()):
+            # Setting "categories" or "search" as category name will cause
+            # routing issues
             flash("Error: Route keywords cannot be used as category name(s).")
-            session.close()
             return render_template(
                 'editcategory.html', category=categoryToEdit)
         else:
             categoryToEdit.name = request.form['name']
             editedCategoryName = categoryToEdit.name
             session.add(categoryToEdit)
-            session.commit()
-            session.close()
+            # Duplicate category names are rejected by the unique index
+            try:
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                flash("Error: Category already exists. "
+                      "Please enter a new one.")
+                return render_template(
+                    'editcategory.html', category=categoryToEdit)
             flash('Category successfully updated.')
             return redirect(url_for(
                 'showItems', category_name=editedCategoryName))
     else:
-        session.close()
         return render_template('editcategory.html', category=categoryToEdit)
 
 
@@ -265,11 +286,11 @@ def deleteCategory(category_name):
     Args:
         item_name (str): Name of the category to be deleted.
     """
-    if 'username' not in login_session:
+    if g.current_user is None:
         flash('Please sign in to delete the category.')
         return redirect('/login')
     else:
-        if login_session['email'] != app.config['ADMIN_EMAIL']:
+        if not g.current_user.is_admin:
             flash(
                 'Warning: Only admin(s) can add, remove or modify a category.')
             return redirect(url_for('showCategories'))
@@ -282,7 +303,6 @@ def deleteCategory(category_name):
     except NoResultFound:
         flash('Error: Could not find any category named "%s" in the record.'
               % category_name)
-        session.close()
         return redirect(url_for('showCategories'))
 
     if (request.method == 'POST'):
@@ -291,7 +311,6 @@ def deleteCategory(category_name):
         session.commit()
         return redirect(url_for('showCategories'))
     else:
-        session.close()
         return render_template(
             'deletecategory.html', category=categoryToDelete)
 
@@ -304,7 +323,7 @@ def newItem(category_name):
     Args:
         category_name (str): Name of the category to which item is to be added.
     """
-    if 'username' not in login_session:
+    if g.current_user is None:
         flash('Please sign in to add new item')
         return redirect('/login')
 
@@ -315,49 +334,34 @@ def newItem(category_name):
     except NoResultFound:
         flash('Error: Could not find any category named "%s" in the record.'
               % category_name)
-        session.close()
         return redirect(url_for('showCategories'))
 
     if (request.method == 'POST'):
 
-        # Check for empty name
-        if (not request.form['name']) or (request.form['name'].isspace()):
-            flash("Error: Item cannot be created with an empty name field.")
-            session.close()
+        # Check for empty name and route keywords
+        error = itemNameError(request.form['name'])
+        if error:
+            flash(error)
             return redirect(url_for('newItem', category_name=category_name))
 
-        # Check for invalid input
-        if (request.form['name'].lower() == "categories".lower()) or \
-           ((request.form['name'].lower() == "item".lower())) or \
-           ((request.form['name'].lower() == "items".lower())):
-                flash("Error: Route keywords cannot be used as item name(s).")
-                session.close()
-                return redirect(url_for(
-                    'newItem', category_name=category_name))
-
-        # Check for duplicate name values
-        item = session.query(Item).filter(Item.name == request.form['name'])
-        isDuplicate = (session.query(literal(True)).
-                       filter(item.exists()).scalar())
-        if (isDuplicate):
+        newItem = Item(category_id=category.id,
+                       user_id=g.current_user.id,
+                       name=request.form['name'],
+                       description=request.form['description'],
+                       price=request.form['price'],
+                       quantity=request.form['quantity'],)
+        session.add(newItem)
+        # Duplicate item names are rejected by the unique index
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
             flash("Error: Item already exists. "
                   "Please enter a new one.")
-            session.close()
             return redirect(url_for('newItem', category_name=category_name))
-        else:
-            newItem = Item(category_id=category.id,
-                           user_id=login_session['user_id'],
-                           name=request.form['name'],
-                           description=request.form['description'],
-                           price=request.form['price'],
-                           quantity=request.form['quantity'],)
-            session.add(newItem)
-            flash('New item "%s" is successfully added.' % newItem.name)
-            session.commit()
-            session.close()
-            return redirect(url_for('showItems', category_name=category_name))
+        flash('New item "%s" is successfully added.' % request.form['name'])
+        return redirect(url_for('showItems', category_name=category_name))
     else:
-        session.close()
         return render_template('newitem.html', category=category)
 
 
@@ -370,64 +374,31 @@ def editItem(item_name, category_name):
     Args:
         item_name (str): Name of item to be edited.
         category_name (str): Name of the catrgory to which the item belongs.
+
+    Returns:
+        A 404 page: if there is no such item in the category.
     """
-    if 'username' not in login_session:
+    if g.current_user is None:
         flash('Please sign in to edit your item')
         return redirect('/login')
 
     session = db_connect()
-    # check for invalid category
-    try:
-        category = session.query(Category).filter_by(name=category_name).one()
-        editedItemCategory = category.name
-    except NoResultFound:
-        flash('Error: Could not find any category named "%s" in the record.'
-              % category_name)
-        session.close()
-        return redirect(url_for('showCategories'))
-    # check for invalid item
-    try:
-        itemToEdit = session.query(Item).filter_by(
-            name=item_name, category_id=category.id).one()
-    except NoResultFound:
-        flash('Error: No item named "%s" is in "%s" category.'
-              % (item_name, category_name))
-        session.close()
-        return redirect(url_for('showItems', category_name=category_name))
+    # the item and its category in one query, or a 404
+    itemToEdit = findItem(category_name, item_name)
+    category = itemToEdit.category
+    editedItemCategory = category.name
 
-    if login_session['user_id'] != itemToEdit.user_id:
+    if g.current_user.id != itemToEdit.user_id:
         flash("Error: You cannot edit an item that you did not add !")
         return redirect(url_for('showMyItems'))
 
     if (request.method == 'POST'):
-        # Check for duplicate name values
-        if not request.form['name'] == itemToEdit.name:
-            item = session.query(Item).filter(
-                Item.name == request.form['name'])
-            isDuplicate = (session.query(literal(True)).
-                           filter(item.exists()).scalar())
-            if (isDuplicate):
-                flash("Error: Item already exists. "
-                      "Please enter a new one.")
-                session.close()
-                return render_template(
-                    'editItem.html', category=category, item=itemToEdit)
-
-        # Check for empty name
-        if (not request.form['name']) or (request.form['name'].isspace()):
-            flash("Error: Item cannot be created with an empty name field.")
-            session.close()
+        # Check for empty name and route keywords
+        error = itemNameError(request.form['name'])
+        if error:
+            flash(error)
             return render_template(
-                'editItem.html', category=category, item=itemToEdit)
-
-        # Check for invalid keywords
-        if (request.form['name'].lower() == "categories".lower()) or \
-           ((request.form['name'].lower() == "item".lower())) or \
-           ((request.form['name'].lower() == "items".lower())):
-                flash("Error: Route keywords cannot be used as item name(s).")
-                session.close()
-                return render_template(
-                    'editItem.html', category=category, item=itemToEdit)
+                'edititem.html', category=category, item=itemToEdit)
         else:
             itemToEdit.name = request.form['name']
             editedItemName = itemToEdit.name
@@ -438,14 +409,20 @@ def editItem(item_name, category_name):
             if request.form['quantity']:
                 itemToEdit.quantity = request.form['quantity']
             session.add(itemToEdit)
-            session.commit()
-            session.close()
+            # Duplicate item names are rejected by the unique index
+            try:
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                flash("Error: Item already exists. "
+                      "Please enter a new one.")
+                return render_template(
+                    'edititem.html', category=category, item=itemToEdit)
             flash('Item successfully updated.')
             return redirect(url_for('showItem',
                                     category_name=editedItemCategory,
                                     item_name=editedItemName))
     else:
-        session.close()
         return render_template('edititem.html',
                                category=category,
                                item=itemToEdit)
@@ -460,31 +437,20 @@ def deleteItem(item_name, category_name):
     Args:
         item_name (str): Name of the item to be deleted.
         category_name (str): Name of the catrgory to which the item belongs.
+
+    Returns:
+        A 404 page: if there is no such item in the category.
     """
-    if 'username' not in login_session:
+    if g.current_user is None:
         flash('Please sign in to delete your item')
         return redirect('/login')
 
     session = db_connect()
-    # check for invalid category
-    try:
-        category = session.query(Category).filter_by(name=category_name).one()
-    except NoResultFound:
-        flash('Error: Could not find any category named "%s" in the record.'
-              % category_name)
-        session.close()
-        return redirect(url_for('showCategories'))
-    # check for invalid item
-    try:
-        itemToDelete = session.query(Item).filter_by(
-            name=item_name, category_id=category.id).one()
-    except NoResultFound:
-        flash('Error: No item named "%s" is in "%s" category.'
-              % (item_name, category_name))
-        session.close()
-        return redirect(url_for('showItems', category_name=category_name))
+    # the item and its category in one query, or a 404
+    itemToDelete = findItem(category_name, item_name)
+    category = itemToDelete.category
 
-    if login_session['user_id'] != itemToDelete.user_id:
+    if g.current_user.id != itemToDelete.user_id:
         flash("Error: You cannot delete an item that you did not add !")
         return redirect(url_for('showMyItems'))
 
@@ -492,9 +458,20 @@ def deleteItem(item_name, category_name):
         session.delete(itemToDelete)
         flash('Item "%s" successfully deleted !' % itemToDelete.name)
         session.commit()
-        session.close()
         return redirect(url_for('showItems', category_name=category_name))
     else:
-        session.close()
         return render_template(
             'deleteitem.html', category=category, item=itemToDelete)
+
+
+@app.errorhandler(404)
+def pageNotFound(error):
+    """
+    Renders the 404 responses: JSON for the JSON endpoints, a web page
+    otherwise.
+    """
+    if request.path.endswith(('JSON', '.json')):
+        response = jsonify(error='Not Found', message=error.description)
+        response.status_code = 404
+        return response
+    return render_template('404.html', message=error.description), 404
@@ -0,0 +1,143 @@
+"""
+    Fixtures shared by the tests.
+
+    The app runs against a temporary SQLite database, created empty for
+    every test. Run the tests from the project root with:
+        python -m pytest tests
+    The PostgreSQL tests run against the database of DATABASE_URL, which
+    they empty, and are skipped without it:
+        DATABASE_URL=postgresql://user@host/test python -m pytest tests
+"""
+
+
+import os
+import shutil
+import tempfile
+import uuid
+import pytest
+
+# The database must be configured before sportsbazar loads its config.
+_db_dir = tempfile.mkdtemp(prefix='sportsbazar-tests-')
+os.environ['SPORTSBAZAR_DB_URL'] = 'sqlite:///%s' % os.path.join(
+    _db_dir, 'sportsbazar.db')
+
+from sqlalchemy import create_engine, event
+from sportsbazar import app
+from sportsbazar import cache
+from sportsbazar.db_connect import db_connect, dispose_engine, get_engine
+from sportsbazar.db_setup import db_create, Base, Category, Item, User
+
+
+app.config['TESTING'] = True
+app.secret_key = 'test-secret-key'
+
+
+class QueryCounter(object):
+    """
+        Counts the statements sent to the database.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+
+@pytest.fixture
+def database():
+    """
+        Gives the test an empty database of its own and empty caches.
+    """
+    dispose_engine()
+    app.config['DB_URL'] = 'sqlite:///%s' % os.path.join(
+        _db_dir, '%s.db' % uuid.uuid4().hex)
+    db_create(app.config['DB_URL'])
+    for namespace_cache in cache._caches.values():
+        namespace_cache.invalidate()
+    yield get_engine()
+    dispose_engine()
+
+
+@pytest.fixture
+def postgres():
+    """
+        Gives the test the emptied PostgreSQL database of DATABASE_URL, or
+        skips it.
+    """
+    url = os.environ.get('DATABASE_URL', '')
+    if not url.startswith('postgresql'):
+        pytest.skip('DATABASE_URL is not a PostgreSQL database')
+    dispose_engine()
+    default_url = app.config['DB_URL']
+    app.config['DB_URL'] = url
+    engine = create_engine(url)
+    Base.metadata.drop_all(engine)
+    engine.dispose()
+    db_create(url)
+    for namespace_cache in cache._caches.values():
+        namespace_cache.invalidate()
+    yield get_engine()
+    dispose_engine()
+    app.config['DB_URL'] = default_url
+
+
+@pytest.fixture
+def client(database):
+    return app.test_client()
+
+
+@pytest.fixture
+def queries(database):
+    """
+        Counter of the statements run on the database during the test.
+    """
+    counter = QueryCounter()
+    event.listen(database, 'before_cursor_execute', counter)
+    yield counter
+    event.remove(database, 'before_cursor_execute', counter)
+
+
+@pytest.fixture
+def catalog(request):
+    """
+        Adds a catalog to the database, the PostgreSQL one for the tests
+        using the postgres fixture. Returns a function taking the number of
+        categories and of items per category, which returns the (category
+        name, item name) pairs added.
+    """
+    if 'postgres' in request.fixturenames:
+        request.getfixturevalue('postgres')
+    else:
+        request.getfixturevalue('database')
+
+    def add(categories, items_per_category):
+        session = db_connect()
+        owner = session.query(User).first()
+        if owner is None:
+            owner = User(name='Owner', email='owner@example.com')
+            session.add(owner)
+        names = []
+        for number in range(session.query(Category).count(),
+                            session.query(Category).count() + categories):
+            category = Category(name='Category %d' % number, user=owner)
+            session.add(category)
+            for item_number in range(items_per_category):
+                item = Item(name='Item %d-%d' % (number, item_number),
+                            description='Item %d of category %d' % (
+                                item_number, number),
+                            price=10, quantity=1, category=category,
+                            user=owner)
+                session.add(item)
+                names.append((category.name, item.name))
+        session.commit()
+        session.close()
+        return names
+    return add
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_db_dir, ignore_errors=True)
@@ -0,0 +1,70 @@
+"""
+    Commits only make the catalog cache values of the scopes they touch
+    stale.
+"""
+
+
+from sportsbazar.cache import LocalCache, cached, get_catalog_cache
+from sportsbazar.db_connect import db_connect
+from sportsbazar.db_setup import Category, Item
+
+
+def cachedNames(category_names):
+    """
+        Caches a value in the scope of each category and in the
+        catalog-wide scopes, and returns a function telling which of them
+        are still cached.
+    """
+    cache = get_catalog_cache()
+    session = db_connect()
+    keys = []
+    for name in category_names:
+        category = session.query(Category).filter_by(name=name).one()
+        scope = 'category:%d' % category.id
+        cached('test:%s' % name, lambda: name, scope=scope)
+        keys.append(('test:%s' % name, scope))
+    session.close()
+    for scope in ('catalog', 'categories'):
+        cached('test:%s' % scope, lambda: scope, scope=scope)
+        keys.append(('test:%s' % scope, scope))
+
+    def stillCached():
+        return set(key for key, scope in keys
+                   if cache.get(key, scope) is not None)
+    return stillCached
+
+
+def test_item_change_keeps_other_categories(database, catalog):
+    catalog(2, 1)
+    stillCached = cachedNames(['Category 0', 'Category 1'])
+
+    session = db_connect()
+    item = session.query(Item).filter_by(name='Item 0-0').one()
+    item.price = 20
+    session.commit()
+    session.close()
+
+    assert stillCached() == set(['test:Category 1', 'test:categories'])
+
+
+def test_category_change_drops_the_category_list(database, catalog):
+    catalog(2, 1)
+    stillCached = cachedNames(['Category 0', 'Category 1'])
+
+    session = db_connect()
+    category = session.query(Category).filter_by(name='Category 1').one()
+    category.name = 'Renamed'
+    session.commit()
+    session.close()
+
+    assert stillCached() == set(['test:Category 0'])
+
+
+def test_value_computed_during_a_write_is_not_stored():
+    cache = LocalCache(10, 60)
+    generation = cache.generation('category:1')
+    cache.invalidateScopes(['category:1'])
+    cache.set('key', 'stale', cache.version, 'category:1', generation)
+    assert cache.get('key', 'category:1') is None
+    cache.set('key', 'fresh', scope='category:1')
+    assert cache.get('key', 'category:1') == 'fresh'
@@ -0,0 +1,32 @@
+"""
+    The full catalog dump (/catalog.json) runs the same number of queries
+    whatever the number of categories.
+"""
+
+
+def catalogQueries(client, queries):
+    queries.reset()
+    response = client.get('/catalog.json')
+    assert response.status_code == 200
+    # The body is streamed: the query runs while it is read.
+    categories = response.get_json()['Categories']
+    return queries.count, categories
+
+
+def test_query_count_does_not_grow_with_categories(client, queries, catalog):
+    catalog(1, 3)
+    one_count, categories = catalogQueries(client, queries)
+    assert len(categories) == 1
+    assert len(categories[0]['Items']) == 3
+
+    catalog(24, 3)
+    many_count, categories = catalogQueries(client, queries)
+    assert len(categories) == 25
+    assert all(len(category['Items']) == 3 for category in categories)
+    assert many_count == one_count
+
+
+def test_empty_categories_are_listed(client, queries, catalog):
+    catalog(2, 0)
+    count, categories = catalogQueries(client, queries)
+    assert [category['Items'] for category in categories] == [[], []]
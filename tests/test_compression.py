@@ -0,0 +1,109 @@
+"""
+    Compression negotiated with Accept-Encoding, and the fingerprinted
+    static files.
+"""
+
+
+import os
+import shutil
+import zlib
+import pytest
+from flask import url_for
+from sportsbazar import app
+from sportsbazar import assets
+from sportsbazar.compression import brotli
+
+
+def fetch(client, url, **headers):
+    response = client.get(url, headers=headers)
+    response.get_data()
+    return response
+
+
+def test_gzip_is_negotiated(client, catalog):
+    catalog(5, 5)
+    response = fetch(client, '/catalog/JSON', **{'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert zlib.decompress(response.get_data(), 31).startswith('{')
+
+
+def test_compressed_etag_is_weak(client, catalog):
+    catalog(5, 5)
+    identity = fetch(client, '/catalog/JSON',
+                     **{'Accept-Encoding': 'identity'})
+    gzipped = fetch(client, '/catalog/JSON', **{'Accept-Encoding': 'gzip'})
+    assert not identity.headers['ETag'].startswith('W/')
+    assert gzipped.headers['ETag'] == 'W/' + identity.headers['ETag']
+
+
+@pytest.mark.skipif(brotli is None, reason='brotli is not installed')
+def test_brotli_is_preferred(client, catalog):
+    catalog(5, 5)
+    response = fetch(client, '/catalog/JSON',
+                     **{'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+
+
+@pytest.mark.parametrize('url', ['/catalog/JSON', '/catalog.json',
+                                 '/catalog/Category 0/'])
+def test_refused_gzip_is_not_sent(client, catalog, url):
+    catalog(5, 5)
+    for attempt in range(2):
+        # The second page is a page cache hit.
+        response = fetch(client, url, **{'Accept-Encoding': 'gzip;q=0'})
+        assert response.status_code == 200
+        assert 'Content-Encoding' not in response.headers
+        assert 'Accept-Encoding' in response.vary
+
+
+def test_small_responses_are_not_compressed(client, catalog):
+    catalog(1, 0)
+    response = fetch(client, '/catalog/Category 0/JSON',
+                     **{'Accept-Encoding': 'gzip'})
+    assert len(response.get_data()) < app.config['COMPRESS_MIN_SIZE']
+    assert 'Content-Encoding' not in response.headers
+
+
+@pytest.fixture
+def built(tmpdir):
+    """
+        Builds a copy of the static folder and serves it.
+    """
+    static_folder = app.static_folder
+    copy = str(tmpdir.join('static'))
+    os.mkdir(copy)
+    shutil.copytree(os.path.join(static_folder, 'css'),
+                    os.path.join(copy, 'css'))
+    app.static_folder = copy
+    assets.build(copy)
+    assets.load_manifest()
+    yield copy
+    app.static_folder = static_folder
+    assets.load_manifest()
+
+
+def staticUrl(filename):
+    with app.test_request_context():
+        return url_for('static', filename=filename)
+
+
+def test_fingerprinted_file_is_immutable(client, built):
+    url = staticUrl('css/styles.css')
+    assert '/build/css/styles.' in url
+    response = fetch(client, url, **{'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == \
+        'public, max-age=%d, immutable' % assets.IMMUTABLE_MAX_AGE
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    with open(os.path.join(built, 'css', 'styles.css'), 'rb') as source:
+        assert zlib.decompress(response.get_data(), 31) == source.read()
+
+
+def test_fingerprinted_file_without_encoding(client, built):
+    response = fetch(client, staticUrl('css/styles.css'),
+                     **{'Accept-Encoding': 'gzip;q=0'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert 'immutable' in response.headers['Cache-Control']
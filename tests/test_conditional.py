@@ -0,0 +1,148 @@
+"""
+    ETag and Last-Modified validators, read from the database.
+"""
+
+
+import time
+from sportsbazar.cache import get_catalog_cache
+from sportsbazar.db_connect import db_connect, get_engine
+from sportsbazar.db_generate import generate
+from sportsbazar.db_setup import Category, Item
+from sportsbazar import app
+
+
+def fetch(client, url, **headers):
+    response = client.get(url, headers=headers)
+    # Read streamed bodies to the end, which closes their request.
+    response.get_data()
+    return response
+
+
+def revalidate(client, url, response):
+    return fetch(client, url,
+                 **{'If-None-Match': response.headers['ETag']}).status_code
+
+
+def changeItem(name, **values):
+    # A session of its own, as another worker or script would use.
+    session = db_connect()
+    item = session.query(Item).filter_by(name=name).one()
+    for key, value in values.items():
+        setattr(item, key, value)
+    session.commit()
+    session.close()
+
+
+def test_unchanged_page_is_not_modified(client, catalog):
+    catalog(1, 2)
+    url = '/catalog/Category 0/'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert revalidate(client, url, response) == 304
+    assert client.get(url, headers={
+        'If-Modified-Since': response.headers['Last-Modified']}
+    ).status_code == 304
+
+
+def test_item_change_is_seen(client, catalog):
+    catalog(2, 2)
+    urls = ['/catalog/Category 0/', '/catalog/Category 0/Item 0-1/JSON',
+            '/catalog/Category 1/', '/catalog/JSON']
+    before = dict((url, fetch(client, url)) for url in urls)
+
+    changeItem('Item 0-0', price=99)
+
+    assert revalidate(client, urls[0], before[urls[0]]) == 200
+    assert revalidate(client, urls[1], before[urls[1]]) == 200
+    assert revalidate(client, urls[2], before[urls[2]]) == 304
+    assert revalidate(client, urls[3], before[urls[3]]) == 200
+
+
+def test_item_deletion_and_move_are_seen(client, catalog):
+    catalog(2, 2)
+    first, second = '/catalog/Category 0/', '/catalog/Category 1/'
+    before = client.get(first)
+    session = db_connect()
+    session.delete(session.query(Item).filter_by(name='Item 0-0').one())
+    session.commit()
+    session.close()
+    assert revalidate(client, first, before) == 200
+
+    before = [client.get(first), client.get(second)]
+    category = db_connect().query(Category).filter_by(
+        name='Category 1').one()
+    changeItem('Item 0-1', category_id=category.id)
+    assert revalidate(client, first, before[0]) == 200
+    assert revalidate(client, second, before[1]) == 200
+
+
+def test_category_deletion_is_seen_by_the_catalog(client, catalog):
+    catalog(2, 0)
+    before = fetch(client, '/catalog/JSON')
+    session = db_connect()
+    session.delete(session.query(Category).filter_by(
+        name='Category 1').one())
+    session.commit()
+    session.close()
+    assert revalidate(client, '/catalog/JSON', before) == 200
+
+
+def test_last_modified_follows_changes(client, catalog):
+    catalog(1, 1)
+    url = '/catalog/Category 0/'
+    before = client.get(url)
+    # Last-Modified has a resolution of a second.
+    time.sleep(1.1)
+    changeItem('Item 0-0', price=99)
+    response = client.get(url, headers={
+        'If-Modified-Since': before.headers['Last-Modified']})
+    assert response.status_code == 200
+    assert response.headers['Last-Modified'] != before.headers[
+        'Last-Modified']
+
+
+def test_bulk_generated_items_are_seen(client, catalog):
+    catalog(1, 0)
+    before = fetch(client, '/catalog/JSON')
+    get_engine().dispose()
+    generate(app.config['DB_URL'], items=20, categories=2, users=1)
+    # Written outside of the app: its catalog cache, which keeps the
+    # catalog's validators with its data, is only dropped by CACHE_TTL.
+    get_catalog_cache().invalidate()
+    assert revalidate(client, '/catalog/JSON', before) == 200
+
+
+def test_warm_catalog_validation_runs_no_query(client, catalog, queries):
+    catalog(3, 1)
+    before = fetch(client, '/catalog/JSON')
+    queries.reset()
+    assert revalidate(client, '/catalog/JSON', before) == 304
+    assert queries.count == 0
+
+
+def test_category_change_touches_only_its_row(client, catalog):
+    catalog(3, 1)
+    session = db_connect()
+    times = dict(session.query(Category.name, Category.updated_at))
+    session.query(Category).filter_by(name='Category 1').one().name = 'New'
+    session.commit()
+    after = dict(session.query(Category.name, Category.updated_at))
+    session.close()
+    assert after['New'] > times['Category 1']
+    assert after['Category 0'] == times['Category 0']
+    assert after['Category 2'] == times['Category 2']
+
+
+def test_category_rename_and_addition_are_seen_by_the_catalog(client,
+                                                              catalog):
+    catalog(2, 0)
+    before = fetch(client, '/catalog/JSON')
+    session = db_connect()
+    session.query(Category).filter_by(name='Category 0').one().name = 'New'
+    session.commit()
+    session.close()
+    assert revalidate(client, '/catalog/JSON', before) == 200
+
+    before = fetch(client, '/catalog/JSON')
+    catalog(1, 0)
+    assert revalidate(client, '/catalog/JSON', before) == 200
@@ -0,0 +1,105 @@
+"""
+    Settings read from the environment, and the engine options they give.
+    The PostgreSQL tests need DATABASE_URL (see conftest.py).
+"""
+
+
+import pytest
+from flask import Config
+from sqlalchemy.pool import QueuePool
+from sportsbazar import app
+from sportsbazar.config import load_config
+from sportsbazar.db_connect import _engine_options, db_connect, dispose_engine
+from sportsbazar.db_connect import get_engine
+
+
+@pytest.fixture
+def environ(monkeypatch):
+    for name in ('DATABASE_URL', 'SPORTSBAZAR_DB_URL',
+                 'SPORTSBAZAR_SETTINGS'):
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def loadedConfig():
+    config = Config('.')
+    load_config(config)
+    return config
+
+
+def test_defaults(environ):
+    config = loadedConfig()
+    assert config['DB_URL'] == 'sqlite:///sportsbazar.db'
+    assert config['DB_POOL_SIZE'] == 5
+
+
+def test_database_url(environ):
+    environ.setenv('DATABASE_URL', 'postgresql://user@host/catalog')
+    assert loadedConfig()['DB_URL'] == 'postgresql://user@host/catalog'
+    # The prefixed setting wins.
+    environ.setenv('SPORTSBAZAR_DB_URL', 'postgresql://user@host/other')
+    assert loadedConfig()['DB_URL'] == 'postgresql://user@host/other'
+
+
+def test_values_are_converted(environ):
+    environ.setenv('SPORTSBAZAR_DB_POOL_SIZE', '20')
+    environ.setenv('SPORTSBAZAR_PG_BATCH_MODE', 'no')
+    environ.setenv('SPORTSBAZAR_DB_REPLICA_URLS', '["sqlite:///r.db"]')
+    config = loadedConfig()
+    assert config['DB_POOL_SIZE'] == 20
+    assert config['PG_BATCH_MODE'] is False
+    assert config['DB_REPLICA_URLS'] == ['sqlite:///r.db']
+
+
+def test_settings_file(environ, tmpdir):
+    settings = tmpdir.join('settings.py')
+    settings.write("DB_URL = 'postgresql://user@host/file'\n"
+                   "PG_STATEMENT_TIMEOUT = 2000\n")
+    environ.setenv('SPORTSBAZAR_SETTINGS', str(settings))
+    config = loadedConfig()
+    assert config['DB_URL'] == 'postgresql://user@host/file'
+    assert config['PG_STATEMENT_TIMEOUT'] == 2000
+
+
+def test_sqlite_file_options():
+    options = _engine_options('sqlite:///catalog.db')
+    assert options['poolclass'] is QueuePool
+    assert options['connect_args'] == {'check_same_thread': False}
+
+
+def test_sqlite_memory_options():
+    options = _engine_options('sqlite://')
+    assert 'poolclass' not in options and 'connect_args' not in options
+
+
+def test_postgresql_options(monkeypatch):
+    monkeypatch.setitem(app.config, 'PG_STATEMENT_TIMEOUT', 2000)
+    options = _engine_options('postgresql://user@host/catalog')
+    assert options['use_batch_mode'] is True
+    assert options['client_encoding'] == 'utf8'
+    assert options['connect_args'] == {
+        'application_name': 'sportsbazar',
+        'options': '-c statement_timeout=2000'}
+    assert options['pool_size'] == app.config['DB_POOL_SIZE']
+
+
+def test_postgresql_connection(postgres, monkeypatch):
+    monkeypatch.setitem(app.config, 'PG_STATEMENT_TIMEOUT', 2000)
+    dispose_engine()
+    engine = get_engine()
+    assert engine.dialect.name == 'postgresql'
+    assert engine.execute('SHOW application_name').scalar() == 'sportsbazar'
+    assert engine.execute('SHOW statement_timeout').scalar() == '2s'
+
+
+def test_postgresql_requests(postgres, catalog):
+    catalog(2, 3)
+    client = app.test_client()
+    response = client.get('/catalog/JSON')
+    assert response.status_code == 200
+    assert [len(category['Items'])
+            for category in response.get_json()['Categories']] == [3, 3]
+    response = client.get('/catalog/Category 1/Item 1-2/')
+    assert response.status_code == 200
+    response = client.get('/catalog/search/JSON?q=item')
+    assert len(response.get_json()['Items']) == 6
@@ -0,0 +1,102 @@
+"""
+    db_migrate() upgrades a database created with the original schema.
+"""
+
+
+import os
+import pytest
+from sqlalchemy import create_engine, inspect
+from sportsbazar.db_setup import Base, db_migrate, search_index_exists
+
+
+# Tables of the first version of the app, before any migration.
+BASELINE_SCHEMA = [
+    'CREATE TABLE user (id INTEGER NOT NULL, name VARCHAR(250) NOT NULL, '
+    'email VARCHAR(250) NOT NULL, picture VARCHAR(250), PRIMARY KEY (id))',
+    'CREATE TABLE category (id INTEGER NOT NULL, '
+    'name VARCHAR(100) NOT NULL, user_id INTEGER, PRIMARY KEY (id), '
+    'FOREIGN KEY(user_id) REFERENCES user (id))',
+    'CREATE TABLE item (id INTEGER NOT NULL, name VARCHAR(250) NOT NULL, '
+    'description VARCHAR, price INTEGER, quantity INTEGER, '
+    'category_id INTEGER, user_id INTEGER, PRIMARY KEY (id), '
+    'FOREIGN KEY(category_id) REFERENCES category (id), '
+    'FOREIGN KEY(user_id) REFERENCES user (id))',
+    "INSERT INTO user VALUES (1, 'Owner', 'owner@example.com', NULL)",
+    "INSERT INTO category VALUES (1, 'Cricket', 1)",
+    "INSERT INTO item VALUES (1, 'Willow Bat', 'English willow', 10, 1, "
+    "1, 1)",
+    # Left by an earlier version of the schema.
+    'CREATE INDEX ix_item_price ON item (price)',
+]
+
+
+@pytest.fixture
+def baseline(tmpdir):
+    """
+        URL of a SQLite file holding the baseline schema and a few rows.
+    """
+    url = 'sqlite:///%s' % os.path.join(str(tmpdir), 'baseline.db')
+    engine = create_engine(url)
+    for statement in BASELINE_SCHEMA:
+        engine.execute(statement)
+    engine.dispose()
+    yield url
+
+
+def schema(url):
+    """
+        Returns the columns and the indexes of every table.
+    """
+    engine = create_engine(url)
+    inspector = inspect(engine)
+    tables = dict(
+        (table, (set(column['name']
+                     for column in inspector.get_columns(table)),
+                 set(index['name'] for index in inspector.get_indexes(table))))
+        for table in inspector.get_table_names()
+        if not table.startswith('item_fts'))
+    engine.dispose()
+    return tables
+
+
+def test_migration_upgrades_the_baseline(baseline):
+    db_migrate(baseline)
+    tables = schema(baseline)
+    for table in Base.metadata.sorted_tables:
+        columns, indexes = tables[table.name]
+        assert columns == set(column.name for column in table.columns)
+        assert indexes == set(index.name for index in table.indexes)
+    assert 'ix_item_price' not in tables['item'][1]
+
+    engine = create_engine(baseline)
+    assert search_index_exists(engine)
+    # The rows that existed before the full-text index are indexed.
+    assert engine.execute(
+        "SELECT rowid FROM item_fts WHERE item_fts MATCH 'willow'"
+    ).fetchall() == [(1,)]
+    assert engine.execute(
+        'SELECT name FROM item').fetchall() == [('Willow Bat',)]
+    engine.dispose()
+
+
+def test_migration_is_idempotent(baseline, capsys):
+    db_migrate(baseline)
+    migrated = schema(baseline)
+    capsys.readouterr()
+    db_migrate(baseline)
+    assert capsys.readouterr().out == ''
+    assert schema(baseline) == migrated
+
+
+def test_duplicates_are_reported(baseline, capsys):
+    engine = create_engine(baseline)
+    engine.execute("INSERT INTO item VALUES (2, 'Willow Bat', 'Copy', 10, "
+                   "1, 1, 1)")
+    engine.dispose()
+    db_migrate(baseline)
+    out = capsys.readouterr().out
+    assert 'Could not create unique index ix_item_name: duplicate values ' \
+        'in item.' in out
+    indexes = schema(baseline)['item'][1]
+    assert 'ix_item_name' not in indexes
+    assert 'ix_item_category_id_id' in indexes
@@ -0,0 +1,225 @@
+"""
+    Sign in with Google, against a local stub of Google's endpoints.
+"""
+
+
+import json
+import os
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import Counter
+import pytest
+from oauth2client import crypt
+from sportsbazar import app
+from sportsbazar import google_oauth
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+CLIENT_ID = 'stub-client'
+
+
+def readData(name):
+    with open(os.path.join(DATA, name)) as source:
+        return source.read()
+
+
+class Stub(object):
+    """
+        What the stub answers, and the number of calls of each path.
+    """
+
+    def __init__(self):
+        self.signer = crypt.Signer.from_string(readData('stub_key.pem'))
+        self.certs = {'k1': readData('stub_cert.pem')}
+        self.certs_cache_control = 'public, max-age=600'
+        self.claims = {}
+        self.issued_to = CLIENT_ID
+        self.hits = Counter()
+
+    def idToken(self, code, key_id='k1', **claims):
+        now = int(time.time())
+        payload = {'iss': 'https://accounts.google.com', 'aud': CLIENT_ID,
+                   'sub': 'sub-' + code, 'iat': now, 'exp': now + 3600,
+                   'email': code + '@example.com', 'name': 'User ' + code,
+                   'picture': 'http://example.com/' + code}
+        payload.update(self.claims)
+        payload.update(claims)
+        return crypt.make_signed_jwt(self.signer, payload, key_id=key_id)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, content, headers=None):
+        body = json.dumps(content)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        stub = self.server.stub
+        stub.hits['/token'] += 1
+        form = urlparse.parse_qs(self.rfile.read(
+            int(self.headers.get('Content-Length', 0))))
+        code = form['code'][0]
+        self.reply({'access_token': 'at-' + code, 'token_type': 'Bearer',
+                    'expires_in': 3600, 'id_token': stub.idToken(code)})
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse.urlparse(self.path)
+        args = dict(urlparse.parse_qsl(url.query))
+        stub.hits[url.path] += 1
+        if url.path == '/certs':
+            self.reply(stub.certs,
+                       {'Cache-Control': stub.certs_cache_control})
+        elif url.path == '/tokeninfo':
+            self.reply({'user_id': 'sub-' + args['access_token'][3:],
+                        'issued_to': stub.issued_to})
+        elif url.path == '/userinfo':
+            code = args['access_token'][3:]
+            self.reply({'name': 'User ' + code,
+                        'email': code + '@example.com',
+                        'picture': 'http://example.com/' + code})
+        else:
+            self.reply({})
+
+
+@pytest.fixture
+def stub(database, tmpdir):
+    """
+        Points the GOOGLE_* settings at a stub server.
+    """
+    server = HTTPServer(('127.0.0.1', 0), StubHandler)
+    server.stub = Stub()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base = 'http://127.0.0.1:%d' % server.server_port
+    secrets = tmpdir.join('client_secrets.json')
+    secrets.write(json.dumps({'web': {
+        'client_id': CLIENT_ID, 'client_secret': 'secret',
+        'auth_uri': base + '/auth', 'token_uri': base + '/token'}}))
+    defaults = dict((name, app.config[name]) for name in (
+        'GOOGLE_CLIENT_SECRETS', 'GOOGLE_CERTS_URL', 'GOOGLE_TOKENINFO_URL',
+        'GOOGLE_USERINFO_URL', 'GOOGLE_REVOKE_URL',
+        'GOOGLE_VERIFY_ID_TOKEN'))
+    app.config.update(
+        GOOGLE_CLIENT_SECRETS=str(secrets),
+        GOOGLE_CERTS_URL=base + '/certs',
+        GOOGLE_TOKENINFO_URL=base + '/tokeninfo',
+        GOOGLE_USERINFO_URL=base + '/userinfo',
+        GOOGLE_REVOKE_URL=base + '/revoke')
+    resetGoogle()
+    yield server.stub
+    server.shutdown()
+    server.server_close()
+    app.config.update(defaults)
+    resetGoogle()
+
+
+def resetGoogle():
+    google_oauth._secrets.clear()
+    del google_oauth._flow[:]
+    google_oauth.certs.clear()
+
+
+def signIn(client, code):
+    client.get('/login')
+    with client.session_transaction() as login_session:
+        state = login_session['state']
+    return client.post('/gconnect?state=' + state, data=code)
+
+
+def test_certs_are_cached_for_their_max_age(stub):
+    google_oauth.verifyIdToken(stub.idToken('alice'))
+    google_oauth.verifyIdToken(stub.idToken('bob'))
+    assert stub.hits['/certs'] == 1
+
+    stub.certs_cache_control = 'public, max-age=0'
+    google_oauth.certs.clear()
+    google_oauth.verifyIdToken(stub.idToken('alice'))
+    google_oauth.verifyIdToken(stub.idToken('bob'))
+    assert stub.hits['/certs'] == 3
+
+
+def test_unknown_key_fetches_the_certs_again(stub, monkeypatch):
+    google_oauth.verifyIdToken(stub.idToken('alice'))
+    # Google rotated its keys.
+    stub.certs = {'k2': stub.certs['k1']}
+    monkeypatch.setattr(google_oauth, 'CERTS_MIN_REFRESH', 0)
+    google_oauth.verifyIdToken(stub.idToken('alice', key_id='k2'))
+    assert stub.hits['/certs'] == 2
+
+    # Not more often than CERTS_MIN_REFRESH.
+    monkeypatch.setattr(google_oauth, 'CERTS_MIN_REFRESH', 60)
+    google_oauth.verifyIdToken(stub.idToken('alice', key_id='k3'))
+    assert stub.hits['/certs'] == 2
+
+
+def test_valid_token_claims(stub):
+    claims = google_oauth.verifyIdToken(stub.idToken('alice'))
+    assert claims['sub'] == 'sub-alice'
+    assert claims['email'] == 'alice@example.com'
+
+
+@pytest.mark.parametrize('claims', [
+    {'aud': 'another-client'},
+    {'iss': 'https://accounts.example.com'},
+    {'iat': int(time.time()) - 7200, 'exp': int(time.time()) - 3600},
+])
+def test_invalid_token_is_refused(stub, claims):
+    with pytest.raises(crypt.AppIdentityError):
+        google_oauth.verifyIdToken(stub.idToken('alice', **claims))
+
+
+def test_sign_in_with_verified_id_token(client, stub):
+    response = signIn(client, 'alice')
+    assert response.status_code == 200
+    assert 'User alice' in response.get_data(as_text=True)
+    with client.session_transaction() as login_session:
+        assert login_session['email'] == 'alice@example.com'
+        assert login_session['gplus_id'] == 'sub-alice'
+    assert stub.hits['/tokeninfo'] == 0
+    assert stub.hits['/userinfo'] == 0
+
+
+def test_sign_in_with_bad_audience_is_refused(client, stub):
+    stub.claims = {'aud': 'another-client'}
+    response = signIn(client, 'alice')
+    assert response.status_code == 401
+    with client.session_transaction() as login_session:
+        assert 'email' not in login_session
+
+
+def test_tokeninfo_fallback(client, stub):
+    app.config['GOOGLE_VERIFY_ID_TOKEN'] = False
+    response = signIn(client, 'bob')
+    assert response.status_code == 200
+    assert stub.hits['/tokeninfo'] == 1
+    assert stub.hits['/certs'] == 0
+    with client.session_transaction() as login_session:
+        assert login_session['email'] == 'bob@example.com'
+
+
+def test_tokeninfo_fallback_without_certs(client, stub):
+    app.config['GOOGLE_CERTS_URL'] = 'http://127.0.0.1:1/certs'
+    assert signIn(client, 'bob').status_code == 200
+    assert stub.hits['/tokeninfo'] == 1
+
+
+def test_tokeninfo_of_another_client_is_refused(client, stub):
+    app.config['GOOGLE_VERIFY_ID_TOKEN'] = False
+    stub.issued_to = 'another-client'
+    response = signIn(client, 'bob')
+    assert response.status_code == 401
+    with client.session_transaction() as login_session:
+        assert 'email' not in login_session
@@ -0,0 +1,72 @@
+"""
+    g.current_user is resolved from the login session before the view runs.
+"""
+
+
+import pytest
+from flask import g
+from sportsbazar import app
+from sportsbazar.db_connect import db_connect
+from sportsbazar.db_setup import User
+
+
+@pytest.fixture
+def user(client):
+    session = db_connect()
+    user = User(name='Someone', email='someone@example.com',
+                picture='http://example.com/someone.png')
+    session.add(user)
+    session.commit()
+    user_id = user.id
+    session.close()
+    return user_id
+
+
+def currentUser(client):
+    with client:
+        client.get('/catalog/categories/').get_data()
+        return g.current_user
+
+
+def signIn(client, **values):
+    with client.session_transaction() as login_session:
+        login_session.update(values)
+
+
+def test_anonymous(client):
+    assert currentUser(client) is None
+
+
+def test_signed_in_user_runs_no_query(client, user, queries):
+    signIn(client, username='Someone', email='someone@example.com',
+           picture='http://example.com/someone.png', user_id=user)
+    client.get('/catalog/categories/').get_data()
+    queries.reset()
+    current_user = currentUser(client)
+    assert current_user == (user, 'Someone', 'someone@example.com',
+                            'http://example.com/someone.png', False)
+    # The categories page comes from the catalog cache.
+    assert queries.count == 0
+
+
+def test_session_without_user_id(client, user, queries):
+    signIn(client, username='Someone', email='someone@example.com')
+    assert currentUser(client).id == user
+    # The id is kept in the session for the next requests.
+    with client.session_transaction() as login_session:
+        assert login_session['user_id'] == user
+    queries.reset()
+    assert currentUser(client).id == user
+    assert queries.count == 0
+
+
+def test_unknown_email(client):
+    signIn(client, username='Nobody', email='nobody@example.com')
+    assert currentUser(client) is None
+
+
+def test_admin(client, user, monkeypatch):
+    monkeypatch.setitem(app.config, 'ADMIN_EMAIL', 'someone@example.com')
+    signIn(client, username='Someone', email='someone@example.com',
+           user_id=user)
+    assert currentUser(client).is_admin
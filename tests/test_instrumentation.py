@@ -0,0 +1,42 @@
+"""
+    Profiles on demand are only taken for the admin.
+"""
+
+
+import os
+import pytest
+from sportsbazar import app
+
+
+@pytest.fixture
+def profiling(client, tmpdir):
+    app.config.update(INSTRUMENTATION=True, PROFILE_DIR=str(tmpdir),
+                      ADMIN_EMAIL=None)
+    yield str(tmpdir)
+    app.config.update(INSTRUMENTATION=False, ADMIN_EMAIL=None)
+
+
+def signIn(client, email):
+    with client.session_transaction() as login_session:
+        login_session.update(username='Someone', email=email, user_id=1)
+
+
+def test_anonymous_request_is_not_profiled(client, profiling):
+    response = client.get('/catalog/categories/?__profile=1')
+    assert response.status_code == 200
+    assert 'X-Profile' not in response.headers
+    assert os.listdir(profiling) == []
+
+
+def test_user_request_is_not_profiled(client, profiling):
+    signIn(client, 'user@example.com')
+    response = client.get('/catalog/categories/?__profile=1')
+    assert 'X-Profile' not in response.headers
+    assert os.listdir(profiling) == []
+
+
+def test_admin_request_is_profiled(client, profiling):
+    app.config['ADMIN_EMAIL'] = 'admin@example.com'
+    signIn(client, 'admin@example.com')
+    response = client.get('/catalog/categories/?__profile=1')
+    assert os.listdir(profiling) == [response.headers['X-Profile']]
@@ -0,0 +1,97 @@
+"""
+    Import form errors are reported instead of failing.
+"""
+
+
+from io import BytesIO
+import pytest
+from sqlalchemy import event
+from sportsbazar.db_connect import db_connect
+from sportsbazar.db_setup import Category, Item, User
+from sportsbazar.item_transfer import loadItems
+
+
+@pytest.fixture
+def member(client):
+    session = db_connect()
+    user = User(name='Member', email='member@example.com')
+    session.add(user)
+    session.commit()
+    with client.session_transaction() as login_session:
+        login_session.update(username=user.name, email=user.email,
+                             user_id=user.id)
+    session.close()
+    return client
+
+
+def importJson(client, data):
+    return client.post('/catalog/import', data=data,
+                       content_type='multipart/form-data',
+                       headers={'Accept': 'application/json'})
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'jsonl'])
+def test_format_without_file(member, file_format):
+    response = importJson(member, {'format': file_format})
+    assert response.status_code == 400
+    assert 'choose' in response.get_json()['error']
+
+
+def test_no_file_chosen(member):
+    response = importJson(member, {'format': 'csv',
+                                   'file': (BytesIO(b''), '')})
+    assert response.status_code == 400
+
+
+def test_empty_file(member):
+    response = importJson(member, {'file': (BytesIO(b''), 'items.csv')})
+    assert response.status_code == 400
+    assert 'empty' in response.get_json()['error']
+
+
+def test_missing_file_in_the_form_is_flashed(member):
+    response = member.post('/catalog/import', data={'format': 'jsonl'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+    with member.session_transaction() as login_session:
+        assert 'choose' in login_session['_flashes'][0][1]
+
+
+def test_upsert_skipping_another_users_item_is_rejected(postgres):
+    # The other user's item is added after the batch's names were checked,
+    # the upsert then skips it.
+    session = db_connect()
+    member, other = User(name='Member', email='member@example.com'), \
+        User(name='Other', email='other@example.com')
+    category = Category(name='Cricket', user=member)
+    session.add(Item(name='Bat', price=1, quantity=1, category=category,
+                     user=member))
+    session.add(other)
+    session.commit()
+    member_id, other_id, category_id = member.id, other.id, category.id
+
+    def addConcurrently(connection, cursor, statement, *args):
+        if statement.startswith('INSERT INTO item') and not added:
+            added.append(True)
+            with postgres.begin() as other_connection:
+                other_connection.execute(Item.__table__.insert().values(
+                    name='Ball', price=1, quantity=1,
+                    category_id=category_id, user_id=other_id))
+    added = []
+    event.listen(postgres, 'before_cursor_execute', addConcurrently)
+    try:
+        rows = [(line, {'name': name, 'price': str(price),
+                        'category': 'Cricket'}, None)
+                for line, name, price in [(2, 'Bat', 5), (3, 'Ball', 6),
+                                          (4, 'Stumps', 7)]]
+        report = loadItems(session, rows, member_id, upsert=True)
+    finally:
+        event.remove(postgres, 'before_cursor_execute', addConcurrently)
+
+    assert (report['inserted'], report['updated'], report['rejected']) == \
+        (1, 1, 1)
+    assert report['errors'][0]['line'] == 3
+    owners = dict(session.query(Item.name, Item.user_id))
+    assert owners == {'Bat': member_id, 'Ball': other_id,
+                      'Stumps': member_id}
+    session.close()
@@ -0,0 +1,124 @@
+"""
+    Prometheus metrics, added up over the files of every worker process.
+"""
+
+
+import json
+import os
+import subprocess
+import uuid
+import pytest
+from sportsbazar import app
+from sportsbazar import metrics
+
+
+@pytest.fixture
+def samples(database, monkeypatch):
+    """
+        Fresh samples for the current process, with metrics enabled.
+    """
+    monkeypatch.setattr(metrics, '_samples', metrics.Samples())
+    app.config['METRICS'] = True
+    yield metrics._samples
+    app.config.update(METRICS=False, METRICS_DIR=None)
+
+
+def deadPid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+def writeProcessFile(directory, pid, counters, gauges):
+    name = 'metrics-%d-%s.json' % (pid, uuid.uuid4().hex[:8])
+    with open(os.path.join(directory, name), 'w') as output:
+        json.dump({'pid': pid, 'counters': counters, 'gauges': gauges},
+                  output)
+
+
+def test_histogram_exposition(samples):
+    labels = (('endpoint', 'showItem'),)
+    for seconds in (0.003, 0.03, 20.0):
+        samples.observe('sportsbazar_request_duration_seconds', labels,
+                        seconds)
+    lines = [line for line in metrics.exposition(metrics.collect())
+             .splitlines()
+             if line.startswith('sportsbazar_request_duration_seconds')]
+    buckets = [line for line in lines if '_bucket' in line]
+    assert lines[:len(buckets)] == buckets
+    assert buckets[0] == 'sportsbazar_request_duration_seconds_bucket' \
+        '{endpoint="showItem",le="0.005"} 1.0'
+    assert buckets[-1] == 'sportsbazar_request_duration_seconds_bucket' \
+        '{endpoint="showItem",le="+Inf"} 3.0'
+    assert len(buckets) == len(metrics.BUCKETS) + 1
+    assert lines[len(buckets):] == [
+        'sportsbazar_request_duration_seconds_count'
+        '{endpoint="showItem"} 3.0',
+        'sportsbazar_request_duration_seconds_sum'
+        '{endpoint="showItem"} 20.033']
+
+
+def test_help_type_and_escaped_labels(samples):
+    samples.inc('sportsbazar_requests_total', (
+        ('endpoint', 'a"b\\c\nd'), ('method', 'GET'), ('status', '200')))
+    text = metrics.exposition(metrics.collect())
+    assert '# TYPE sportsbazar_requests_total counter\n' in text
+    assert '# HELP sportsbazar_requests_total Requests handled' in text
+    assert 'sportsbazar_requests_total{endpoint="a\\"b\\\\c\\nd",' \
+        'method="GET",status="200"} 1.0\n' in text
+
+
+def test_processes_are_added_up(samples, tmpdir):
+    app.config['METRICS_DIR'] = str(tmpdir)
+    labels = [['endpoint', 'showItem']]
+    samples.inc('sportsbazar_db_queries_total', (('endpoint', 'showItem'),),
+                2)
+    # An exited worker: its counters are kept, its gauges dropped.
+    writeProcessFile(str(tmpdir), deadPid(),
+                     [['sportsbazar_db_queries_total', labels, 3]],
+                     [['sportsbazar_db_pool_checked_out', [], 7]])
+    totals = metrics.collect()
+    assert totals[('sportsbazar_db_queries_total',
+                   (('endpoint', 'showItem'),))] == 5
+    assert totals.get(('sportsbazar_db_pool_checked_out', ()), 0) < 7
+    # This process' file was written by collect().
+    assert len(tmpdir.listdir()) == 2
+
+
+def test_unreadable_files_are_skipped(samples, tmpdir):
+    app.config['METRICS_DIR'] = str(tmpdir)
+    tmpdir.join('metrics-1-broken.json').write('{')
+    samples.inc('sportsbazar_db_queries_total', (('endpoint', 'x'),))
+    assert metrics.collect()[('sportsbazar_db_queries_total',
+                              (('endpoint', 'x'),))] == 1
+
+
+def test_cache_hit_ratio_is_over_all_processes(samples, tmpdir):
+    app.config['METRICS_DIR'] = str(tmpdir)
+    labels = [['cache', 'test']]
+    writeProcessFile(str(tmpdir), deadPid(),
+                     [['sportsbazar_cache_hits_total', labels, 1],
+                      ['sportsbazar_cache_misses_total', labels, 3]], [])
+    writeProcessFile(str(tmpdir), deadPid(),
+                     [['sportsbazar_cache_hits_total', labels, 5],
+                      ['sportsbazar_cache_misses_total', labels, 1]], [])
+    totals = metrics.collect()
+    assert totals[('sportsbazar_cache_hit_ratio', (('cache', 'test'),))] \
+        == 0.6
+
+
+def test_endpoint(client, samples):
+    app.config['INSTRUMENTATION'] = True
+    try:
+        client.get('/catalog/categories/').get_data()
+        response = client.get('/metrics')
+    finally:
+        app.config['INSTRUMENTATION'] = False
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'sportsbazar_requests_total{endpoint="showCategories",' \
+        'method="GET",status="200"} 1.0' in response.get_data(as_text=True)
+
+
+def test_disabled_endpoint(client):
+    assert client.get('/metrics').status_code == 404
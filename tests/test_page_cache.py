@@ -0,0 +1,103 @@
+"""
+    Rendered category and item pages served from the page cache.
+"""
+
+
+import zlib
+import pytest
+from sportsbazar import app
+from sportsbazar.page_cache import USER_NAV_MARKER
+
+
+def fetch(client, url, **headers):
+    response = client.get(url, headers=headers)
+    response.get_data()
+    return response
+
+
+def html(response):
+    if response.headers.get('Content-Encoding') == 'gzip':
+        # wbits 31: gzip header and trailer.
+        return zlib.decompress(response.get_data(), 31)
+    return response.get_data()
+
+
+@pytest.mark.parametrize('accept_encoding', ['gzip', 'identity'])
+def test_hit_has_the_etag_of_the_miss(client, catalog, accept_encoding):
+    catalog(1, 1)
+    url = '/catalog/Category 0/Item 0-0/'
+    miss = fetch(client, url, **{'Accept-Encoding': accept_encoding})
+    hit = fetch(client, url, **{'Accept-Encoding': accept_encoding})
+    assert 'X-Page-Cache' not in miss.headers
+    assert hit.headers['X-Page-Cache'] == 'hit'
+    assert hit.headers['ETag'] == miss.headers['ETag']
+    assert hit.headers['ETag'].startswith('W/')
+    assert hit.headers.get('Content-Encoding') == \
+        miss.headers.get('Content-Encoding')
+    assert html(hit) == html(miss)
+
+
+def test_hit_revalidates_the_etag_of_the_other_encoding(client, catalog):
+    catalog(1, 1)
+    url = '/catalog/Category 0/Item 0-0/'
+    gzipped = fetch(client, url, **{'Accept-Encoding': 'gzip'})
+    identity = fetch(client, url, **{'Accept-Encoding': 'identity'})
+    assert identity.headers['X-Page-Cache'] == 'hit'
+    assert identity.headers['ETag'] == gzipped.headers['ETag']
+    assert fetch(client, url, **{
+        'Accept-Encoding': 'gzip',
+        'If-None-Match': identity.headers['ETag']}).status_code == 304
+
+
+def signIn(client, name, user_id):
+    with client.session_transaction() as login_session:
+        login_session.update(username=name, email='owner@example.com',
+                             user_id=user_id, picture='')
+
+
+def test_signed_in_hit_shows_its_user(client, catalog):
+    catalog(1, 1)
+    url = '/catalog/Category 0/Item 0-0/'
+    signIn(client, 'First Name', 1)
+    miss = fetch(client, url)
+    signIn(client, 'Second Name', 1)
+    hit = fetch(client, url)
+    assert hit.headers['X-Page-Cache'] == 'hit'
+    assert 'First Name' in html(miss)
+    assert 'Second Name' in html(hit) and 'First Name' not in html(hit)
+    assert USER_NAV_MARKER not in html(miss) + html(hit)
+
+
+def test_edit_replaces_the_cached_page(client, catalog):
+    catalog(1, 1)
+    url = '/catalog/Category 0/Item 0-0/'
+    signIn(client, 'Owner', 1)
+    fetch(client, url)
+    assert fetch(client, url).headers['X-Page-Cache'] == 'hit'
+
+    response = client.post('/catalog/Category 0/Item 0-0/edit', data={
+        'name': 'Item 0-0', 'description': 'Edited description',
+        'price': '', 'quantity': ''})
+    assert response.status_code == 302
+    # Shown with the flashed message, neither read from nor stored in the
+    # cache.
+    flashed = fetch(client, url)
+    assert 'X-Page-Cache' not in flashed.headers
+    assert 'Item successfully updated.' in html(flashed)
+    assert 'Edited description' in html(flashed)
+
+    miss = fetch(client, url)
+    assert 'X-Page-Cache' not in miss.headers
+    assert 'Edited description' in html(miss)
+    hit = fetch(client, url)
+    assert hit.headers['X-Page-Cache'] == 'hit'
+    assert 'Edited description' in html(hit)
+    assert 'Item successfully updated.' not in html(hit)
+
+
+def test_disabled_page_cache(client, catalog, monkeypatch):
+    monkeypatch.setitem(app.config, 'PAGE_CACHE', False)
+    catalog(1, 1)
+    url = '/catalog/Category 0/'
+    fetch(client, url)
+    assert 'X-Page-Cache' not in fetch(client, url).headers
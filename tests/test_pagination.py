@@ -0,0 +1,108 @@
+"""
+    Keyset pagination of the item listings.
+"""
+
+
+import re
+import pytest
+from sportsbazar import app
+
+
+@pytest.fixture
+def pages(client, catalog):
+    """
+        A category of 5 items, 2 to a page by default.
+    """
+    catalog(1, 5)
+    app.config['PAGE_SIZE'] = 2
+    yield client
+    app.config['PAGE_SIZE'] = 50
+
+
+def page(client, **args):
+    response = client.get('/catalog/Category 0/JSON', query_string=args)
+    assert response.status_code == 200
+    return response, response.get_json()
+
+
+def names(payload):
+    return [item['name'] for item in payload['category']['Items']]
+
+
+def test_first_page(pages):
+    response, payload = page(pages)
+    assert names(payload) == ['Item 0-0', 'Item 0-1']
+    assert payload['next_after'] == payload['category']['Items'][1]['id']
+
+
+def test_pages_follow_the_cursor(pages):
+    seen, args = [], {}
+    while True:
+        response, payload = page(pages, **args)
+        seen.extend(names(payload))
+        if payload['next_after'] is None:
+            break
+        args = {'after': payload['next_after']}
+    assert seen == ['Item 0-%d' % number for number in range(5)]
+    # The last page has no link to a next one.
+    assert names(payload) == ['Item 0-4']
+    assert 'Link' not in response.headers
+
+
+def test_link_header(pages):
+    response, payload = page(pages, limit=3)
+    match = re.match(r'^<(.+)>; rel="next"$', response.headers['Link'])
+    assert match is not None
+    url = match.group(1)
+    assert url.startswith('http://localhost/catalog/Category%200/JSON?')
+    assert 'after=%d' % payload['next_after'] in url
+    assert 'limit=3' in url
+    next_page = pages.get(url).get_json()
+    assert names(next_page) == ['Item 0-3', 'Item 0-4']
+
+
+@pytest.mark.parametrize('limit, expected', [
+    (0, 1), (-5, 1), (3, 3), (1000, 4)])
+def test_limit_is_clamped(pages, limit, expected):
+    app.config['PAGE_SIZE_MAX'] = 4
+    try:
+        response, payload = page(pages, limit=limit)
+    finally:
+        app.config['PAGE_SIZE_MAX'] = 500
+    assert len(names(payload)) == expected
+
+
+@pytest.mark.parametrize('after', ['99999999999999999999',
+                                   '-99999999999999999999'])
+def test_huge_cursor(pages, after):
+    response, payload = page(pages, after=after)
+    assert len(names(payload)) == (0 if after[0] != '-' else 2)
+
+
+def test_cursor_past_the_end(pages):
+    response, payload = page(pages, after=10 ** 6)
+    assert names(payload) == []
+    assert payload['next_after'] is None
+
+
+def test_category_page_links_the_next(pages):
+    html = pages.get('/catalog/Category 0/').get_data(as_text=True)
+    assert 'Item 0-1' in html and 'Item 0-2' not in html
+    match = re.search(r'href="([^"]+)">Next page', html)
+    assert match is not None
+    html = pages.get(match.group(1).replace('&amp;', '&')).get_data(
+        as_text=True)
+    assert 'Item 0-2' in html and 'Item 0-1' not in html
+
+
+def test_my_items_pages(pages):
+    with pages.session_transaction() as login_session:
+        login_session.update(username='Owner', email='owner@example.com',
+                             user_id=1)
+    html = pages.get('/catalog/myitems/?limit=3').get_data(as_text=True)
+    assert 'Item 0-2' in html and 'Item 0-3' not in html
+    match = re.search(r'href="([^"]+)">Next page', html)
+    html = pages.get(match.group(1).replace('&amp;', '&')).get_data(
+        as_text=True)
+    assert 'Item 0-4' in html and 'Item 0-2' not in html
+    assert 'Next page' not in html
@@ -0,0 +1,85 @@
+"""
+    Reads from a lagging replica never get cached past the lag.
+"""
+
+
+import shutil
+import pytest
+from sqlalchemy.engine.url import make_url
+from sportsbazar import app
+from sportsbazar.db_connect import db_connect, dispose_engine
+from sportsbazar.db_setup import Category, Item, User
+
+
+def copyToReplica():
+    """
+        Copies the primary over the replica, which then has all the
+        changes committed so far.
+    """
+    dispose_engine()
+    primary = make_url(app.config['DB_URL']).database
+    shutil.copy(primary, primary + '.replica')
+
+
+@pytest.fixture
+def replica(database, catalog):
+    catalog(1, 1)
+    copyToReplica()
+    app.config['DB_REPLICA_URLS'] = [app.config['DB_URL'] + '.replica']
+    yield
+    app.config['DB_REPLICA_URLS'] = []
+    dispose_engine()
+
+
+def addCategory(name):
+    session = db_connect()
+    session.add(Category(name=name, user=session.query(User).first()))
+    session.commit()
+    session.close()
+
+
+def test_cache_is_filled_from_the_primary_after_a_change(client, replica):
+    addCategory('New Category')
+    response = client.get('/catalog/categories/')
+    assert 'New Category' in response.data
+
+    # Past the lag, the list is still the one read from the primary.
+    app.config['DB_READ_YOUR_WRITES'] = 0
+    try:
+        assert 'New Category' in client.get('/catalog/categories/').data
+    finally:
+        app.config['DB_READ_YOUR_WRITES'] = 10
+
+
+def test_replica_is_read_past_the_lag(client, replica):
+    # A category only on the primary, unknown to the process' caches.
+    session = db_connect()
+    session.execute(Category.__table__.insert().values(name='Primary Only'))
+    session.commit()
+    session.close()
+    app.config['DB_READ_YOUR_WRITES'] = 0
+    try:
+        response = client.get('/catalog/categories/')
+    finally:
+        app.config['DB_READ_YOUR_WRITES'] = 10
+    assert 'Primary Only' not in response.data
+
+
+def test_stale_page_is_replaced_when_the_replica_catches_up(client, replica):
+    url = '/catalog/Category 0/'
+    before = client.get(url)
+    session = db_connect()
+    item = session.query(Item).filter_by(name='Item 0-0').one()
+    item.name = 'Renamed Item'
+    session.commit()
+    session.close()
+
+    # The replica still has the old page, with its old ETag.
+    stale = client.get(url)
+    assert 'Item 0-0' in stale.data
+    assert stale.headers['ETag'] == before.headers['ETag']
+
+    copyToReplica()
+    fresh = client.get(url)
+    assert 'Renamed Item' in fresh.data
+    assert fresh.headers['ETag'] != before.headers['ETag']
@@ -0,0 +1,116 @@
+"""
+    Full-text search of the items, with its LIKE fallback.
+"""
+
+
+import pytest
+from sportsbazar import app
+from sportsbazar import db_setup
+from sportsbazar import search
+from sportsbazar.db_connect import db_connect, dispose_engine
+from sportsbazar.db_setup import Category, Item, User
+
+
+@pytest.fixture
+def items(client):
+    """
+        Adds a few items of two categories.
+    """
+    session = db_connect()
+    owner = User(name='Owner', email='owner@example.com')
+    cricket = Category(name='Cricket', user=owner)
+    tennis = Category(name='Tennis', user=owner)
+    for name, description, category in [
+            ('Willow Bat', 'A cricket bat made of willow', cricket),
+            ('Cricket Ball', 'Red leather ball', cricket),
+            ('Tennis Ball', 'Yellow ball for cricket practice', tennis),
+            ('Tennis Racket', 'Carbon racket', tennis)]:
+        session.add(Item(name=name, description=description, price=1,
+                         quantity=1, category=category, user=owner))
+    session.commit()
+    session.close()
+    return client
+
+
+def names(client, **args):
+    response = client.get('/catalog/search/JSON', query_string=args)
+    assert response.status_code == 200
+    return [item['name'] for item in response.get_json()['Items']]
+
+
+def test_name_matches_rank_first(items):
+    found = names(items, q='cricket')
+    assert found[0] == 'Cricket Ball'
+    assert sorted(found[1:]) == ['Tennis Ball', 'Willow Bat']
+
+
+def test_last_word_is_a_prefix(items):
+    assert names(items, q='rack') == ['Tennis Racket']
+    assert names(items, q='tennis rack') == ['Tennis Racket']
+    assert names(items, q='rack tennis') == []
+
+
+def test_category_filter(items):
+    assert names(items, q='ball', category='Tennis') == ['Tennis Ball']
+    assert names(items, q='ball', category='Missing') == []
+
+
+def test_pages(items):
+    first = items.get('/catalog/search/JSON',
+                      query_string={'q': 'ball', 'limit': 1}).get_json()
+    assert first['page'] == 1 and first['next_page'] == 2
+    second = items.get('/catalog/search/JSON', query_string={
+        'q': 'ball', 'limit': 1, 'page': 2}).get_json()
+    assert second['next_page'] is None
+    assert set(item['name'] for item in first['Items'] + second['Items']) \
+        == set(['Cricket Ball', 'Tennis Ball'])
+
+
+@pytest.mark.parametrize('page', [search.MAX_PAGE + 1,
+                                  99999999999999999999])
+def test_pages_past_the_deepest_are_empty(items, page):
+    assert names(items, q='ball', page=page) == []
+
+
+def test_search_page(items):
+    response = items.get('/catalog/search?q=racket')
+    assert response.status_code == 200
+    assert 'Tennis Racket' in response.get_data(as_text=True)
+
+
+def test_search_is_a_reserved_category_name(items):
+    app.config['ADMIN_EMAIL'] = 'owner@example.com'
+    with items.session_transaction() as login_session:
+        login_session.update(username='Owner', email='owner@example.com',
+                             user_id=1)
+    try:
+        response = items.post('/catalog/new', data={'name': 'Search'},
+                              follow_redirects=True)
+    finally:
+        app.config['ADMIN_EMAIL'] = None
+    assert 'Route keywords' in response.get_data(as_text=True)
+    session = db_connect()
+    assert session.query(Category).filter_by(name='Search').count() == 0
+    session.close()
+
+
+def test_like_fallback_without_fts5(database, monkeypatch):
+    dispose_engine()
+    database.execute('DROP TABLE item_fts')
+    for trigger in ('insert', 'delete', 'update'):
+        database.execute('DROP TRIGGER item_fts_%s' % trigger)
+    # An FTS5 module missing from this SQLite build.
+    statements = list(db_setup.SQLITE_SEARCH_DDL)
+    statements[0] = statements[0].replace('fts5', 'fts5_missing')
+    monkeypatch.setattr(db_setup, 'SQLITE_SEARCH_DDL', statements)
+    db_setup.db_migrate(app.config['DB_URL'])
+    assert not db_setup.search_index_exists(database)
+
+    session = db_connect()
+    owner = User(name='Owner', email='owner@example.com')
+    session.add(Item(name='Willow Bat', description='Cricket bat',
+                     category=Category(name='Cricket', user=owner),
+                     user=owner))
+    session.commit()
+    session.close()
+    assert search.searchItems('cricket')[0][0]['name'] == 'Willow Bat'
@@ -0,0 +1,76 @@
+"""
+    Server-side sessions vary the response only when they were read, and
+    get a new id on login.
+"""
+
+
+import pytest
+from flask import session as login_session
+from sportsbazar import app
+from sportsbazar.sessions import StoredSession, renewSession
+
+
+@pytest.fixture
+def interface(database):
+    app.config['SESSION_STORE'] = 'memory'
+    yield app.session_interface
+    app.config['SESSION_STORE'] = 'cookie'
+
+
+def saved(interface, session):
+    response = app.response_class()
+    interface.save_session(app, session, response)
+    return response
+
+
+def stored(interface, data):
+    sid = interface.createSession(app, data)
+    entry = interface.store(app).load(sid)
+    return StoredSession(interface.serializer.loads(entry[0]), sid,
+                         entry[1])
+
+
+def test_unread_session_does_not_vary(interface):
+    session = stored(interface, {'username': 'Someone'})
+    assert 'Cookie' not in saved(interface, session).vary
+
+
+@pytest.mark.parametrize('read', [
+    lambda session: session['username'],
+    lambda session: session.get('username'),
+    lambda session: session.setdefault('username'),
+])
+def test_read_session_varies(interface, read):
+    session = stored(interface, {'username': 'Someone'})
+    read(session)
+    assert 'Cookie' in saved(interface, session).vary
+
+
+def test_renewed_session_gets_new_id(interface):
+    session = stored(interface, {'state': 'STATE'})
+    old_sid = session.sid
+    with app.test_request_context(
+            headers={'Cookie': '%s=%s' % (app.session_cookie_name,
+                                          old_sid)}):
+        app.preprocess_request()
+        assert login_session.sid == old_sid
+        renewSession()
+        login_session['username'] = 'Someone'
+        response = saved(interface, login_session._get_current_object())
+        new_sid = login_session.sid
+
+    assert new_sid not in (None, old_sid)
+    assert interface.store(app).load(old_sid) is None
+    assert interface.serializer.loads(
+        interface.store(app).load(new_sid)[0]) == {'state': 'STATE',
+                                                   'username': 'Someone'}
+    assert '%s=%s' % (app.session_cookie_name, new_sid) in \
+        response.headers['Set-Cookie']
+
+
+def test_renewing_cookie_session_is_noop(database):
+    with app.test_request_context():
+        renewSession()
+        login_session['username'] = 'Someone'
+        assert not isinstance(login_session._get_current_object(),
+                              StoredSession)
@@ -0,0 +1,48 @@
+"""
+    Slow query log: plans, and no session data in the logs.
+"""
+
+
+import logging
+import time
+import pytest
+from sportsbazar import app
+from sportsbazar.db_connect import get_engine
+from sportsbazar.sessions import SqlStore
+from sportsbazar.slow_queries import REDACTED, slow_queries
+
+
+@pytest.fixture
+def everything_slow(database):
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = 0
+    slow_queries.clear()
+    yield
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = None
+    slow_queries.clear()
+
+
+def test_plan_is_captured(everything_slow):
+    get_engine().execute('SELECT id FROM item WHERE name = ?', 'Bat')
+    entry, = [entry for entry in slow_queries.top()
+              if entry['statement'].startswith('SELECT id FROM item')]
+    assert 'item' in entry['plan']
+    assert entry['last_parameters'] == repr(('Bat',))
+
+
+def test_session_data_is_not_logged(everything_slow, caplog):
+    caplog.set_level(logging.DEBUG)
+    SqlStore().save('a' * 32, '{"access_token": "secret-token"}',
+                    time.time() + 60)
+    assert 'secret-token' not in caplog.text
+    entries = [entry for entry in slow_queries.top()
+               if 'web_session' in entry['statement']]
+    assert entries
+    assert all(entry['last_parameters'] == repr(REDACTED)
+               for entry in entries)
+
+
+def test_parameters_are_only_logged_at_debug_level(everything_slow, caplog):
+    caplog.set_level(logging.INFO)
+    get_engine().execute('SELECT id FROM item WHERE name = ?', 'Bat-1234')
+    assert 'Slow query' in caplog.text
+    assert 'Bat-1234' not in caplog.text
@@ -0,0 +1,120 @@
+"""
+    SQLite files are opened with the SQLITE_PRAGMAS and written by one
+    transaction at a time.
+"""
+
+
+import sys
+import threading
+import pytest
+from sportsbazar import app
+from sportsbazar.db_connect import db_connect
+from sportsbazar.db_setup import Category, User
+
+
+connection_module = sys.modules['sportsbazar.db_connect']
+
+
+def pragma(engine, name):
+    return engine.execute('PRAGMA %s' % name).scalar()
+
+
+def test_pragmas(database):
+    assert pragma(database, 'journal_mode') == 'wal'
+    # NORMAL
+    assert pragma(database, 'synchronous') == 1
+    assert pragma(database, 'busy_timeout') == 5000
+    # MEMORY
+    assert pragma(database, 'temp_store') == 2
+    assert pragma(database, 'cache_size') == -65536
+
+
+def isWriterLockFree():
+    if not connection_module._writer_lock.acquire(False):
+        return False
+    connection_module._writer_lock.release()
+    return True
+
+
+@pytest.fixture(autouse=True)
+def writerLock():
+    """
+        Fails the test that leaks the writer lock, and releases it so that
+        the next tests can write.
+    """
+    yield connection_module._writer_lock
+    if not isWriterLockFree():
+        connection_module._writer_lock.release()
+        pytest.fail('The writer lock was not released.')
+
+
+def addUser(email):
+    session = db_connect()
+    session.add(User(name='User', email=email))
+    session.commit()
+    session.close()
+
+
+def writeInThread(email):
+    """
+        Writes from another thread, returns whether it could.
+    """
+    thread = threading.Thread(target=addUser, args=(email,))
+    thread.daemon = True
+    thread.start()
+    thread.join(10)
+    return not thread.is_alive()
+
+
+def test_reads_do_not_take_the_lock(database):
+    session = db_connect()
+    session.query(User).all()
+    assert isWriterLockFree()
+    session.close()
+
+
+def test_lock_is_held_until_commit(database):
+    session = db_connect()
+    session.add(User(name='User', email='user@example.com'))
+    session.flush()
+    assert not isWriterLockFree()
+    session.commit()
+    assert isWriterLockFree()
+    session.close()
+
+
+def test_lock_is_released_by_rollback(database):
+    session = db_connect()
+    session.add(User(name='User', email='user@example.com'))
+    session.flush()
+    session.rollback()
+    assert isWriterLockFree()
+    session.close()
+
+
+@pytest.mark.parametrize('cleanup', ['rollback', 'close'])
+def test_error_between_flush_and_commit(database, cleanup):
+    session = db_connect()
+    try:
+        session.add(Category(name='Category'))
+        session.flush()
+        raise ValueError('failed before the commit')
+    except ValueError:
+        getattr(session, cleanup)()
+    assert writeInThread('other@example.com')
+    session.close()
+    assert db_connect().query(User).count() == 1
+
+
+def test_error_in_a_request_releases_the_lock(database, monkeypatch):
+    def failingView():
+        session = db_connect()
+        session.add(Category(name='Category'))
+        session.flush()
+        raise ValueError('failed before the commit')
+    monkeypatch.setitem(app.view_functions, 'showCategories', failingView)
+    monkeypatch.setitem(app.config, 'PROPAGATE_EXCEPTIONS', False)
+    response = app.test_client().get('/catalog/categories/')
+    assert response.status_code == 500
+    assert isWriterLockFree()
+    assert writeInThread('other@example.com')
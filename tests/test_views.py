@@ -0,0 +1,97 @@
+"""
+    The category and item pages run a fixed number of queries, and answer
+    404 for names that are not in the catalog.
+"""
+
+
+import pytest
+from sportsbazar import app
+
+
+@pytest.fixture
+def owner(client):
+    with client.session_transaction() as login_session:
+        login_session.update(username='Owner', email='owner@example.com',
+                             user_id=1)
+    return client
+
+
+@pytest.fixture
+def uncached(database):
+    app.config['PAGE_CACHE'] = False
+    yield
+    app.config['PAGE_CACHE'] = True
+
+
+def warmQueries(client, queries, url):
+    """
+        Returns the number of queries of url once the caches are warm.
+    """
+    client.get(url).get_data()
+    queries.reset()
+    response = client.get(url)
+    assert response.status_code == 200
+    # Streamed bodies run their queries while they are read.
+    response.get_data()
+    return queries.count
+
+
+# The validator of the category, then the page's own lookup if it is not
+# served from the catalog cache.
+@pytest.mark.parametrize('url, expected', [
+    ('/catalog/Category 0/', 2),
+    ('/catalog/Category 0/Item 0-0/', 2),
+    ('/catalog/Category 0/JSON', 1),
+    ('/catalog/Category 0/Item 0-0/JSON', 1),
+])
+def test_read_query_count(client, uncached, catalog, queries, url,
+                          expected):
+    catalog(1, 3)
+    assert warmQueries(client, queries, url) == expected
+    catalog(9, 30)
+    assert warmQueries(client, queries, url) == expected
+
+
+@pytest.mark.parametrize('action', ['edit', 'delete'])
+def test_owner_form_query_count(owner, catalog, queries, action):
+    catalog(3, 3)
+    url = '/catalog/Category 0/Item 0-0/%s' % action
+    assert warmQueries(owner, queries, url) == 1
+
+
+@pytest.mark.parametrize('url', [
+    '/catalog/Missing/',
+    '/catalog/Missing/Item 0-0/',
+    '/catalog/Category 0/Missing/',
+    '/catalog/Category 1/Item 0-0/',
+])
+def test_html_not_found(client, catalog, url):
+    catalog(2, 1)
+    response = client.get(url)
+    assert response.status_code == 404
+    assert response.mimetype == 'text/html'
+
+
+@pytest.mark.parametrize('url', [
+    '/catalog/Missing/JSON',
+    '/catalog/Missing/Item 0-0/JSON',
+    '/catalog/Category 0/Missing/JSON',
+    '/catalog/Category 1/Item 0-0/JSON',
+])
+def test_json_not_found(client, catalog, url):
+    catalog(2, 1)
+    response = client.get(url)
+    assert response.status_code == 404
+    assert response.get_json()['error'] == 'Not Found'
+
+
+@pytest.mark.parametrize('action', ['edit', 'delete'])
+@pytest.mark.parametrize('path', [
+    'Missing/Item 0-0',
+    'Category 0/Missing',
+    'Category 1/Item 0-0',
+])
+def test_owner_form_not_found(owner, catalog, action, path):
+    catalog(2, 1)
+    response = owner.get('/catalog/%s/%s' % (path, action))
+    assert response.status_code == 404